@@ -0,0 +1,214 @@
+"""Measure ingestion throughput and caller-side overhead against a local stub server.
+
+Drives the low-level client (`trace`/`span`/`generation`), the `@observe` decorator and the OpenAI integration
+at a controlled rate and reports per scenario:
+
+- delivered events/s from the first call until `flush()` returns
+- caller-side time per enqueued event, i.e. the time spent in the SDK on the calling thread
+- p50/p99 latency of `add_task`
+- memory growth (traced allocations with --trace-memory, otherwise the growth of the peak RSS)
+- dropped events by reason
+
+The OpenAI scenario calls the chat completions stub over HTTP, its caller-side time includes that round trip.
+
+Usage:
+    python -m benchmarks.bench_ingestion [--scenario all] [--operations 2000] [--rate 0]
+        [--latency 0.05] [--error-rate 0.0] [--threads 1] [--flush-at 15]
+"""
+
+import argparse
+import logging
+import resource
+import statistics
+import time
+import tracemalloc
+
+from benchmarks.stub_server import StubServer
+from langfuse import Langfuse
+from langfuse.decorators import observe
+from langfuse.utils.langfuse_singleton import LangfuseSingleton
+
+
+def run_client(langfuse: Langfuse, i: int):
+    trace = langfuse.trace(name="bench-trace", user_id="user", input={"i": i})
+    span = trace.span(name="bench-span", input={"query": "What is Langfuse?"})
+    span.generation(
+        name="bench-generation",
+        model="gpt-3.5-turbo",
+        input=[{"role": "user", "content": "What is Langfuse?"}],
+        output="An LLM engineering platform.",
+        usage={"input": 12, "output": 5},
+    ).end()
+    span.end()
+
+
+@observe(as_type="generation")
+def generate(query: str):
+    return "An LLM engineering platform."
+
+
+@observe()
+def retrieve(query: str):
+    return ["doc-1", "doc-2"]
+
+
+@observe()
+def answer(query: str):
+    retrieve(query)
+    return generate(query)
+
+
+def run_observe(langfuse: Langfuse, i: int):
+    answer(f"What is Langfuse? {i}")
+
+
+def make_run_openai(server: StubServer):
+    from langfuse.openai import openai
+
+    client = openai.OpenAI(api_key="sk-stub", base_url=f"{server.url}/v1")
+
+    def run_openai(langfuse: Langfuse, i: int):
+        client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=[{"role": "user", "content": f"What is Langfuse? {i}"}],
+        )
+
+    return run_openai
+
+
+def percentile(samples, q: float) -> float:
+    if not samples:
+        return 0.0
+
+    return statistics.quantiles(samples, n=100, method="inclusive")[q - 1]
+
+
+def run_scenario(name: str, operation, server: StubServer, args) -> dict:
+    server.reset()
+
+    langfuse = Langfuse(
+        public_key="pk-lf-bench",
+        secret_key="sk-lf-bench",
+        host=server.url,
+        threads=args.threads,
+        flush_at=args.flush_at,
+        flush_interval=args.flush_interval,
+        max_retries=args.max_retries,
+    )
+    # the decorator and the OpenAI integration use the shared client
+    LangfuseSingleton()._langfuse = langfuse
+    # failed uploads are reported as failed batches instead of logged tracebacks
+    logging.getLogger("langfuse").setLevel(logging.CRITICAL)
+    logging.getLogger("backoff").setLevel(logging.CRITICAL)
+
+    enqueue_latencies = []
+    add_task = langfuse.task_manager.add_task
+
+    def timed_add_task(event):
+        start = time.perf_counter()
+        result = add_task(event)
+        enqueue_latencies.append(time.perf_counter() - start)
+
+        return result
+
+    langfuse.task_manager.add_task = timed_add_task
+
+    if args.trace_memory:
+        tracemalloc.start()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    caller_time = 0.0
+    start = time.perf_counter()
+    for i in range(args.operations):
+        if args.rate > 0:
+            delay = start + i / args.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        operation_start = time.perf_counter()
+        operation(langfuse, i)
+        caller_time += time.perf_counter() - operation_start
+
+    langfuse.flush()
+    elapsed = time.perf_counter() - start
+
+    if args.trace_memory:
+        memory_growth = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    else:
+        # ru_maxrss is in kilobytes on Linux
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        memory_growth = (rss_after - rss_before) * 1024
+
+    langfuse.shutdown()
+    LangfuseSingleton().reset()
+
+    enqueued = len(enqueue_latencies)
+
+    return {
+        "scenario": name,
+        "enqueued": enqueued,
+        "received": server.received_events,
+        "events_per_second": server.received_events / elapsed,
+        "caller_us_per_event": caller_time / max(enqueued, 1) * 1e6,
+        "enqueue_p50_us": percentile(enqueue_latencies, 50) * 1e6,
+        "enqueue_p99_us": percentile(enqueue_latencies, 99) * 1e6,
+        "memory_growth_kb": memory_growth / 1024,
+        "failed_batches": server.failed_batches,
+        "dropped": langfuse.task_manager.get_stats()["dropped"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scenario", choices=["all", "client", "observe", "openai"], default="all"
+    )
+    parser.add_argument("--operations", type=int, default=2000)
+    parser.add_argument(
+        "--rate", type=float, default=0, help="operations per second, 0 for no limit"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="stub response time in seconds"
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--flush-at", type=int, default=15)
+    parser.add_argument("--flush-interval", type=float, default=0.5)
+    parser.add_argument("--max-retries", type=int, default=3)
+    parser.add_argument("--trace-memory", action="store_true")
+    args = parser.parse_args()
+
+    server = StubServer(latency=args.latency, error_rate=args.error_rate).start()
+
+    scenarios = {
+        "client": run_client,
+        "observe": run_observe,
+        "openai": None,
+    }
+    if args.scenario != "all":
+        scenarios = {args.scenario: scenarios[args.scenario]}
+
+    try:
+        for name, operation in scenarios.items():
+            if operation is None:
+                operation = make_run_openai(server)
+
+            result = run_scenario(name, operation, server, args)
+            print(
+                f"{result['scenario']:<8} "
+                f"{result['received']:>7}/{result['enqueued']:<7} events  "
+                f"{result['events_per_second']:>9,.0f} events/s  "
+                f"caller {result['caller_us_per_event']:>7.1f} us/event  "
+                f"enqueue p50 {result['enqueue_p50_us']:>6.1f} us "
+                f"p99 {result['enqueue_p99_us']:>7.1f} us  "
+                f"memory +{result['memory_growth_kb']:,.0f} KB  "
+                f"failed batches {result['failed_batches']}  "
+                f"dropped {result['dropped']}"
+            )
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
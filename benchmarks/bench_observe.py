@@ -0,0 +1,168 @@
+"""Measure the per-call overhead of the `@observe` decorator.
+
+Times a trivial function called directly and through `@observe` for sync functions, async functions and
+generators, both as the top-level trace and nested one level below it, and for `deferred=True` observations that
+are sent as a single event. The overhead is the difference to the
+undecorated call, in microseconds per call. Events are uploaded to a local stub server by the consumer thread
+in the background, as in production.
+
+Usage:
+    python -m benchmarks.bench_observe [--calls 2000] [--repeat 5]
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+from benchmarks.stub_server import StubServer
+from langfuse import Langfuse
+from langfuse.decorators import observe
+from langfuse.utils.langfuse_singleton import LangfuseSingleton
+
+
+def add(a, b):
+    return a + b
+
+
+async def async_add(a, b):
+    return a + b
+
+
+def count(n):
+    yield from range(n)
+
+
+observed_add = observe()(add)
+observed_async_add = observe()(async_add)
+observed_count = observe()(count)
+deferred_add = observe(deferred=True)(add)
+
+
+@observe()
+def parent(func, calls: int):
+    for i in range(calls):
+        func(i, 1)
+
+
+@observe()
+async def async_parent(func, calls: int):
+    for i in range(calls):
+        await func(i, 1)
+
+
+@observe()
+def generator_parent(func, calls: int):
+    for _ in range(calls):
+        for _ in func(3):
+            pass
+
+
+def top_level(func, calls: int):
+    for i in range(calls):
+        func(i, 1)
+
+
+async def async_top_level(func, calls: int):
+    for i in range(calls):
+        await func(i, 1)
+
+
+def generator_top_level(func, calls: int):
+    for _ in range(calls):
+        for _ in func(3):
+            pass
+
+
+def best_of(run, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def make_client(server: StubServer) -> Langfuse:
+    # large batches keep the consumer thread mostly idle while the calls are timed
+    langfuse = Langfuse(
+        public_key="pk-lf-bench",
+        secret_key="sk-lf-bench",
+        host=server.url,
+        flush_at=1_000,
+        flush_interval=10,
+    )
+    logging.getLogger("langfuse").setLevel(logging.CRITICAL)
+    LangfuseSingleton()._langfuse = langfuse
+
+    return langfuse
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=2_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    server = StubServer().start()
+    langfuse = make_client(server)
+    calls = args.calls
+
+    scenarios = [
+        ("sync", lambda: top_level(add, calls), lambda: top_level(observed_add, calls)),
+        (
+            "sync nested",
+            lambda: top_level(add, calls),
+            lambda: parent(observed_add, calls),
+        ),
+        (
+            "sync deferred",
+            lambda: top_level(add, calls),
+            lambda: top_level(deferred_add, calls),
+        ),
+        (
+            "nested deferred",
+            lambda: top_level(add, calls),
+            lambda: parent(deferred_add, calls),
+        ),
+        (
+            "async",
+            lambda: asyncio.run(async_top_level(async_add, calls)),
+            lambda: asyncio.run(async_top_level(observed_async_add, calls)),
+        ),
+        (
+            "async nested",
+            lambda: asyncio.run(async_top_level(async_add, calls)),
+            lambda: asyncio.run(async_parent(observed_async_add, calls)),
+        ),
+        (
+            "generator",
+            lambda: generator_top_level(count, calls),
+            lambda: generator_top_level(observed_count, calls),
+        ),
+        (
+            "gen nested",
+            lambda: generator_top_level(count, calls),
+            lambda: generator_parent(observed_count, calls),
+        ),
+    ]
+
+    try:
+        for name, baseline, observed in scenarios:
+            baseline_time = best_of(baseline, args.repeat)
+            observed_time = best_of(observed, args.repeat)
+            print(
+                f"{name:<15} "
+                f"plain {baseline_time / calls * 1e6:>6.2f} us/call  "
+                f"observed {observed_time / calls * 1e6:>7.2f} us/call  "
+                f"overhead {(observed_time - baseline_time) / calls * 1e6:>7.2f} us/call"
+            )
+    finally:
+        langfuse.shutdown()
+        LangfuseSingleton().reset()
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Measure the per-chunk overhead of tracing a streamed OpenAI chat completion.
+
+Replays a synthetic stream of chat completion chunks through the Langfuse streaming wrapper and compares it
+to iterating the chunks directly. The overhead is the difference in microseconds per chunk, including
+accumulating the output and enqueueing the generation update at the end of the stream. Events are uploaded to a
+local stub server.
+
+Usage:
+    python -m benchmarks.bench_openai_stream [--chunks 2000] [--repeat 5]
+"""
+
+import argparse
+import logging
+import time
+
+from openai.types.chat import ChatCompletionChunk
+
+from benchmarks.stub_server import StubServer
+from langfuse import Langfuse
+from langfuse.openai import (
+    OPENAI_METHODS_V1,
+    _get_langfuse_data_from_sync_streaming_response,
+)
+
+CHAT = OPENAI_METHODS_V1[0]
+
+
+def make_chunks(count: int):
+    def chunk(delta):
+        return ChatCompletionChunk(
+            id="chatcmpl-bench",
+            object="chat.completion.chunk",
+            created=0,
+            model="gpt-3.5-turbo",
+            choices=[{"index": 0, "delta": delta, "finish_reason": None}],
+        )
+
+    return [chunk({"role": "assistant", "content": ""})] + [
+        chunk({"content": f"token{i} "}) for i in range(count - 1)
+    ]
+
+
+def best_of(run, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=2_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    server = StubServer().start()
+    langfuse = Langfuse(
+        public_key="pk-lf-bench",
+        secret_key="sk-lf-bench",
+        host=server.url,
+        flush_at=1_000,
+        flush_interval=10,
+    )
+    logging.getLogger("langfuse").setLevel(logging.CRITICAL)
+
+    chunks = make_chunks(args.chunks)
+
+    def plain():
+        for _ in iter(chunks):
+            pass
+
+    def traced():
+        generation = langfuse.generation(name="bench", model="gpt-3.5-turbo")
+        stream = _get_langfuse_data_from_sync_streaming_response(
+            CHAT, iter(chunks), generation, langfuse, True
+        )
+        for _ in stream:
+            pass
+
+    try:
+        plain_time = best_of(plain, args.repeat)
+        traced_time = best_of(traced, args.repeat)
+        print(
+            f"{args.chunks} chunks  "
+            f"plain {plain_time * 1e3:>7.2f} ms  "
+            f"traced {traced_time * 1e3:>7.2f} ms  "
+            f"overhead {(traced_time - plain_time) / args.chunks * 1e6:>6.2f} us/chunk"
+        )
+    finally:
+        langfuse.shutdown()
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Compare the event serializer backends.
+
+Checks that `serialize` produces the same JSON as `json.dumps(..., cls=EventSerializer)` for representative
+ingestion events and reports the throughput of both.
+
+Usage:
+    python -m benchmarks.bench_serializer [--events 2000] [--repeat 5]
+"""
+
+import argparse
+import json
+import time
+import uuid
+from datetime import datetime, timezone
+
+from langfuse.serializer import EventSerializer, orjson, serialize
+
+
+def make_event(size: int) -> dict:
+    now = datetime.now(timezone.utc)
+    return {
+        "id": str(uuid.uuid4()),
+        "type": "generation-create",
+        "timestamp": now,
+        "body": {
+            "id": str(uuid.uuid4()),
+            "traceId": str(uuid.uuid4()),
+            "name": "OpenAI-generation",
+            "startTime": now,
+            "model": "gpt-3.5-turbo",
+            "modelParameters": {"temperature": 1, "top_p": 1},
+            "input": [
+                {"role": "system", "content": "You are a helpful assistant. " * size},
+                {
+                    "role": "user",
+                    "content": "Summarize the following document. " * size,
+                },
+            ],
+            "output": {"role": "assistant", "content": "The document says. " * size},
+            "metadata": {
+                "user": uuid.uuid4(),
+                "tags": ["a", "b"],
+                "nested": {"x": [1, 2, 3]},
+            },
+        },
+    }
+
+
+def measure(func, events, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for event in events:
+            func(event)
+        best = min(best, time.perf_counter() - start)
+
+    return len(events) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    def stdlib(event):
+        return json.dumps(event, cls=EventSerializer).encode("utf-8")
+
+    print(f"orjson installed: {orjson is not None}")
+
+    for size in (1, 100, 1000):
+        events = [make_event(size) for _ in range(args.events)]
+
+        for event in events:
+            assert json.loads(serialize(event)) == json.loads(stdlib(event))
+
+        baseline = measure(stdlib, events, args.repeat)
+        fast = measure(serialize, events, args.repeat)
+        print(
+            f"payload x{size:<5} EventSerializer {baseline:>10,.0f} events/s  "
+            f"serialize {fast:>10,.0f} events/s  speedup {fast / baseline:.1f}x  (output parity ok)"
+        )
+
+
+if __name__ == "__main__":
+    main()
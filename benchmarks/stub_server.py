@@ -0,0 +1,118 @@
+"""Local stub of the Langfuse ingestion API and the OpenAI chat completions API for benchmarks."""
+
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHAT_COMPLETION = {
+    "id": "chatcmpl-stub",
+    "object": "chat.completion",
+    "created": 1700000000,
+    "model": "gpt-3.5-turbo",
+    "choices": [
+        {
+            "index": 0,
+            "message": {"role": "assistant", "content": "Hello from the stub."},
+            "finish_reason": "stop",
+            "logprobs": None,
+        }
+    ],
+    "usage": {"prompt_tokens": 12, "completion_tokens": 5, "total_tokens": 17},
+}
+
+
+class StubServer:
+    """Threaded HTTP server answering ingestion requests with a configurable latency and error rate.
+
+    Ingestion responses are delayed by `latency` seconds and fail with a 500 with probability `error_rate`,
+    only successful requests are counted as received.
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.received_events = 0
+        self.received_batches = 0
+        self.received_bytes = 0
+        self.failed_batches = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.received_events = 0
+            self.received_batches = 0
+            self.received_bytes = 0
+            self.failed_batches = 0
+
+    def _record_ingestion(self, body: bytes, encoding: str) -> int:
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        with self._lock:
+            if self._random.random() < self.error_rate:
+                self.failed_batches += 1
+                return 500
+
+            self.received_bytes += len(body)
+            if encoding == "gzip":
+                body = gzip.decompress(body)
+            self.received_batches += 1
+            # zstd bodies are counted as batches and bytes only
+            if encoding != "zstd":
+                self.received_events += len(json.loads(body)["batch"])
+
+        return 200
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+                if self.path == "/api/public/ingestion":
+                    status = stub._record_ingestion(
+                        body, self.headers.get("Content-Encoding", "")
+                    )
+                    self._respond(status, {"successes": [], "errors": []})
+                elif self.path.endswith("/chat/completions"):
+                    self._respond(200, CHAT_COMPLETION)
+                else:
+                    self._respond(404, {"message": "not found"})
+
+            def _respond(self, status: int, payload: dict):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -1,5 +1,5 @@
 """.. include:: ../README.md
 """
 
-from .client import Langfuse  # noqa
+from .client import Langfuse, AsyncLangfuse  # noqa
 from .version import __version__  # noqa
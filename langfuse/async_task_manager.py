@@ -0,0 +1,544 @@
+"""@private
+"""
+
+import asyncio
+import logging
+import threading
+import typing
+from datetime import datetime, timezone
+from typing import Any, List
+
+import backoff
+
+from langfuse.request import APIErrors, AsyncLangfuseClient, PreparedRequest
+from langfuse.stats import DEFAULT_STATS_INTERVAL, IngestionStats, StatsReporter
+from langfuse.tail_sampling import TailSamplingBuffer, TailSamplingTimer
+from langfuse.task_manager import (
+    BATCH_SIZE_LIMIT,
+    AdaptiveBatchPolicy,
+    DropCounter,
+    LangfuseMetadata,
+    _encode_event,
+    _prepare_item,
+)
+
+
+class AsyncConsumer:
+    """Consumer task running on the event loop, the asyncio counterpart of `Consumer`."""
+
+    _log = logging.getLogger("langfuse")
+    _queue: asyncio.Queue
+    _identifier: int
+    _client: AsyncLangfuseClient
+    _flush_at: int
+    _flush_interval: float
+    _max_retries: int
+    _public_key: str
+    _sdk_name: str
+    _sdk_version: str
+    _sdk_integration: str
+    _drop_counter: DropCounter
+    _stats: IngestionStats
+    _max_in_flight_batches: int
+    _upload_tasks: typing.Set[asyncio.Task]
+
+    def __init__(
+        self,
+        queue: asyncio.Queue,
+        identifier: int,
+        client: AsyncLangfuseClient,
+        flush_at: int,
+        flush_interval: float,
+        max_retries: int,
+        public_key: str,
+        sdk_name: str,
+        sdk_version: str,
+        sdk_integration: str,
+        drop_counter: DropCounter,
+        max_in_flight_batches: int = 1,
+        batch_policy: typing.Optional[AdaptiveBatchPolicy] = None,
+        stats: typing.Optional[IngestionStats] = None,
+    ):
+        self._queue = queue
+        self.running = True
+        self._identifier = identifier
+        self._client = client
+        self._flush_at = flush_at
+        self._flush_interval = flush_interval
+        self._max_retries = max_retries
+        self._public_key = public_key
+        self._sdk_name = sdk_name
+        self._sdk_version = sdk_version
+        self._sdk_integration = sdk_integration
+        self._drop_counter = drop_counter
+        self._stats = stats or IngestionStats()
+        self._max_in_flight_batches = max_in_flight_batches
+        self._in_flight = None
+        self._upload_tasks = set()
+        self._batch_policy = batch_policy
+
+    def get_stats(self) -> dict:
+        """Return the effective batch settings of this consumer."""
+        if self._batch_policy is not None:
+            return self._batch_policy.get_stats()
+
+        return {
+            "adaptive": False,
+            "flush_at": self._flush_at,
+            "flush_interval": self._flush_interval,
+        }
+
+    async def _next(self, items: List[bytes]):
+        """Collect the next batch of items to upload into `items`."""
+        loop = asyncio.get_running_loop()
+        if self._batch_policy is not None:
+            flush_at, flush_interval = self._batch_policy.get_settings()
+        else:
+            flush_at, flush_interval = self._flush_at, self._flush_interval
+
+        start_time = loop.time()
+        total_size = 0
+
+        while len(items) < flush_at:
+            elapsed = loop.time() - start_time
+            if elapsed >= flush_interval:
+                break
+            try:
+                item = await asyncio.wait_for(
+                    self._queue.get(), timeout=flush_interval - elapsed
+                )
+            except asyncio.TimeoutError:
+                break
+
+            item = _prepare_item(item, self._drop_counter)
+            if item is None:
+                self._queue.task_done()
+                continue
+
+            items.append(item)
+            total_size += len(item)
+            if total_size >= BATCH_SIZE_LIMIT:
+                self._log.debug("hit batch size limit (size: %d)", total_size)
+                break
+
+        if self._batch_policy is not None and len(items) > 0:
+            self._batch_policy.record_batch(len(items), self._queue.qsize())
+
+    async def run(self):
+        """Runs the consumer."""
+        self._log.debug(f"async consumer {self._identifier} is running...")
+        # created here as it binds to the running loop on older Python versions
+        self._in_flight = asyncio.Semaphore(self._max_in_flight_batches)
+        while self.running:
+            await self.upload()
+
+    async def upload(self):
+        """Start uploading the next batch of items while the next batch is collected."""
+        batch = []
+        try:
+            await self._next(batch)
+            if len(batch) == 0:
+                return
+
+            # waits while max_in_flight_batches batches are being uploaded
+            await self._in_flight.acquire()
+        except asyncio.CancelledError:
+            # the consumer is stopped by join, the items already taken from the queue are still uploaded
+            if batch:
+                self._start_upload(batch)
+            raise
+
+        task = self._start_upload(batch)
+        task.add_done_callback(lambda _: self._in_flight.release())
+
+    def _start_upload(self, batch: List[bytes]) -> asyncio.Task:
+        task = asyncio.get_running_loop().create_task(
+            self._upload_and_acknowledge(batch)
+        )
+        self._upload_tasks.add(task)
+        task.add_done_callback(self._upload_tasks.discard)
+
+        return task
+
+    async def _upload_and_acknowledge(self, batch: List[bytes]):
+        try:
+            await self._upload_batch(batch)
+        except Exception as e:
+            self._log.exception("error uploading: %s", e)
+        finally:
+            # mark items as acknowledged from queue
+            for _ in batch:
+                self._queue.task_done()
+
+    def pause(self):
+        """Pause the consumer."""
+        self.running = False
+
+    async def _upload_batch(self, batch: List[bytes]):
+        self._log.debug("uploading batch of %d items", len(batch))
+
+        metadata = LangfuseMetadata(
+            batch_size=len(batch),
+            sdk_integration=self._sdk_integration,
+            sdk_name=self._sdk_name,
+            sdk_version=self._sdk_version,
+            public_key=self._public_key,
+        ).dict()
+
+        @backoff.on_exception(
+            backoff.expo,
+            Exception,
+            max_tries=self._max_retries,
+            on_backoff=lambda _: self._stats.record_retry(),
+        )
+        async def execute_task_with_backoff(request: PreparedRequest):
+            try:
+                return await self._client.batch_post(request)
+            except APIErrors as e:
+                self._stats.record_partial_errors(len(e.errors))
+                raise
+
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        try:
+            # encoded and compressed once, retries send the same bytes
+            request = self._client.prepare_batch(batch=batch, metadata=metadata)
+            await execute_task_with_backoff(request)
+        except Exception:
+            self._stats.record_failed_upload(len(batch))
+            raise
+
+        latency = loop.time() - start_time
+        self._stats.record_upload(len(batch), sum(map(len, batch)), latency)
+        if self._batch_policy is not None:
+            self._batch_policy.record_upload(latency)
+
+        self._log.debug("successfully uploaded batch of %d items", len(batch))
+
+
+class AsyncTaskManager(object):
+    """Batches events on an `asyncio.Queue` and uploads them from consumer tasks on the event loop.
+
+    `add_task` is synchronous so that the stateful clients can be shared with `TaskManager`. It can be called
+    from the event loop or from other threads; events added before the loop is known are buffered until the
+    first call from within a running loop. When the loop is closed, e.g. between two `asyncio.run` calls, the
+    manager binds to the next running loop and keeps the events that were not uploaded yet.
+    """
+
+    _log = logging.getLogger("langfuse")
+    _consumers: List[AsyncConsumer]
+    _consumer_tasks: List[asyncio.Task]
+    _num_consumers: int
+    _max_task_queue_size: int
+    _queue: typing.Optional[asyncio.Queue]
+    _loop: typing.Optional[asyncio.AbstractEventLoop]
+    _pending: List[Any]
+    _lock: threading.Lock
+    _client: AsyncLangfuseClient
+    _flush_at: int
+    _flush_interval: float
+    _max_retries: int
+    _public_key: str
+    _sdk_name: str
+    _sdk_version: str
+    _sdk_integration: str
+    _drop_counter: DropCounter
+    _stats: IngestionStats
+    _stats_reporter: typing.Optional[StatsReporter]
+    _max_in_flight_batches: int
+    _adaptive_batching: bool
+    _tail_sampling: typing.Optional[TailSamplingBuffer]
+    _tail_sampling_timer: typing.Optional[TailSamplingTimer]
+    _flush_callbacks: List[typing.Callable[[typing.Optional[str]], typing.Any]]
+
+    def __init__(
+        self,
+        client: AsyncLangfuseClient,
+        flush_at: int,
+        flush_interval: float,
+        max_retries: int,
+        consumers: int,
+        public_key: str,
+        sdk_name: str,
+        sdk_version: str,
+        sdk_integration: str,
+        max_task_queue_size: int = 100_000,
+        max_in_flight_batches: int = 1,
+        adaptive_batching: bool = False,
+        stats_callback: typing.Optional[typing.Callable[[dict], typing.Any]] = None,
+        stats_interval: float = DEFAULT_STATS_INTERVAL,
+        tail_sampling: typing.Optional[TailSamplingBuffer] = None,
+    ):
+        self._max_task_queue_size = max_task_queue_size
+        self._num_consumers = consumers
+        self._queue = None
+        self._loop = None
+        self._pending = []
+        # guards binding to a loop and the events buffered while no loop is bound
+        self._lock = threading.Lock()
+        self._consumers = []
+        self._consumer_tasks = []
+        self._client = client
+        self._flush_at = flush_at
+        self._flush_interval = flush_interval
+        self._max_retries = max_retries
+        self._public_key = public_key
+        self._sdk_name = sdk_name
+        self._sdk_version = sdk_version
+        self._sdk_integration = sdk_integration
+        self._drop_counter = DropCounter()
+        self._stats = IngestionStats()
+        self._max_in_flight_batches = max_in_flight_batches
+        self._adaptive_batching = adaptive_batching
+        self._flush_callbacks = []
+        self._tail_sampling = tail_sampling
+        self._tail_sampling_timer = None
+        if tail_sampling is not None:
+            self._tail_sampling_timer = TailSamplingTimer(
+                self._release_expired, tail_sampling.check_interval
+            )
+            self._tail_sampling_timer.start()
+
+        # the reporter runs on its own thread so that a slow exporter does not block the event loop
+        self._stats_reporter = None
+        if stats_callback is not None:
+            self._stats_reporter = StatsReporter(
+                self.get_stats, stats_callback, stats_interval
+            )
+            self._stats_reporter.start()
+
+    def _ensure_started(self) -> bool:
+        """Bind to the running event loop and start the consumers, return whether the caller is on that loop."""
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            with self._lock:
+                if self._loop is not None and self._loop.is_closed():
+                    self._unbind()
+
+                if self._loop is None:
+                    if running_loop is None:
+                        return False
+
+                    self._bind(running_loop)
+                    pending, self._pending = self._pending, []
+                else:
+                    pending = []
+
+            for item in pending:
+                self._put(item)
+
+        return running_loop is self._loop
+
+    def _bind(self, running_loop: asyncio.AbstractEventLoop):
+        """Create the queue and start the consumers on the running loop."""
+        self._loop = running_loop
+        self._queue = asyncio.Queue(self._max_task_queue_size)
+        for i in range(self._num_consumers):
+            consumer = AsyncConsumer(
+                queue=self._queue,
+                identifier=i,
+                client=self._client,
+                flush_at=self._flush_at,
+                flush_interval=self._flush_interval,
+                max_retries=self._max_retries,
+                public_key=self._public_key,
+                sdk_name=self._sdk_name,
+                sdk_version=self._sdk_version,
+                sdk_integration=self._sdk_integration,
+                drop_counter=self._drop_counter,
+                max_in_flight_batches=self._max_in_flight_batches,
+                batch_policy=AdaptiveBatchPolicy(self._flush_at, self._flush_interval)
+                if self._adaptive_batching
+                else None,
+                stats=self._stats,
+            )
+            self._consumers.append(consumer)
+            self._consumer_tasks.append(running_loop.create_task(consumer.run()))
+
+    def _unbind(self):
+        """Detach from a closed event loop, keeping the events that are still queued for the next loop."""
+        self._log.debug("event loop closed, rebinding to the next running loop")
+        queue = self._queue
+        self._loop = None
+        self._queue = None
+        self._consumers = []
+        self._consumer_tasks = []
+
+        # batches that were being uploaded when the loop closed are lost with it
+        while queue is not None and not queue.empty():
+            self._append_pending(queue.get_nowait())
+
+    def _append_pending(self, item: Any):
+        """Buffer an event until a loop is bound, up to `max_task_queue_size` events. Requires `_lock`."""
+        if len(self._pending) >= self._max_task_queue_size:
+            self._log.warning("analytics-python queue is full")
+            self._drop_counter.increment(DropCounter.QUEUE_FULL)
+            return
+
+        self._pending.append(item)
+
+    def _put(self, item: Any):
+        try:
+            self._queue.put_nowait(item)
+            self._stats.record_enqueued()
+        except asyncio.QueueFull:
+            self._log.warning("analytics-python queue is full")
+            self._drop_counter.increment(DropCounter.QUEUE_FULL)
+
+    def add_task(self, event: dict) -> bool:
+        """Enqueue an event on the event loop, return False if it could not be encoded.
+
+        Events dropped because the queue is full are only counted, the queue is filled on the event loop.
+        """
+        try:
+            self._log.debug("adding task %s", event)
+            event["timestamp"] = datetime.utcnow().replace(tzinfo=timezone.utc)
+
+            if self._tail_sampling is not None:
+                # buffered events are encoded right away, their size counts against the buffer budget
+                item = _encode_event(event)
+                items = self._tail_sampling.add(event, item, len(item))
+            else:
+                items = [_encode_event(event)]
+
+            for item in items:
+                self._dispatch(item)
+
+            return True
+        except Exception as e:
+            self._log.exception(f"Exception in adding task {e}")
+            self._drop_counter.increment(DropCounter.SERIALIZATION_ERROR)
+
+            return False
+
+    def _dispatch(self, item: Any):
+        if self._ensure_started():
+            self._put(item)
+            return
+
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(self._put, item)
+                return
+            except RuntimeError:
+                # the loop was closed after the check, the event waits for the next loop
+                pass
+
+        with self._lock:
+            loop = self._loop
+            if loop is None or loop.is_closed():
+                self._append_pending(item)
+                return
+
+        # a loop was bound in the meantime
+        self._dispatch(item)
+
+    def add_flush_callback(
+        self, callback: typing.Callable[[typing.Optional[str]], typing.Any]
+    ):
+        """Register a callback that enqueues events held back outside of the task manager, e.g. by an integration.
+
+        It is called with the id of a trace before the trace is decided for tail sampling, and with None before
+        flushing or joining to enqueue the held back events of all traces.
+        """
+        self._flush_callbacks.append(callback)
+
+    def _run_flush_callbacks(self, trace_id: typing.Optional[str] = None):
+        for callback in list(self._flush_callbacks):
+            try:
+                callback(trace_id)
+            except Exception as e:
+                self._log.exception(e)
+
+    def end_trace(self, trace_id: str):
+        """Decide on a trace buffered for tail sampling and enqueue its events if it is kept."""
+        if self._tail_sampling is None:
+            return
+
+        self._run_flush_callbacks(trace_id)
+        for item in self._tail_sampling.complete(trace_id):
+            self._dispatch(item)
+
+    def _release_expired(self):
+        for trace_id in self._tail_sampling.expired_trace_ids():
+            self._run_flush_callbacks(trace_id)
+
+        for item in self._tail_sampling.decide_expired():
+            self._dispatch(item)
+
+    def _release_tail_sampled(self):
+        if self._tail_sampling is None:
+            return
+
+        for item in self._tail_sampling.decide_all():
+            self._dispatch(item)
+
+    def get_dropped_count(self, reason: typing.Optional[str] = None) -> int:
+        """Number of events dropped so far, optionally only for the given `DropCounter` reason"""
+        return self._drop_counter.get(reason)
+
+    def get_stats(self) -> dict:
+        """Return the ingestion counters and histograms, the queue depth, the dropped events by reason, the
+        effective batch settings of each consumer and the tail sampling buffer"""
+        stats = self._stats.as_dict()
+        stats["queue_depth"] = (
+            self._queue.qsize() if self._queue is not None else len(self._pending)
+        )
+        stats["dropped"] = self._drop_counter.as_dict()
+        stats["consumers"] = [consumer.get_stats() for consumer in self._consumers]
+        if self._tail_sampling is not None:
+            stats["tail_sampling"] = self._tail_sampling.get_stats()
+
+        return stats
+
+    async def flush(self):
+        """Forces a flush from the internal queue to the server"""
+        self._log.debug("flushing queue")
+        self._ensure_started()
+        self._run_flush_callbacks()
+        # traces buffered for tail sampling are decided with what is known so far
+        self._release_tail_sampled()
+        if self._queue is None:
+            return
+
+        size = self._queue.qsize()
+        await self._queue.join()
+        self._log.debug("successfully flushed about %s items.", size)
+
+    async def join(self):
+        """Ends the consumer tasks once in-flight uploads and the batches being collected are uploaded. Events still in the queue are not uploaded, call flush() first."""
+        self._log.debug(f"joining {len(self._consumers)} consumer tasks")
+        if self._tail_sampling_timer is not None:
+            self._tail_sampling_timer.stop()
+        for consumer in self._consumers:
+            consumer.pause()
+
+        for task in self._consumer_tasks:
+            task.cancel()
+
+        await asyncio.gather(*self._consumer_tasks, return_exceptions=True)
+        # uploads that already started are not cancelled
+        await asyncio.gather(
+            *[task for consumer in self._consumers for task in consumer._upload_tasks],
+            return_exceptions=True,
+        )
+        for consumer in self._consumers:
+            self._log.debug(f"consumer task {consumer._identifier} joined")
+
+        if self._stats_reporter is not None:
+            self._stats_reporter.stop()
+
+    async def shutdown(self):
+        """Flush all messages and cleanly shutdown the client"""
+        self._log.debug("shutdown initiated")
+
+        await self.flush()
+        await self.join()
+
+        self._log.debug("shutdown completed")
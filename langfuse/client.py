@@ -1,11 +1,25 @@
+import asyncio
 import datetime as dt
 import logging
 import os
 import typing
 import uuid
 import httpx
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from typing import Any, Optional, Literal, Union, List, overload
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Optional,
+    Literal,
+    Sequence,
+    Tuple,
+    Union,
+    List,
+    overload,
+)
 
 from langfuse.api.resources.ingestion.types.create_event_body import CreateEventBody
 from langfuse.api.resources.ingestion.types.create_generation_body import (
@@ -38,24 +52,57 @@ from langfuse.model import (
     ChatPromptClient,
     TextPromptClient,
 )
-from langfuse.prompt_cache import PromptCache
+from langfuse.prompt_cache import (
+    DEFAULT_PROMPT_CACHE_MAX_BYTES,
+    DEFAULT_PROMPT_CACHE_MAX_ENTRIES,
+    DEFAULT_PROMPT_PREFETCH_WORKERS,
+    AsyncSingleFlight,
+    PromptCache,
+    SingleFlight,
+)
 
 try:
     import pydantic.v1 as pydantic  # type: ignore
 except ImportError:
     import pydantic  # type: ignore
 
-from langfuse.api.client import FernLangfuse
+from langfuse.api.client import AsyncFernLangfuse, FernLangfuse
+from langfuse.async_task_manager import AsyncTaskManager
 from langfuse.environment import get_common_release_envs
 from langfuse.logging import clean_logger
 from langfuse.model import Dataset, MapValue, Observation, TraceWithFullDetails
-from langfuse.request import LangfuseClient
+from langfuse.request import (
+    DEFAULT_COMPRESSION_MIN_SIZE,
+    AsyncLangfuseClient,
+    LangfuseClient,
+)
+from langfuse.sampling import TraceSampler
+from langfuse.spill_queue import DEFAULT_SPILL_MAX_BYTES
+from langfuse.stats import DEFAULT_STATS_INTERVAL
+from langfuse.tail_sampling import (
+    DEFAULT_TAIL_SAMPLING_DECISION_WAIT,
+    DEFAULT_TAIL_SAMPLING_MAX_BYTES,
+    DEFAULT_TAIL_SAMPLING_MAX_TRACE_BYTES,
+    TailSamplingBuffer,
+)
 from langfuse.task_manager import TaskManager
 from langfuse.types import SpanLevel
 from langfuse.utils import _convert_usage_input, _create_prompt_context, _get_timestamp
 
 from .version import __version__ as version
 
+PromptIdentifier = Union[str, Tuple[str, Optional[int]]]
+"""A prompt name for the active version, or a tuple of name and version."""
+
+
+def _parse_prompt_identifier(prompt: PromptIdentifier) -> Tuple[str, Optional[int]]:
+    if isinstance(prompt, str):
+        return prompt, None
+
+    name, version = prompt
+
+    return name, version
+
 
 class Langfuse(object):
     """Langfuse Python client.
@@ -104,6 +151,28 @@ class Langfuse(object):
         timeout: int = 10,  # seconds
         sdk_integration: Optional[str] = "default",
         httpx_client: Optional[httpx.Client] = None,
+        defer_serialization: bool = False,
+        compression: Optional[Literal["gzip", "zstd"]] = None,
+        compression_min_size: int = DEFAULT_COMPRESSION_MIN_SIZE,
+        max_in_flight_batches: int = 1,
+        adaptive_batching: bool = False,
+        spill_dir: Optional[str] = None,
+        spill_max_bytes: int = DEFAULT_SPILL_MAX_BYTES,
+        stats_callback: Optional[Callable[[dict], Any]] = None,
+        stats_interval: float = DEFAULT_STATS_INTERVAL,
+        prompt_cache_stale_while_revalidate: bool = False,
+        prompt_cache_max_entries: int = DEFAULT_PROMPT_CACHE_MAX_ENTRIES,
+        prompt_cache_max_bytes: int = DEFAULT_PROMPT_CACHE_MAX_BYTES,
+        prompt_cache_path: Optional[str] = None,
+        sample_rate: Optional[float] = None,
+        sampler: Optional[Callable[[str], bool]] = None,
+        tail_sampling: Optional[bool] = None,
+        tail_sampling_rate: Optional[float] = None,
+        tail_sampling_latency_threshold: Optional[float] = None,
+        tail_sampling_tags: Optional[List[str]] = None,
+        tail_sampling_max_trace_bytes: int = DEFAULT_TAIL_SAMPLING_MAX_TRACE_BYTES,
+        tail_sampling_max_bytes: int = DEFAULT_TAIL_SAMPLING_MAX_BYTES,
+        tail_sampling_decision_wait: float = DEFAULT_TAIL_SAMPLING_DECISION_WAIT,
     ):
         """Initialize the Langfuse client.
 
@@ -120,9 +189,31 @@ class Langfuse(object):
             timeout: Timeout of API requests in seconds.
             httpx_client: Pass your own httpx client for more customizability of requests.
             sdk_integration: Used by intgerations that wrap the Langfuse SDK to add context for debugging and support. Not to be used directly.
+            defer_serialization: Serialize events on the consumer threads instead of the calling thread. The caller only enqueues a snapshot of the event; serialization errors are logged and counted as dropped events. Not supported by `AsyncLangfuse`, which encodes the events on the event loop either way.
+            compression: Compress ingestion requests with `"gzip"` or `"zstd"` (falls back to gzip if `zstandard` is not installed, `pip install langfuse[zstd]`). Compression runs on the consumer threads. Disabled by default.
+            compression_min_size: Minimum request body size in bytes for compression to be applied. Defaults to 1024.
+            max_in_flight_batches: Max number of batches each consumer uploads concurrently while it collects the next batch. Increase this instead of `threads` if uploads are slowed down by network latency. Defaults to 1.
+            adaptive_batching: Adapt the batch size and flush interval to the observed load. Batches grow up to 1,000 events while the queue backlog grows or uploads are slow, and shrink back to `flush_at` and `flush_interval` under light traffic. The effective settings are reported by `get_stats()`. Disabled by default.
+            spill_dir: Directory for a durable on-disk overflow queue. Events that do not fit into the in-memory queue, batches that failed to upload after all retries and events still queued on shutdown are written to append-only segment files in this directory instead of being dropped. Spilled events are uploaded once the API accepts uploads again, retried with a growing delay of up to a minute while it does not, and segments left by a previous process are uploaded on start. Only events that can succeed later are spilled: events rejected by the API with a 4xx status other than 429 are not, and spilled events that failed to upload 10 times are dropped. The directory must not be shared between processes. Disabled by default.
+            spill_max_bytes: Max size of the on-disk overflow queue in bytes. Defaults to 256 MB.
+            stats_callback: Called with the result of `get_stats()` every `stats_interval` seconds from a background thread and once more on shutdown. Use it to export the ingestion stats to Prometheus, OpenTelemetry or your logs.
+            stats_interval: Interval in seconds between calls of `stats_callback`. Defaults to 10.
+            prompt_cache_stale_while_revalidate: Return expired prompts from the cache immediately and refresh them on a background thread instead of refetching them on the calling thread. Disabled by default.
+            prompt_cache_max_entries: Max number of prompts in the prompt cache, the least recently used prompts are evicted first. Defaults to 1,000.
+            prompt_cache_max_bytes: Max approximate size of the prompts in the prompt cache in bytes. Defaults to 32 MB.
+            prompt_cache_path: File to persist the prompt cache in. It is rewritten atomically on a background thread after prompts are fetched, prompts fetched in quick succession are written once. On startup, the prompts in it are served as expired entries, so `get_prompt` falls back to them if the API is unreachable, and they are revalidated in the background with the default TTL. Disabled by default.
+            sample_rate: Fraction of traces to send, between 0 and 1. The decision is made once per trace id from a hash of the id, so all clients with the same rate keep the same traces, including distributed traces created in several services. Unsampled traces and all of their observations and scores are no-op clients that send no events. Can be set via `LANGFUSE_SAMPLE_RATE` environment variable. Defaults to 1.
+            sampler: Custom sampling decision, called with the trace id of each new trace and returning whether to keep it. Overrides `sample_rate`. The decision is kept until `end_trace` is called for the trace, which the `@observe` decorator does when the outermost function returns, and then remembered for the 10,000 most recently ended trace ids. Without `end_trace`, the decisions of the 100,000 most recent traces are kept.
+            tail_sampling: Buffer the events of each trace in memory and decide whether to send them once the trace is complete, which keeps all failed or slow traces while sending only a fraction of the healthy ones. A trace is kept if any observation has level `ERROR`, if it took longer than `tail_sampling_latency_threshold`, if it has one of `tail_sampling_tags`, or otherwise with probability `tail_sampling_rate`. A trace is complete when the outermost `@observe` function returns, when `end_trace()` is called, or `tail_sampling_decision_wait` seconds after its first event. Traces that are still buffered are decided on `flush()`. Applies to traces kept by head sampling. Can be set via `LANGFUSE_TAIL_SAMPLING` environment variable. Disabled by default.
+            tail_sampling_rate: Fraction of traces to keep that match no other tail sampling rule, decided from a hash of the trace id. Can be set via `LANGFUSE_TAIL_SAMPLING_RATE` environment variable. Defaults to 0.
+            tail_sampling_latency_threshold: Keep traces that took more than this many seconds, measured from the first start time to the last end time of their observations or from the first event of the trace until it is complete, whichever is longer. Can be set via `LANGFUSE_TAIL_SAMPLING_LATENCY_THRESHOLD` environment variable. Disabled by default.
+            tail_sampling_tags: Keep traces that have any of these tags.
+            tail_sampling_max_trace_bytes: Max buffered size of a single trace in bytes. Larger traces are kept and sent without waiting for the decision. Defaults to 1 MB.
+            tail_sampling_max_bytes: Max buffered size of all traces in bytes. The oldest traces are decided early to stay within it. Defaults to 64 MB.
+            tail_sampling_decision_wait: Max time in seconds a trace is buffered before it is decided. Defaults to 30.
 
         Raises:
-            ValueError: If public_key or secret_key are not set and not found in environment variables.
+            ValueError: If public_key or secret_key are not set and not found in environment variables, or if sample_rate is not between 0 and 1.
 
         Example:
             Initiating the Langfuse client should always be first step to use Langfuse.
@@ -184,34 +275,97 @@ class Langfuse(object):
             httpx_client=self.httpx_client,
         )
 
-        langfuse_client = LangfuseClient(
-            public_key=public_key,
-            secret_key=secret_key,
-            base_url=self.base_url,
-            version=version,
-            timeout=timeout,
-            session=self.httpx_client,
-        )
+        client_args = {
+            "public_key": public_key,
+            "secret_key": secret_key,
+            "base_url": self.base_url,
+            "version": version,
+            "timeout": timeout,
+            "compression": compression,
+            "compression_min_size": compression_min_size,
+        }
+
+        if tail_sampling is None:
+            tail_sampling = os.getenv("LANGFUSE_TAIL_SAMPLING", "False") == "True"
+        if tail_sampling_rate is None:
+            tail_sampling_rate = float(os.getenv("LANGFUSE_TAIL_SAMPLING_RATE", "0"))
+        if (
+            tail_sampling_latency_threshold is None
+            and "LANGFUSE_TAIL_SAMPLING_LATENCY_THRESHOLD" in os.environ
+        ):
+            tail_sampling_latency_threshold = float(
+                os.environ["LANGFUSE_TAIL_SAMPLING_LATENCY_THRESHOLD"]
+            )
 
         args = {
             "threads": threads,
             "flush_at": flush_at,
             "flush_interval": flush_interval,
             "max_retries": max_retries,
-            "client": langfuse_client,
             "public_key": public_key,
             "sdk_name": "python",
             "sdk_version": version,
             "sdk_integration": sdk_integration,
+            "defer_serialization": defer_serialization,
+            "max_in_flight_batches": max_in_flight_batches,
+            "adaptive_batching": adaptive_batching,
+            "spill_dir": spill_dir,
+            "spill_max_bytes": spill_max_bytes,
+            "stats_callback": stats_callback,
+            "stats_interval": stats_interval,
+            "tail_sampling": TailSamplingBuffer(
+                sample_rate=tail_sampling_rate,
+                latency_threshold=tail_sampling_latency_threshold,
+                tags=tail_sampling_tags,
+                max_trace_bytes=tail_sampling_max_trace_bytes,
+                max_bytes=tail_sampling_max_bytes,
+                decision_wait=tail_sampling_decision_wait,
+            )
+            if tail_sampling
+            else None,
         }
 
-        self.task_manager = TaskManager(**args)
+        if sample_rate is None and "LANGFUSE_SAMPLE_RATE" in os.environ:
+            sample_rate = float(os.environ["LANGFUSE_SAMPLE_RATE"])
+
+        self._sampler = (
+            TraceSampler(sample_rate=sample_rate, sampler=sampler)
+            if sample_rate is not None or sampler is not None
+            else None
+        )
+
+        self.task_manager = self._create_task_manager(client_args, args)
 
         self.trace_id = None
 
         self.release = self._get_release_value(release)
 
-        self.prompt_cache = PromptCache()
+        self.prompt_cache = PromptCache(
+            max_entries=prompt_cache_max_entries,
+            max_bytes=prompt_cache_max_bytes,
+            snapshot_path=prompt_cache_path,
+        )
+        self.prompt_cache_stale_while_revalidate = prompt_cache_stale_while_revalidate
+        self._prompt_fetches = SingleFlight()
+
+        if prompt_cache_path is not None:
+            self._revalidate_prompt_cache_snapshot()
+
+    def _revalidate_prompt_cache_snapshot(self):
+        """Load the prompt cache snapshot and refresh its prompts in the background."""
+        for cache_key in self.prompt_cache.load_snapshot():
+            name, version = PromptCache.parse_cache_key(cache_key)
+            self.prompt_cache.add_refresh_prompt_task(
+                cache_key,
+                lambda name=name, version=version: self._fetch_prompt_and_update_cache(
+                    name, version
+                ),
+            )
+
+    def _create_task_manager(self, client_args: dict, task_manager_args: dict):
+        langfuse_client = LangfuseClient(**client_args, session=self.httpx_client)
+
+        return TaskManager(client=langfuse_client, **task_manager_args)
 
     def _get_release_value(self, release: Optional[str] = None) -> Optional[str]:
         if release:
@@ -221,6 +375,41 @@ class Langfuse(object):
         else:
             return get_common_release_envs()
 
+    def _is_sampled(self, trace_id: str) -> bool:
+        return self._sampler is None or self._sampler.is_sampled(trace_id)
+
+    def end_trace(self, trace_id: Optional[str] = None):
+        """Mark a trace as complete for tail sampling, its buffered events are sent or discarded right away.
+
+        The `@observe` decorator calls this when the outermost decorated function returns. It also releases the
+        decision of a custom `sampler` for the trace. Without `tail_sampling` or `sampler` this does nothing.
+
+        Args:
+            trace_id: The id of the trace, defaults to the current trace of the client.
+
+        Example:
+            ```python
+            from langfuse import Langfuse
+
+            langfuse = Langfuse(tail_sampling=True, tail_sampling_latency_threshold=10)
+
+            trace = langfuse.trace(name="llm-feature")
+            trace.span(name="retrieval").end()
+
+            # send the trace if it was slow, discard it otherwise
+            langfuse.end_trace(trace.id)
+            ```
+        """
+        try:
+            trace_id = trace_id or self.trace_id
+            if trace_id is not None:
+                self.task_manager.end_trace(trace_id)
+
+                if self._sampler is not None:
+                    self._sampler.end(trace_id)
+        except Exception as e:
+            self.log.exception(e)
+
     def get_trace_id(self) -> str:
         """Get the current trace id."""
         return self.trace_id
@@ -527,7 +716,8 @@ class Langfuse(object):
         This method attempts to fetch the requested prompt from the local cache. If the prompt is not found
         in the cache or if the cached prompt has expired, it will try to fetch the prompt from the server again
         and update the cache. If fetching the new prompt fails, and there is an expired prompt in the cache, it will
-        return the expired prompt as a fallback.
+        return the expired prompt as a fallback. With `prompt_cache_stale_while_revalidate` enabled, an expired
+        prompt is returned right away and refreshed in the background, once per prompt at a time.
 
         Args:
             name (str): The name of the prompt to retrieve.
@@ -559,6 +749,17 @@ class Langfuse(object):
             return self._fetch_prompt_and_update_cache(name, version, cache_ttl_seconds)
 
         if cached_prompt.is_expired():
+            if self.prompt_cache_stale_while_revalidate:
+                self.log.debug(f"Returning stale prompt '{cache_key}' while refreshing")
+                self.prompt_cache.add_refresh_prompt_task(
+                    cache_key,
+                    lambda: self._fetch_prompt_and_update_cache(
+                        name, version, cache_ttl_seconds
+                    ),
+                )
+
+                return cached_prompt.value
+
             try:
                 return self._fetch_prompt_and_update_cache(
                     name, version, cache_ttl_seconds
@@ -573,11 +774,84 @@ class Langfuse(object):
 
         return cached_prompt.value
 
+    def prefetch_prompts(
+        self,
+        prompts: Sequence[PromptIdentifier],
+        *,
+        cache_ttl_seconds: Optional[int] = None,
+        max_workers: int = DEFAULT_PROMPT_PREFETCH_WORKERS,
+    ) -> Dict[str, Exception]:
+        """Fetch prompts concurrently into the prompt cache, e.g. at startup, so that `get_prompt` is served from the cache.
+
+        Args:
+            prompts (Sequence[PromptIdentifier]): Prompt names to fetch the active version, or tuples of name and version.
+
+        Keyword Args:
+            cache_ttl_seconds: Optional[int]: Time-to-live in seconds for caching the prompts. If not set, defaults to 60 seconds.
+            max_workers: int: Max number of prompts fetched at the same time. Defaults to 8.
+
+        Returns:
+            Dict[str, Exception]: The errors of the prompts that could not be fetched by their cache key, e.g. `"my-prompt-latest"` or `"my-prompt-2"`. Empty if all prompts were fetched.
+
+        Example:
+            ```python
+            from langfuse import Langfuse
+
+            langfuse = Langfuse()
+
+            failed = langfuse.prefetch_prompts(["summarize", ("classify", 3)])
+            if failed:
+                print(f"Could not prefetch prompts: {list(failed)}")
+            ```
+        """
+        parsed_prompts = {
+            PromptCache.generate_cache_key(*prompt): prompt
+            for prompt in map(_parse_prompt_identifier, prompts)
+        }
+        if not parsed_prompts:
+            return {}
+
+        failed = {}
+        with ThreadPoolExecutor(
+            max_workers=min(max_workers, len(parsed_prompts))
+        ) as executor:
+            futures = {
+                cache_key: executor.submit(
+                    self._fetch_prompt_and_update_cache,
+                    name,
+                    version,
+                    cache_ttl_seconds,
+                )
+                for cache_key, (name, version) in parsed_prompts.items()
+            }
+
+            for cache_key, future in futures.items():
+                error = future.exception()
+                if error is not None:
+                    failed[cache_key] = error
+
+        if failed:
+            self.log.warning(f"Failed to prefetch prompts: {', '.join(failed)}")
+
+        return failed
+
     def _fetch_prompt_and_update_cache(
         self,
         name: str,
         version: Optional[int] = None,
         ttl_seconds: Optional[int] = None,
+    ) -> PromptClient:
+        # concurrent cache misses of the same prompt share a single request and its result or error
+        return self._prompt_fetches.do(
+            PromptCache.generate_cache_key(name, version),
+            lambda: self._fetch_prompt(name, version, ttl_seconds),
+        )
+
+    def _fetch_prompt(
+        self,
+        name: str,
+        version: Optional[int] = None,
+        ttl_seconds: Optional[int] = None,
     ) -> PromptClient:
         try:
             self.log.debug(
@@ -733,6 +1007,11 @@ class Langfuse(object):
         """
         new_id = id or str(uuid.uuid4())
         self.trace_id = new_id
+        if not self._is_sampled(new_id):
+            return _UnsampledTraceClient(
+                self.client, new_id, StateType.TRACE, new_id, self.task_manager
+            )
+
         try:
             new_dict = {
                 "id": new_id,
@@ -754,7 +1033,7 @@ class Langfuse(object):
 
             new_body = TraceBody(**new_dict)
 
-            self.log.debug(f"Creating trace {new_body}")
+            self.log.debug("Creating trace %s", new_body)
             event = {
                 "id": str(uuid.uuid4()),
                 "type": "trace-create",
@@ -772,6 +1051,19 @@ class Langfuse(object):
                 self.client, new_id, StateType.TRACE, new_id, self.task_manager
             )
 
+    def _deferred_trace(self, id: str) -> "StatefulTraceClient":
+        """Return the client of a trace without sending an event.
+
+        The trace is created by a later `trace()` call with the same id, e.g. by the decorator once the outermost
+        function has returned.
+        """
+        self.trace_id = id
+        client_class = (
+            StatefulTraceClient if self._is_sampled(id) else _UnsampledTraceClient
+        )
+
+        return client_class(self.client, id, StateType.TRACE, id, self.task_manager)
+
     def score(
         self,
         *,
@@ -820,6 +1112,17 @@ class Langfuse(object):
         """
         trace_id = trace_id or self.trace_id or str(uuid.uuid4())
         new_id = id or str(uuid.uuid4())
+        if not self._is_sampled(trace_id):
+            return _UnsampledClient(
+                self.client,
+                observation_id or trace_id,
+                StateType.OBSERVATION
+                if observation_id is not None
+                else StateType.TRACE,
+                trace_id,
+                self.task_manager,
+            )
+
         try:
             new_dict = {
                 "id": new_id,
@@ -831,7 +1134,7 @@ class Langfuse(object):
                 **kwargs,
             }
 
-            self.log.debug(f"Creating score {new_dict}...")
+            self.log.debug("Creating score %s...", new_dict)
             new_body = ScoreBody(**new_dict)
 
             event = {
@@ -917,6 +1220,15 @@ class Langfuse(object):
         new_span_id = id or str(uuid.uuid4())
         new_trace_id = trace_id or str(uuid.uuid4())
         self.trace_id = new_trace_id
+        if not self._is_sampled(new_trace_id):
+            return _UnsampledSpanClient(
+                self.client,
+                new_span_id,
+                StateType.OBSERVATION,
+                new_trace_id,
+                self.task_manager,
+            )
+
         try:
             span_body = {
                 "id": new_span_id,
@@ -938,7 +1250,7 @@ class Langfuse(object):
             if trace_id is None:
                 self._generate_trace(new_trace_id, name or new_trace_id)
 
-            self.log.debug(f"Creating span {span_body}...")
+            self.log.debug("Creating span %s...", span_body)
 
             span_body = CreateSpanBody(**span_body)
 
@@ -948,7 +1260,7 @@ class Langfuse(object):
                 "body": span_body.dict(exclude_none=True),
             }
 
-            self.log.debug(f"Creating span {event}...")
+            self.log.debug("Creating span %s...", event)
             self.task_manager.add_task(event)
 
         except Exception as e:
@@ -1017,6 +1329,15 @@ class Langfuse(object):
         event_id = id or str(uuid.uuid4())
         new_trace_id = trace_id or str(uuid.uuid4())
         self.trace_id = new_trace_id
+        if not self._is_sampled(new_trace_id):
+            return _UnsampledSpanClient(
+                self.client,
+                event_id,
+                StateType.OBSERVATION,
+                new_trace_id,
+                self.task_manager,
+            )
+
         try:
             event_body = {
                 "id": event_id,
@@ -1045,7 +1366,7 @@ class Langfuse(object):
                 "body": request.dict(exclude_none=True),
             }
 
-            self.log.debug(f"Creating event {event}...")
+            self.log.debug("Creating event %s...", event)
             self.task_manager.add_task(event)
 
         except Exception as e:
@@ -1132,6 +1453,15 @@ class Langfuse(object):
         new_trace_id = trace_id or str(uuid.uuid4())
         new_generation_id = id or str(uuid.uuid4())
         self.trace_id = new_trace_id
+        if not self._is_sampled(new_trace_id):
+            return _UnsampledGenerationClient(
+                self.client,
+                new_generation_id,
+                StateType.OBSERVATION,
+                new_trace_id,
+                self.task_manager,
+            )
+
         try:
             generation_body = {
                 "id": new_generation_id,
@@ -1170,11 +1500,11 @@ class Langfuse(object):
                     "body": request.dict(exclude_none=True),
                 }
 
-                self.log.debug(f"Creating trace {event}...")
+                self.log.debug("Creating trace %s...", event)
 
                 self.task_manager.add_task(event)
 
-            self.log.debug(f"Creating generation max {generation_body} {usage}...")
+            self.log.debug("Creating generation max %s %s...", generation_body, usage)
             request = CreateGenerationBody(**generation_body)
 
             event = {
@@ -1183,7 +1513,7 @@ class Langfuse(object):
                 "body": request.dict(exclude_none=True),
             }
 
-            self.log.debug(f"Creating top-level generation {event} ...")
+            self.log.debug("Creating top-level generation %s ...", event)
             self.task_manager.add_task(event)
 
         except Exception as e:
@@ -1212,7 +1542,7 @@ class Langfuse(object):
             "body": trace_body.dict(exclude_none=True),
         }
 
-        self.log.debug(f"Creating trace {event}...")
+        self.log.debug("Creating trace %s...", event)
         self.task_manager.add_task(event)
 
     def join(self):
@@ -1246,6 +1576,44 @@ class Langfuse(object):
         except Exception as e:
             self.log.exception(e)
 
+    def get_stats(self) -> dict:
+        """Return statistics of the event ingestion.
+
+        The stats are collected all the time, calling this method only takes a snapshot. The result contains:
+
+        - `enqueued`, `uploaded_events`, `uploaded_batches`, `failed_batches`, `failed_events`: Number of events and batches added to the queue, delivered to the API and given up on after all retries.
+        - `bytes_sent`: Size of the delivered events in bytes, before compression.
+        - `retries`: Number of retried upload attempts.
+        - `partial_errors`: Number of event errors in partially successful (207) responses.
+        - `batch_size`, `upload_latency`: Histograms of the delivered batches in events and seconds with cumulative `buckets` like Prometheus histograms, `sum` and `count`.
+        - `queue_depth`: Number of events currently waiting in the queue.
+        - `dropped`: Number of dropped events by reason (`queue_full`, `oversize`, `serialization_error`).
+        - `consumers`: Effective `flush_at` and `flush_interval` of each consumer, which change over time if `adaptive_batching` is enabled.
+        - `spill`: Size of the on-disk overflow queue and the number of records dropped after too many failed uploads if `spill_dir` is set.
+        - `tail_sampling`: Number of traces and bytes waiting for a decision, and the number of kept and discarded traces and discarded events if `tail_sampling` is enabled.
+        - `prompt_cache`: Number of entries, approximate size in bytes, hits, stale (expired) hits, misses and evictions of the prompt cache.
+
+        Example:
+            ```python
+            from langfuse import Langfuse
+
+            langfuse = Langfuse()
+
+            # Some operations with Langfuse
+
+            stats = langfuse.get_stats()
+            if stats["dropped"]:
+                print(f"Dropped events: {stats['dropped']}")
+            ```
+        """
+        try:
+            stats = self.task_manager.get_stats()
+            stats["prompt_cache"] = self.prompt_cache.get_stats()
+
+            return stats
+        except Exception as e:
+            self.log.exception(e)
+
     def shutdown(self):
         """Initiate a graceful shutdown of the Langfuse SDK, ensuring all events are sent to Langfuse API and all consumer Threads are terminated.
 
@@ -1258,6 +1626,309 @@ class Langfuse(object):
             self.log.exception(e)
 
 
+class AsyncLangfuse(Langfuse):
+    """Langfuse Python client for asyncio applications.
+
+    Shares the tracing API (`trace`, `span`, `generation`, `event`, `score`) of `Langfuse`, but batches events on an
+    `asyncio.Queue` and uploads them with an `httpx.AsyncClient` from tasks on the running event loop instead of
+    consumer threads. The coroutines `aflush()`, `ajoin()`, `ashutdown()`, `aget_prompt()` and `aprefetch_prompts()`
+    are the asyncio counterparts of the methods without the `a` prefix. Those keep the blocking behavior of
+    `Langfuse`: `get_prompt()` and `prefetch_prompts()` use the synchronous `client`, `flush()`, `join()` and
+    `shutdown()` wait for the event loop the events are uploaded on and cannot be called from within a running loop.
+
+    Attributes:
+        async_httpx_client (httpx.AsyncClient): HTTPX async client used for ingestion and `async_client`.
+        async_client (AsyncFernLangfuse): Async interface for Langfuse API interaction.
+
+    Example:
+        ```python
+        from langfuse import AsyncLangfuse
+
+        langfuse = AsyncLangfuse()
+
+        async def handle_request():
+            trace = langfuse.trace(name="llm-feature")
+            trace.generation(name="summary-generation", model="gpt-3.5-turbo")
+
+        async def on_shutdown():
+            await langfuse.ashutdown()
+        ```
+    """
+
+    def __init__(
+        self,
+        *args,
+        async_httpx_client: Optional[httpx.AsyncClient] = None,
+        **kwargs,
+    ):
+        """Initialize the AsyncLangfuse client.
+
+        Accepts the same arguments as `Langfuse`, `threads` sets the number of consumer tasks on the event loop.
+
+        Args:
+            async_httpx_client: Pass your own httpx async client for more customizability of ingestion requests.
+        """
+        self._owns_async_httpx_client = async_httpx_client is None
+        self.async_httpx_client = async_httpx_client
+        self._async_prompt_fetches = AsyncSingleFlight()
+        self._prompt_refresh_tasks = set()
+
+        super().__init__(*args, **kwargs)
+
+    def _create_task_manager(self, client_args: dict, task_manager_args: dict):
+        if self.async_httpx_client is None:
+            self.async_httpx_client = httpx.AsyncClient(timeout=client_args["timeout"])
+
+        self.async_client = AsyncFernLangfuse(
+            base_url=self.base_url,
+            username=client_args["public_key"],
+            password=client_args["secret_key"],
+            x_langfuse_sdk_name="python",
+            x_langfuse_sdk_version=version,
+            x_langfuse_public_key=client_args["public_key"],
+            httpx_client=self.async_httpx_client,
+        )
+
+        langfuse_client = AsyncLangfuseClient(
+            **client_args, session=self.async_httpx_client
+        )
+        task_manager_args["consumers"] = task_manager_args.pop("threads")
+        task_manager_args.pop("spill_max_bytes")
+        if task_manager_args.pop("spill_dir") is not None:
+            raise ValueError("spill_dir is not supported by AsyncLangfuse")
+        # events are encoded on the event loop either way, deferring would only add the cost of the snapshot
+        if task_manager_args.pop("defer_serialization"):
+            raise ValueError("defer_serialization is not supported by AsyncLangfuse")
+
+        return AsyncTaskManager(client=langfuse_client, **task_manager_args)
+
+    async def ajoin(self):
+        """Stop the consumer tasks on the event loop.
+
+        Events still in the queue are not sent, call aflush() first to guarantee all events have been delivered.
+        """
+        try:
+            return await self.task_manager.join()
+        except Exception as e:
+            self.log.exception(e)
+
+    async def aflush(self):
+        """Flush the internal event queue to the Langfuse API. It waits until the queue is empty.
+
+        Example:
+            ```python
+            from langfuse import AsyncLangfuse
+
+            langfuse = AsyncLangfuse()
+
+            # Some operations with Langfuse
+
+            # Flushing all events to end Langfuse cleanly
+            await langfuse.aflush()
+            ```
+        """
+        try:
+            return await self.task_manager.flush()
+        except Exception as e:
+            self.log.exception(e)
+
+    def join(self):
+        """Stop the consumer tasks from synchronous code, blocking until they are done, see `ajoin`."""
+        try:
+            return self._run_blocking(self.ajoin)
+        except Exception as e:
+            self.log.exception(e)
+
+    def flush(self):
+        """Flush the internal event queue from synchronous code, blocking until it is empty, see `aflush`."""
+        try:
+            return self._run_blocking(self.aflush)
+        except Exception as e:
+            self.log.exception(e)
+
+    def shutdown(self):
+        """Shut down from synchronous code, blocking until all events are sent, see `ashutdown`."""
+        try:
+            return self._run_blocking(self.ashutdown)
+        except Exception as e:
+            self.log.exception(e)
+
+    def _run_blocking(self, coroutine_function: Callable[[], Awaitable[Any]]):
+        """Run a coroutine on the event loop the events are uploaded on and wait for its result."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            # waiting would block the loop that has to run the coroutine
+            raise RuntimeError(
+                f"{coroutine_function.__name__[1:]}() blocks and cannot be called from a running event loop, "
+                f"await {coroutine_function.__name__}() instead"
+            )
+
+        loop = self.task_manager._loop
+        if loop is None or loop.is_closed():
+            # no loop runs the consumers, the buffered events are uploaded on a new one
+            return asyncio.run(coroutine_function())
+
+        return asyncio.run_coroutine_threadsafe(coroutine_function(), loop).result()
+
+    async def aget_prompt(
+        self,
+        name: str,
+        version: Optional[int] = None,
+        *,
+        type: Literal["chat", "text"] = "text",
+        cache_ttl_seconds: Optional[int] = None,
+    ) -> PromptClient:
+        """Get a prompt on the event loop, see `Langfuse.get_prompt`.
+
+        Prompts are fetched with `async_client`. Concurrent cache misses of the same prompt on the event loop
+        share a single request, with `prompt_cache_stale_while_revalidate` enabled expired prompts are refreshed
+        in a task on the event loop.
+        """
+        self.log.debug(f"Getting prompt {name}, version {version or 'latest'}")
+
+        if not name:
+            raise ValueError("Prompt name cannot be empty.")
+
+        cache_key = PromptCache.generate_cache_key(name, version)
+        cached_prompt = self.prompt_cache.get(cache_key)
+
+        if cached_prompt is None:
+            return await self._async_fetch_prompt_and_update_cache(
+                name, version, cache_ttl_seconds
+            )
+
+        if cached_prompt.is_expired():
+            if self.prompt_cache_stale_while_revalidate:
+                self.log.debug(f"Returning stale prompt '{cache_key}' while refreshing")
+                task = asyncio.get_running_loop().create_task(
+                    self._async_refresh_prompt(name, version, cache_ttl_seconds)
+                )
+                self._prompt_refresh_tasks.add(task)
+                task.add_done_callback(self._prompt_refresh_tasks.discard)
+
+                return cached_prompt.value
+
+            try:
+                return await self._async_fetch_prompt_and_update_cache(
+                    name, version, cache_ttl_seconds
+                )
+
+            except Exception as e:
+                self.log.warning(
+                    f"Returning expired prompt cache for '{name}-{version or 'latest'}' due to fetch error: {e}"
+                )
+
+                return cached_prompt.value
+
+        return cached_prompt.value
+
+    async def aprefetch_prompts(
+        self,
+        prompts: Sequence[PromptIdentifier],
+        *,
+        cache_ttl_seconds: Optional[int] = None,
+        max_workers: int = DEFAULT_PROMPT_PREFETCH_WORKERS,
+    ) -> Dict[str, Exception]:
+        """Fetch prompts concurrently on the event loop into the prompt cache, see `Langfuse.prefetch_prompts`."""
+        parsed_prompts = {
+            PromptCache.generate_cache_key(*prompt): prompt
+            for prompt in map(_parse_prompt_identifier, prompts)
+        }
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def fetch(name: str, version: Optional[int]):
+            async with semaphore:
+                return await self._async_fetch_prompt_and_update_cache(
+                    name, version, cache_ttl_seconds
+                )
+
+        results = await asyncio.gather(
+            *[fetch(name, version) for name, version in parsed_prompts.values()],
+            return_exceptions=True,
+        )
+        failed = {
+            cache_key: result
+            for cache_key, result in zip(parsed_prompts, results)
+            if isinstance(result, Exception)
+        }
+
+        if failed:
+            self.log.warning(f"Failed to prefetch prompts: {', '.join(failed)}")
+
+        return failed
+
+    async def _async_refresh_prompt(
+        self,
+        name: str,
+        version: Optional[int] = None,
+        ttl_seconds: Optional[int] = None,
+    ):
+        try:
+            await self._async_fetch_prompt_and_update_cache(name, version, ttl_seconds)
+        except Exception as e:
+            # the expired prompt is kept and served until a refresh succeeds
+            self.log.warning(f"Prompt cache was not refreshed: {e}")
+
+    async def _async_fetch_prompt_and_update_cache(
+        self,
+        name: str,
+        version: Optional[int] = None,
+        ttl_seconds: Optional[int] = None,
+    ) -> PromptClient:
+        return await self._async_prompt_fetches.do(
+            PromptCache.generate_cache_key(name, version),
+            lambda: self._async_fetch_prompt(name, version, ttl_seconds),
+        )
+
+    async def _async_fetch_prompt(
+        self,
+        name: str,
+        version: Optional[int] = None,
+        ttl_seconds: Optional[int] = None,
+    ) -> PromptClient:
+        try:
+            self.log.debug(
+                f"Fetching prompt {name}-{version or 'latest'}' from server..."
+            )
+
+            promptResponse = await self.async_client.prompts.get(
+                name=name, version=version
+            )
+            cache_key = PromptCache.generate_cache_key(name, version)
+
+            if promptResponse.type == "chat":
+                prompt = ChatPromptClient(promptResponse)
+            else:
+                prompt = TextPromptClient(promptResponse)
+
+            self.prompt_cache.set(cache_key, prompt, ttl_seconds)
+
+            return prompt
+
+        except Exception as e:
+            self.log.exception(
+                f"Error while fetching prompt '{name}-{version or 'latest'}': {e}"
+            )
+            raise e
+
+    async def ashutdown(self):
+        """Initiate a graceful shutdown, sending all events to the Langfuse API and stopping the consumer tasks.
+
+        Closes the httpx async client unless it was passed in by the caller. Unlike `Langfuse`, there is no
+        automatic shutdown at interpreter exit, await this before the event loop closes.
+        """
+        try:
+            await self.task_manager.shutdown()
+
+            if self._owns_async_httpx_client:
+                await self.async_httpx_client.aclose()
+        except Exception as e:
+            self.log.exception(e)
+
+
 class StateType(Enum):
     """Enum to distinguish observation and trace states.
 
@@ -1282,10 +1953,13 @@ class StatefulClient(object):
         state_type (StateType): Enum indicating whether the client is an observation or a trace.
         trace_id (str): Id of the trace associated with the stateful client.
         task_manager (TaskManager): Manager handling asynchronous tasks for the client.
+        sampled (bool): Whether the trace is kept by sampling. Clients of unsampled traces do not send any events.
     """
 
     log = logging.getLogger("langfuse")
 
+    sampled: bool = True
+
     def __init__(
         self,
         client: FernLangfuse,
@@ -1322,6 +1996,21 @@ class StatefulClient(object):
             body["start_time"] = _get_timestamp()
         return body
 
+    def _deferred_observation(
+        self, id: str, as_type: typing.Optional[Literal["generation"]] = None
+    ) -> typing.Union["StatefulSpanClient", "StatefulGenerationClient"]:
+        """Return the client of a nested span or generation without sending an event.
+
+        The observation is created by a later `span()` or `generation()` call with the same id.
+        """
+        client_class = (
+            StatefulGenerationClient if as_type == "generation" else StatefulSpanClient
+        )
+
+        return client_class(
+            self.client, id, StateType.OBSERVATION, self.trace_id, self.task_manager
+        )
+
     def generation(
         self,
         *,
@@ -1419,7 +2108,7 @@ class StatefulClient(object):
                 "body": new_body.dict(exclude_none=True, exclude_unset=False),
             }
 
-            self.log.debug(f"Creating generation {new_body}...")
+            self.log.debug("Creating generation %s...", new_body)
             self.task_manager.add_task(event)
 
         except Exception as e:
@@ -1497,7 +2186,7 @@ class StatefulClient(object):
                 **kwargs,
             }
 
-            self.log.debug(f"Creating span {span_body}...")
+            self.log.debug("Creating span %s...", span_body)
 
             new_dict = self._add_state_to_event(span_body)
             new_body = self._add_default_values(new_dict)
@@ -1571,7 +2260,7 @@ class StatefulClient(object):
                 **kwargs,
             }
 
-            self.log.debug(f"Creating score {new_score}...")
+            self.log.debug("Creating score %s...", new_score)
 
             new_dict = self._add_state_to_event(new_score)
 
@@ -1671,7 +2360,7 @@ class StatefulClient(object):
                 "body": request.dict(exclude_none=True),
             }
 
-            self.log.debug(f"Creating event {event}...")
+            self.log.debug("Creating event %s...", event)
             self.task_manager.add_task(event)
 
         except Exception as e:
@@ -1791,7 +2480,7 @@ class StatefulGenerationClient(StatefulClient):
                 **kwargs,
             }
 
-            self.log.debug(f"Update generation {generation_body}...")
+            self.log.debug("Update generation %s...", generation_body)
 
             request = UpdateGenerationBody(**generation_body)
 
@@ -1801,7 +2490,7 @@ class StatefulGenerationClient(StatefulClient):
                 "body": request.dict(exclude_none=True, exclude_unset=False),
             }
 
-            self.log.debug(f"Update generation {event}...")
+            self.log.debug("Update generation %s...", event)
             self.task_manager.add_task(event)
 
         except Exception as e:
@@ -1977,7 +2666,7 @@ class StatefulSpanClient(StatefulClient):
                 "end_time": end_time,
                 **kwargs,
             }
-            self.log.debug(f"Update span {span_body}...")
+            self.log.debug("Update span %s...", span_body)
 
             request = UpdateSpanBody(**span_body)
 
@@ -2176,7 +2865,7 @@ class StatefulTraceClient(StatefulClient):
                 "tags": tags,
                 **kwargs,
             }
-            self.log.debug(f"Update trace {trace_body}...")
+            self.log.debug("Update trace %s...", trace_body)
 
             request = TraceBody(**trace_body)
 
@@ -2240,6 +2929,79 @@ class StatefulTraceClient(StatefulClient):
         return self.get_langchain_handler()
 
 
+class _UnsampledClientMixin:
+    """Replaces the methods of a stateful client for a trace that was dropped by sampling.
+
+    No event bodies are built or enqueued, nested observations are unsampled clients as well so that whole traces
+    are dropped.
+    """
+
+    sampled = False
+
+    def generation(self, *, id: typing.Optional[str] = None, **kwargs):
+        return _UnsampledGenerationClient(
+            self.client,
+            id or str(uuid.uuid4()),
+            StateType.OBSERVATION,
+            self.trace_id,
+            self.task_manager,
+        )
+
+    def span(self, *, id: typing.Optional[str] = None, **kwargs):
+        return _UnsampledSpanClient(
+            self.client,
+            id or str(uuid.uuid4()),
+            StateType.OBSERVATION,
+            self.trace_id,
+            self.task_manager,
+        )
+
+    def event(self, *, id: typing.Optional[str] = None, **kwargs):
+        return _UnsampledClient(
+            self.client,
+            id or str(uuid.uuid4()),
+            self.state_type,
+            self.trace_id,
+            self.task_manager,
+        )
+
+    def _deferred_observation(self, id: str, as_type=None):
+        client_class = (
+            _UnsampledGenerationClient
+            if as_type == "generation"
+            else _UnsampledSpanClient
+        )
+
+        return client_class(
+            self.client, id, StateType.OBSERVATION, self.trace_id, self.task_manager
+        )
+
+    def score(self, **kwargs):
+        return self
+
+    def update(self, **kwargs):
+        return self
+
+    def end(self, **kwargs):
+        return self
+
+
+class _UnsampledClient(_UnsampledClientMixin, StatefulClient):
+    pass
+
+
+class _UnsampledGenerationClient(_UnsampledClientMixin, StatefulGenerationClient):
+    pass
+
+
+class _UnsampledSpanClient(_UnsampledClientMixin, StatefulSpanClient):
+    pass
+
+
+class _UnsampledTraceClient(_UnsampledClientMixin, StatefulTraceClient):
+    pass
+
+
 class DatasetItemClient:
     """Class for managing dataset items in Langfuse.
 
@@ -5,6 +5,7 @@ from datetime import datetime
 from functools import wraps
 import inspect
 import logging
+import uuid
 from typing import (
     Any,
     Callable,
@@ -30,6 +31,7 @@ from langfuse.client import (
     ModelUsage,
     MapValue,
 )
+from langfuse.task_manager import _snapshot
 from langfuse.types import ObservationParams, SpanLevel
 from langfuse.utils import _get_timestamp
 from langfuse.utils.langfuse_singleton import LangfuseSingleton
@@ -37,36 +39,57 @@ from langfuse.utils.error_logging import catch_and_log_errors
 
 from pydantic import BaseModel
 
-_observation_stack_context: ContextVar[
-    List[Union[StatefulTraceClient, StatefulSpanClient, StatefulGenerationClient]]
-] = ContextVar("observation_stack_context", default=[])
-_observation_params_context: ContextVar[DefaultDict[str, ObservationParams]] = (
-    ContextVar(
-        "observation_params_context",
-        default=defaultdict(
-            lambda: {
-                "name": None,
-                "user_id": None,
-                "session_id": None,
-                "version": None,
-                "release": None,
-                "metadata": None,
-                "tags": None,
-                "input": None,
-                "output": None,
-                "level": None,
-                "status_message": None,
-                "start_time": None,
-                "end_time": None,
-                "completion_start_time": None,
-                "model": None,
-                "model_parameters": None,
-                "usage": None,
-                "prompt": None,
-                "public": None,
-            },
-        ),
+
+class _ObservationStack:
+    """Immutable linked list of the active observations, the top of the stack is `observation`.
+
+    Pushing and popping create or return a node in O(1), the parent nodes are shared instead of copying the stack
+    on every call. For a `deferred` observation, the node also holds what is needed to create it once it has
+    ended: its create event is only built then, with the captured input, the output and all updates in a single
+    body.
+    """
+
+    __slots__ = (
+        "observation",
+        "parent",
+        "root",
+        "trace",
+        "name",
+        "start_time",
+        "input",
+        "deferred",
     )
+
+    def __init__(
+        self,
+        observation: Union[
+            StatefulTraceClient, StatefulSpanClient, StatefulGenerationClient
+        ],
+        parent: Optional["_ObservationStack"] = None,
+        trace: Optional[StatefulTraceClient] = None,
+        name: Optional[str] = None,
+        start_time: Optional[datetime] = None,
+        input: Optional[Any] = None,
+        deferred: bool = False,
+    ):
+        self.observation = observation
+        self.parent = parent
+        self.root = parent.root if parent is not None else observation
+        # the wrapper trace of a top-level generation, it is not on the stack itself
+        self.trace = trace
+        self.name = name
+        self.start_time = start_time
+        # a snapshot of the args and kwargs of the call, taken when it started
+        self.input = input
+        self.deferred = deferred
+
+
+_observation_stack_context: ContextVar[Optional[_ObservationStack]] = ContextVar(
+    "observation_stack_context", default=None
+)
+# only the params that were set via the context updates, entries are removed when the observation ends
+_observation_params_context: ContextVar[DefaultDict[str, ObservationParams]] = (
+    ContextVar("observation_params_context", default=defaultdict(dict))
 )
 
 
@@ -80,6 +103,7 @@ class LangfuseDecorator:
         capture_input: bool = True,
         capture_output: bool = True,
         transform_to_string: Optional[Callable[[Iterable], str]] = None,
+        deferred: bool = False,
     ) -> Callable:
         """Wrap a function to create and manage Langfuse tracing around its execution, supporting both synchronous and asynchronous functions.
 
@@ -91,6 +115,7 @@ class LangfuseDecorator:
             capture_input (bool): If True, captures the args and kwargs of the function as input. Default is True.
             capture_output (bool): If True, captures the return value of the function as output. Default is True.
             transform_to_string (Optional[Callable[[Iterable], str]]): When the decorated function returns a generator, this function transforms yielded values into a string representation for output capture
+            deferred (bool): If True, the observation is sent as a single event once the function has returned, or once a returned generator is exhausted, instead of being created when the function is called and updated when it returns. This halves the events of short, frequent calls, but functions that are still running do not appear in Langfuse yet. Default is False.
 
         Returns:
             Callable: A wrapped version of the original function that, upon execution, is automatically observed and managed by Langfuse.
@@ -115,6 +140,7 @@ class LangfuseDecorator:
         Note:
         - Automatic observation ID and context management is provided. Optionally, an observation ID can be specified using the `langfuse_observation_id` keyword when calling the wrapped function.
         - To update observation or trace parameters (e.g., metadata, session_id), use `langfuse.update_current_observation` and `langfuse.update_current_trace` methods within the wrapped function.
+        - With `deferred=True`, the input is copied when the function is called, so mutations of the arguments during the call are not recorded.
         """
 
         def decorator(func: Callable) -> Callable:
@@ -125,6 +151,7 @@ class LangfuseDecorator:
                     capture_input=capture_input,
                     capture_output=capture_output,
                     transform_to_string=transform_to_string,
+                    deferred=deferred,
                 )
                 if asyncio.iscoroutinefunction(func)
                 else self._sync_observe(
@@ -133,6 +160,7 @@ class LangfuseDecorator:
                     capture_input=capture_input,
                     capture_output=capture_output,
                     transform_to_string=transform_to_string,
+                    deferred=deferred,
                 )
             )
 
@@ -145,26 +173,30 @@ class LangfuseDecorator:
         capture_input: bool,
         capture_output: bool,
         transform_to_string: Optional[Callable[[Iterable], str]] = None,
+        deferred: bool = False,
     ) -> Callable:
+        is_instance_method = self._is_instance_method(func)
+
         @wraps(func)
         async def async_wrapper(*args, **kwargs):
-            observation = self._prepare_call(
+            stack = self._prepare_call(
                 func_name=func.__name__,
                 as_type=as_type,
                 capture_input=capture_input,
-                is_instance_method=self._is_instance_method(func),
+                is_instance_method=is_instance_method,
                 func_args=args,
                 func_kwargs=kwargs,
+                deferred=deferred,
             )
             result = None
 
             try:
                 result = await func(*args, **kwargs)
             except Exception as e:
-                self._handle_exception(observation, e)
+                self._handle_exception(stack, e)
             finally:
                 result = self._finalize_call(
-                    observation, result, capture_output, transform_to_string
+                    stack, result, capture_output, transform_to_string
                 )
 
                 # Returning from finally block may swallow errors, so only return if result is not None
@@ -180,26 +212,30 @@ class LangfuseDecorator:
         capture_input: bool,
         capture_output: bool,
         transform_to_string: Optional[Callable[[Iterable], str]] = None,
+        deferred: bool = False,
     ) -> Callable:
+        is_instance_method = self._is_instance_method(func)
+
         @wraps(func)
         def sync_wrapper(*args, **kwargs):
-            observation = self._prepare_call(
+            stack = self._prepare_call(
                 func_name=func.__name__,
                 as_type=as_type,
                 capture_input=capture_input,
-                is_instance_method=self._is_instance_method(func),
+                is_instance_method=is_instance_method,
                 func_args=args,
                 func_kwargs=kwargs,
+                deferred=deferred,
             )
             result = None
 
             try:
                 result = func(*args, **kwargs)
             except Exception as e:
-                self._handle_exception(observation, e)
+                self._handle_exception(stack, e)
             finally:
                 result = self._finalize_call(
-                    observation, result, capture_output, transform_to_string
+                    stack, result, capture_output, transform_to_string
                 )
 
                 # Returning from finally block may swallow errors, so only return if result is not None
@@ -230,18 +266,16 @@ class LangfuseDecorator:
         is_instance_method: bool = False,
         func_args: Tuple = (),
         func_kwargs: Dict = {},
-    ) -> Optional[
-        Union[StatefulSpanClient, StatefulTraceClient, StatefulGenerationClient]
-    ]:
+        deferred: bool = False,
+    ) -> Optional[_ObservationStack]:
         try:
             langfuse = self._get_langfuse()
-            stack = _observation_stack_context.get().copy()
-            parent = stack[-1] if stack else None
+            stack = _observation_stack_context.get()
+            parent = stack.observation if stack is not None else None
 
             # Collect default observation data
             name = func_name
             observation_id = func_kwargs.pop("langfuse_observation_id", None)
-            id = str(observation_id) if observation_id else None
             start_time = _get_timestamp()
 
             # Remove implicitly passed "self" argument for instance methods
@@ -250,6 +284,18 @@ class LangfuseDecorator:
             else:
                 logged_args = func_args
 
+            if deferred:
+                return self._prepare_deferred_call(
+                    langfuse,
+                    stack,
+                    name=name,
+                    as_type=as_type,
+                    id=str(observation_id) if observation_id else str(uuid.uuid4()),
+                    start_time=start_time,
+                    input=(logged_args, func_kwargs) if capture_input else None,
+                )
+
+            id = str(observation_id) if observation_id else None
             input = (
                 {"args": logged_args, "kwargs": func_kwargs} if capture_input else None
             )
@@ -276,69 +322,114 @@ class LangfuseDecorator:
             else:
                 observation = langfuse.trace(**params)
 
-            _observation_stack_context.set(stack + [observation])
+            stack = _ObservationStack(observation, stack)
+            _observation_stack_context.set(stack)
 
-            return observation
+            return stack
         except Exception as e:
             self._log.error(f"Failed to prepare observation: {e}")
 
+    def _prepare_deferred_call(
+        self,
+        langfuse: Langfuse,
+        stack: Optional[_ObservationStack],
+        *,
+        name: str,
+        as_type: Optional[Literal["generation"]],
+        id: str,
+        start_time: datetime,
+        input: Optional[Tuple[Tuple, Dict]],
+    ) -> _ObservationStack:
+        # Only the clients are created here, the create events are sent once the observation has ended
+        trace = None
+        if stack is not None:
+            observation = stack.observation._deferred_observation(id, as_type)
+        elif as_type == "generation":
+            # Create wrapper trace if generation is top-level
+            # Do not add wrapper trace to stack, as it does not have a corresponding end that will pop it off again
+            trace = langfuse._deferred_trace(id)
+            observation = trace._deferred_observation(str(uuid.uuid4()), as_type)
+        else:
+            observation = langfuse._deferred_trace(id)
+
+        if input is not None and observation.sampled:
+            # the input is sent when the call ends, copy it so that mutations during the call are not recorded
+            args, kwargs = input
+            input = _snapshot({"args": args, "kwargs": kwargs})
+        else:
+            input = None
+
+        stack = _ObservationStack(
+            observation, stack, trace, name, start_time, input, deferred=True
+        )
+        _observation_stack_context.set(stack)
+
+        return stack
+
     def _finalize_call(
         self,
-        observation: Optional[
-            Union[
-                StatefulSpanClient,
-                StatefulTraceClient,
-                StatefulGenerationClient,
-            ]
-        ],
+        stack: Optional[_ObservationStack],
         result: Any,
         capture_output: bool,
         transform_to_string: Optional[Callable[[Iterable], str]] = None,
     ):
         if inspect.isgenerator(result):
             return self._wrap_sync_generator_result(
-                observation, result, capture_output, transform_to_string
+                stack, result, capture_output, transform_to_string
             )
         elif inspect.isasyncgen(result):
             return self._wrap_async_generator_result(
-                observation, result, capture_output, transform_to_string
+                stack, result, capture_output, transform_to_string
             )
 
         else:
-            return self._handle_call_result(observation, result, capture_output)
+            return self._handle_call_result(stack, result, capture_output)
 
     def _handle_call_result(
         self,
-        observation: Optional[
-            Union[
-                StatefulSpanClient,
-                StatefulTraceClient,
-                StatefulGenerationClient,
-            ]
-        ],
+        stack: Optional[_ObservationStack],
         result: Any,
         capture_output: bool,
     ):
         try:
-            if observation is None:
+            if stack is None:
                 raise ValueError("No observation found in the current context")
 
-            # Collect final observation data
-            observation_params = _observation_params_context.get()[observation.id]
-            end_time = observation_params["end_time"] or _get_timestamp()
-            output = observation_params["output"] or (
-                str(result) if result and capture_output else None
+            observation = stack.observation
+
+            # Collect final observation data, the params are not needed once the observation has ended
+            observation_params = _observation_params_context.get().pop(
+                observation.id, {}
             )
-            observation_params.update(end_time=end_time, output=output)
 
-            if isinstance(observation, (StatefulSpanClient, StatefulGenerationClient)):
-                observation.end(**observation_params)
-            elif isinstance(observation, StatefulTraceClient):
-                observation.update(**observation_params)
+            # nothing is sent for traces dropped by sampling
+            if observation.sampled:
+                end_time = observation_params.get("end_time") or _get_timestamp()
+                output = observation_params.get("output") or (
+                    str(result) if result and capture_output else None
+                )
+                observation_params.update(end_time=end_time, output=output)
+
+                if not stack.deferred:
+                    if isinstance(
+                        observation, (StatefulSpanClient, StatefulGenerationClient)
+                    ):
+                        observation.end(**observation_params)
+                    elif isinstance(observation, StatefulTraceClient):
+                        observation.update(**observation_params)
+                else:
+                    if stack.input is not None and "input" not in observation_params:
+                        observation_params["input"] = stack.input
+
+                    self._create_observation(stack, observation_params)
 
             # Remove observation from top of stack
-            stack = _observation_stack_context.get()
-            _observation_stack_context.set(stack[:-1])
+            _observation_stack_context.set(stack.parent)
+
+            # the outermost observation ended, a trace buffered for tail sampling is complete and the sampling
+            # decision of the trace is released
+            if stack.parent is None:
+                self._get_langfuse().end_trace(observation.trace_id)
 
         except Exception as e:
             self._log.error(f"Failed to finalize observation: {e}")
@@ -346,28 +437,57 @@ class LangfuseDecorator:
         finally:
             return result
 
+    def _create_observation(self, stack: _ObservationStack, params: Dict):
+        observation = stack.observation
+
+        if isinstance(observation, StatefulTraceClient):
+            # the sampling decision was made with the deferred client, updating the trace sends its create event
+            observation.update(
+                timestamp=params.pop("start_time", stack.start_time),
+                **{
+                    "name": stack.name,
+                    "release": self._get_langfuse().release,
+                    **params,
+                },
+            )
+
+            return
+
+        if stack.parent is not None:
+            parent = stack.parent.observation
+        else:
+            parent = stack.trace.update(
+                name=stack.name,
+                release=self._get_langfuse().release,
+                timestamp=stack.start_time,
+            )
+
+        params = {
+            "id": observation.id,
+            "name": stack.name,
+            "start_time": stack.start_time,
+            **params,
+        }
+
+        if isinstance(observation, StatefulGenerationClient):
+            parent.generation(**params)
+        else:
+            parent.span(**params)
+
     def _handle_exception(
         self,
-        observation: Optional[
-            Union[StatefulSpanClient, StatefulTraceClient, StatefulGenerationClient]
-        ],
+        stack: Optional[_ObservationStack],
         e: Exception,
     ):
-        if observation:
-            _observation_params_context.get()[observation.id].update(
+        if stack:
+            _observation_params_context.get()[stack.observation.id].update(
                 level="ERROR", status_message=str(e)
             )
         raise e
 
     def _wrap_sync_generator_result(
         self,
-        observation: Optional[
-            Union[
-                StatefulSpanClient,
-                StatefulTraceClient,
-                StatefulGenerationClient,
-            ]
-        ],
+        stack: Optional[_ObservationStack],
         generator: Generator,
         capture_output: bool,
         transform_to_string: Optional[Callable[[Iterable], str]] = None,
@@ -389,17 +509,11 @@ class LangfuseDecorator:
             elif all(isinstance(item, str) for item in items):
                 output = "".join(items)
 
-            self._handle_call_result(observation, output, capture_output)
+            self._handle_call_result(stack, output, capture_output)
 
     async def _wrap_async_generator_result(
         self,
-        observation: Optional[
-            Union[
-                StatefulSpanClient,
-                StatefulTraceClient,
-                StatefulGenerationClient,
-            ]
-        ],
+        stack: Optional[_ObservationStack],
         generator: AsyncGenerator,
         capture_output: bool,
         transform_to_string: Optional[Callable[[Iterable], str]] = None,
@@ -421,7 +535,7 @@ class LangfuseDecorator:
             elif all(isinstance(item, str) for item in items):
                 output = "".join(items)
 
-            self._handle_call_result(observation, output, capture_output)
+            self._handle_call_result(stack, output, capture_output)
 
     def get_current_llama_index_handler(self):
         """Retrieve the current LlamaIndexCallbackHandler associated with the most recent observation in the observation stack.
@@ -447,7 +561,8 @@ class LangfuseDecorator:
 
             return None
 
-        observation = _observation_stack_context.get()[-1]
+        stack = _observation_stack_context.get()
+        observation = stack.observation if stack is not None else None
 
         if observation is None:
             self._log.warn("No observation found in the current context")
@@ -481,7 +596,8 @@ class LangfuseDecorator:
             - This method should be called within the context of a trace (i.e., within a function wrapped by @observe) to ensure that an observation context exists.
             - If no observation is found in the current context (e.g., if called outside of a trace or if the observation stack is empty), the method logs a warning and returns None.
         """
-        observation = _observation_stack_context.get()[-1]
+        stack = _observation_stack_context.get()
+        observation = stack.observation if stack is not None else None
 
         if observation is None:
             self._log.warn("No observation found in the current context")
@@ -515,13 +631,13 @@ class LangfuseDecorator:
         stack = _observation_stack_context.get()
         should_log_warning = self._get_caller_module_name() != "langfuse.openai"
 
-        if not stack:
+        if stack is None:
             if should_log_warning:
                 self._log.warn("No trace found in the current context")
 
             return None
 
-        return stack[0].id
+        return stack.root.id
 
     def _get_caller_module_name(self):
         try:
@@ -573,13 +689,13 @@ class LangfuseDecorator:
         stack = _observation_stack_context.get()
         should_log_warning = self._get_caller_module_name() != "langfuse.openai"
 
-        if not stack:
+        if stack is None:
             if should_log_warning:
                 self._log.warn("No observation found in the current context")
 
             return None
 
-        return stack[-1].id
+        return stack.observation.id
 
     def update_current_trace(
         self,
@@ -708,7 +824,7 @@ class LangfuseDecorator:
             - Parameters set to `None` will not overwrite existing values for those parameters. This behavior allows for selective updates without clearing previously set information.
         """
         stack = _observation_stack_context.get()
-        observation = stack[-1] if stack else None
+        observation = stack.observation if stack is not None else None
 
         if not observation:
             self._log.warn("No observation found in the current context")
@@ -857,6 +973,30 @@ class LangfuseDecorator:
         else:
             self._log.warn("No langfuse object found in the current context")
 
+    def configure(self, **kwargs) -> Langfuse:
+        """Configure the Langfuse client used by the `@observe` decorator and the integrations sharing it.
+
+        Replaces the shared client with one created from the given arguments, which are passed to `Langfuse`. Call
+        this once at startup, before the first decorated function or integration call.
+
+        Args:
+            **kwargs: Arguments of `Langfuse`, e.g. `sample_rate`, `sampler` or `tail_sampling`.
+
+        Returns:
+            Langfuse: The shared client.
+
+        Example:
+            ```python
+            from langfuse.decorators import langfuse_context
+
+            langfuse_context.configure(sample_rate=0.1)
+            ```
+        """
+        langfuse_singleton = LangfuseSingleton()
+        langfuse_singleton.reset()
+
+        return langfuse_singleton.get(**kwargs)
+
     def _get_langfuse(self) -> Langfuse:
         return LangfuseSingleton().get()
 
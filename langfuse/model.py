@@ -1,10 +1,32 @@
 """@private"""
 
 from abc import ABC, abstractmethod
-from typing import Optional, TypedDict, Any, Dict, Union, List
+from functools import partial
+from itertools import islice
+import multiprocessing
+from typing import (
+    Callable,
+    Iterable,
+    Iterator,
+    Optional,
+    Tuple,
+    TypedDict,
+    Any,
+    Dict,
+    Union,
+    List,
+)
 import chevron
+from chevron.tokenizer import tokenize
 import re
 
+# chevron's own lookup and escaping, so that flat templates render exactly like chevron.render
+try:
+    from chevron.renderer import _get_key, _html_escape
+except ImportError:
+    _get_key = None
+    _html_escape = None
+
 from langfuse.api.resources.commons.types.dataset import (
     Dataset,  # noqa: F401
 )
@@ -50,6 +72,78 @@ class ModelUsage(TypedDict):
     total_cost: Optional[float]
 
 
+class CompiledTemplate:
+    """A mustache template that is tokenized once and renders exactly like `chevron.render(template, data)`.
+
+    Templates with only text and variables are rendered directly from the tokens, all others by passing the tokens
+    to `chevron.render`. Templates that cannot be tokenized are kept as strings, so that chevron raises the error
+    on render.
+    """
+
+    __slots__ = ("_tokens", "_flat")
+
+    def __init__(self, template: str):
+        self._tokens: Union[List[Tuple[str, str]], str] = template
+        self._flat = False
+
+        try:
+            tokens = list(tokenize(template))
+        except Exception:
+            return
+
+        self._tokens = tokens
+        self._flat = _get_key is not None and all(
+            tag in ("literal", "variable", "no escape") for tag, _ in tokens
+        )
+
+    def render(self, data: Dict[str, Any]) -> str:
+        if not self._flat:
+            return chevron.render(self._tokens, data)
+
+        scopes = [data]
+        output = []
+        for tag, key in self._tokens:
+            if tag == "literal":
+                output.append(key)
+                continue
+
+            value = _get_key(key, scopes)
+            if not isinstance(value, str):
+                value = str(value)
+            output.append(_html_escape(value) if tag == "variable" else value)
+
+        return "".join(output)
+
+
+DEFAULT_COMPILE_MANY_CHUNKSIZE = 256
+
+
+def _render_text(template: CompiledTemplate, variables: Dict[str, Any]) -> str:
+    return template.render(variables)
+
+
+def _render_chat(
+    messages: List[Tuple[str, CompiledTemplate]], variables: Dict[str, Any]
+) -> List[ChatMessage]:
+    return [
+        ChatMessage(content=template.render(variables), role=role)
+        for role, template in messages
+    ]
+
+
+# set once per worker process of compile_many, so that the templates are not sent with every chunk
+_worker_render: Optional[Callable[[Dict[str, Any]], Any]] = None
+
+
+def _init_compile_worker(render: Callable[[Dict[str, Any]], Any]):
+    global _worker_render
+    _worker_render = render
+
+
+def _compile_in_worker(variables: Dict[str, Any]):
+    return _worker_render(variables)
+
+
 class BasePromptClient(ABC):
     name: str
     version: int
@@ -64,6 +158,53 @@ class BasePromptClient(ABC):
     def compile(self, **kwargs) -> Union[str, List[ChatMessage]]:
         pass
 
+    @abstractmethod
+    def _get_renderer(self) -> Callable[[Dict[str, Any]], Any]:
+        pass
+
+    def compile_many(
+        self,
+        variables: Iterable[Dict[str, Any]],
+        *,
+        processes: Optional[int] = None,
+        chunksize: int = DEFAULT_COMPILE_MANY_CHUNKSIZE,
+    ) -> Iterator[Union[str, List[ChatMessage]]]:
+        """Compile the prompt for each set of variables, in order.
+
+        The template is parsed once for all variable sets. Results are yielded one at a time and `variables` is
+        consumed lazily, so that large generators of variables can be compiled without holding all results in memory.
+
+        Args:
+            variables (Iterable[Dict[str, Any]]): The variables of each compilation, as passed to `compile(**variables)`.
+            processes (Optional[int]): Number of worker processes to compile in. By default the prompts are compiled
+                in the calling process. Variables and results are pickled to and from the workers, which only pays off
+                for large templates. They must be picklable.
+            chunksize (int): Number of variable sets sent to a worker at once.
+
+        Yields:
+            The compiled prompt of each variable set, like `compile`.
+        """
+        render = self._get_renderer()
+
+        if processes is None:
+            for kwargs in variables:
+                yield render(kwargs)
+
+            return
+
+        # workers are fed a bounded window at a time, Pool.imap would read the whole iterable upfront
+        window_size = processes * chunksize * 2
+        iterator = iter(variables)
+        with multiprocessing.Pool(
+            processes, initializer=_init_compile_worker, initargs=(render,)
+        ) as pool:
+            while True:
+                window = list(islice(iterator, window_size))
+                if not window:
+                    break
+
+                yield from pool.imap(_compile_in_worker, window, chunksize)
+
     @abstractmethod
     def __eq__(self, other):
         pass
@@ -81,9 +222,25 @@ class TextPromptClient(BasePromptClient):
     def __init__(self, prompt: Prompt_Text):
         super().__init__(prompt)
         self.prompt = prompt.prompt
+        self._compiled_source = None
+        self._compiled_template = None
+        self._langchain_prompt = None
+        self._get_compiled_template()
+
+    def _get_compiled_template(self) -> CompiledTemplate:
+        # compiled again if the prompt was replaced after construction
+        if self._compiled_source is not self.prompt:
+            self._compiled_template = CompiledTemplate(self.prompt)
+            self._langchain_prompt = None
+            self._compiled_source = self.prompt
+
+        return self._compiled_template
 
     def compile(self, **kwargs) -> str:
-        return chevron.render(self.prompt, kwargs)
+        return _render_text(self._get_compiled_template(), kwargs)
+
+    def _get_renderer(self) -> Callable[[Dict[str, Any]], str]:
+        return partial(_render_text, self._get_compiled_template())
 
     def __eq__(self, other):
         if isinstance(self, other.__class__):
@@ -105,22 +262,39 @@ class TextPromptClient(BasePromptClient):
         Returns:
             str: The string that can be plugged into Langchain's PromptTemplate.
         """
-        return self.get_langchain_prompt_string(self.prompt)
+        self._get_compiled_template()
+        if self._langchain_prompt is None:
+            self._langchain_prompt = self.get_langchain_prompt_string(self.prompt)
+
+        return self._langchain_prompt
 
 
 class ChatPromptClient(BasePromptClient):
     def __init__(self, prompt: Prompt_Chat):
         super().__init__(prompt)
         self.prompt = prompt.prompt
+        self._compiled_source = None
+        self._compiled_messages = None
+        self._langchain_prompt = None
+        self._get_compiled_messages()
+
+    def _get_compiled_messages(self) -> List[Tuple[str, CompiledTemplate]]:
+        # compiled again if the prompt was replaced after construction
+        if self._compiled_source is not self.prompt:
+            self._compiled_messages = [
+                (chat_message["role"], CompiledTemplate(chat_message["content"]))
+                for chat_message in self.prompt
+            ]
+            self._langchain_prompt = None
+            self._compiled_source = self.prompt
+
+        return self._compiled_messages
 
     def compile(self, **kwargs) -> List[ChatMessage]:
-        return [
-            ChatMessage(
-                content=chevron.render(chat_message["content"], kwargs),
-                role=chat_message["role"],
-            )
-            for chat_message in self.prompt
-        ]
+        return _render_chat(self._get_compiled_messages(), kwargs)
+
+    def _get_renderer(self) -> Callable[[Dict[str, Any]], List[ChatMessage]]:
+        return partial(_render_chat, self._get_compiled_messages())
 
     def __eq__(self, other):
         if isinstance(self, other.__class__):
@@ -145,10 +319,15 @@ class ChatPromptClient(BasePromptClient):
         Returns:
             List of messages in the format expected by Langchain's ChatPromptTemplate: (role, content) tuple.
         """
-        return [
-            (msg["role"], self.get_langchain_prompt_string(msg["content"]))
-            for msg in self.prompt
-        ]
+        self._get_compiled_messages()
+        if self._langchain_prompt is None:
+            self._langchain_prompt = [
+                (msg["role"], self.get_langchain_prompt_string(msg["content"]))
+                for msg in self.prompt
+            ]
+
+        # a copy, callers may modify the list
+        return list(self._langchain_prompt)
 
 
 PromptClient = Union[TextPromptClient, ChatPromptClient]
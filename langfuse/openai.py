@@ -8,19 +8,31 @@
 Langfuse automatically tracks:
 
 - All prompts/completions with support for streaming, async and functions
+- Embeddings, with the number and dimensions of the vectors instead of the vectors themselves
 - Latencies
 - API Errors
 - Model usage (tokens) and cost (USD)
 
 The integration is fully interoperable with the `observe()` decorator and the low-level tracing SDK.
 
+For high-frequency calls, `openai.langfuse_aggregate_generations = True` sends each call as a single event when it
+completes instead of one when it starts and one when it ends. `openai.langfuse_rollup_generations = True`
+additionally sums successful calls with the same name and model in a trace into one generation with their usage.
+
 See docs for more details: https://langfuse.com/docs/integrations/openai
 """
 
-import copy
+import atexit
+import base64
+import binascii
+import hashlib
 import logging
+import threading
+import time
 import types
-from typing import List, Optional
+import weakref
+from collections import OrderedDict
+from typing import Dict, List, Optional
 
 from packaging.version import Version
 from wrapt import wrap_function_wrapper
@@ -28,7 +40,7 @@ from wrapt import wrap_function_wrapper
 from langfuse import Langfuse
 from langfuse.client import StatefulGenerationClient
 from langfuse.decorators import langfuse_context
-from langfuse.utils import _get_timestamp
+from langfuse.utils import _convert_usage_input, _get_timestamp
 from langfuse.utils.langfuse_singleton import LangfuseSingleton
 
 try:
@@ -48,6 +60,20 @@ except ImportError:
 
 log = logging.getLogger("langfuse")
 
+DEFAULT_ROLLUP_WINDOW = 10.0
+ROLLUP_CHECK_INTERVAL = 1.0
+
+# embedding inputs are logged as their count and the beginning of the first few texts
+EMBEDDING_INPUT_PREVIEW_COUNT = 3
+EMBEDDING_INPUT_PREVIEW_LENGTH = 100
+
+# resolved once, the extraction below is specialized for the installed SDK generation
+_IS_OPENAI_V1 = Version(openai.__version__) >= Version("1.0.0")
+
+_STREAM_TYPES = (types.GeneratorType, types.AsyncGeneratorType) + (
+    (openai.Stream, openai.AsyncStream) if _IS_OPENAI_V1 else ()
+)
+
 
 class OpenAiDefinition:
     module: str
@@ -79,6 +105,13 @@ OPENAI_METHODS_V0 = [
         type="completion",
         sync=True,
     ),
+    OpenAiDefinition(
+        module="openai",
+        object="Embedding",
+        method="create",
+        type="embedding",
+        sync=True,
+    ),
 ]
 
 
@@ -111,6 +144,20 @@ OPENAI_METHODS_V1 = [
         type="completion",
         sync=False,
     ),
+    OpenAiDefinition(
+        module="openai.resources.embeddings",
+        object="Embeddings",
+        method="create",
+        type="embedding",
+        sync=True,
+    ),
+    OpenAiDefinition(
+        module="openai.resources.embeddings",
+        object="AsyncEmbeddings",
+        method="create",
+        type="embedding",
+        sync=False,
+    ),
 ]
 
 
@@ -170,13 +217,17 @@ def _extract_chat_prompt(kwargs: any):
         # uf user provided functions, we need to send these together with messages to langfuse
         prompt.update(
             {
-                "messages": _filter_image_data(kwargs.get("messages", [])),
+                "messages": _filter_image_data(
+                    kwargs.get("messages", []), openai.langfuse_image_placeholder
+                ),
             }
         )
         return prompt
     else:
         # vanilla case, only send messages in openai format to langfuse
-        return _filter_image_data(kwargs.get("messages", []))
+        return _filter_image_data(
+            kwargs.get("messages", []), openai.langfuse_image_placeholder
+        )
 
 
 def _extract_chat_response(kwargs: any):
@@ -202,10 +253,13 @@ def _extract_chat_response(kwargs: any):
 def _get_langfuse_data_from_kwargs(
     resource: OpenAiDefinition, langfuse: Langfuse, start_time, kwargs
 ):
-    name = kwargs.get("name", "OpenAI-generation")
+    default_name = (
+        "OpenAI-embedding" if resource.type == "embedding" else "OpenAI-generation"
+    )
+    name = kwargs.get("name", default_name)
 
     if name is None:
-        name = "OpenAI-generation"
+        name = default_name
 
     if name is not None and not isinstance(name, str):
         raise TypeError("name must be a string")
@@ -260,6 +314,8 @@ def _get_langfuse_data_from_kwargs(
         prompt = kwargs.get("prompt", None)
     elif resource.type == "chat":
         prompt = _extract_chat_prompt(kwargs)
+    elif resource.type == "embedding":
+        prompt = _extract_embedding_input(kwargs.get("input", None))
 
     is_nested_trace = False
     if trace_id:
@@ -278,13 +334,20 @@ def _get_langfuse_data_from_kwargs(
             ).id
         )
 
-    modelParameters = {
-        "temperature": kwargs.get("temperature", 1),
-        "max_tokens": kwargs.get("max_tokens", float("inf")),  # casing?
-        "top_p": kwargs.get("top_p", 1),
-        "frequency_penalty": kwargs.get("frequency_penalty", 0),
-        "presence_penalty": kwargs.get("presence_penalty", 0),
-    }
+    if resource.type == "embedding":
+        modelParameters = {
+            key: kwargs[key]
+            for key in ("dimensions", "encoding_format")
+            if kwargs.get(key, None) is not None
+        }
+    else:
+        modelParameters = {
+            "temperature": kwargs.get("temperature", 1),
+            "max_tokens": kwargs.get("max_tokens", float("inf")),  # casing?
+            "top_p": kwargs.get("top_p", 1),
+            "frequency_penalty": kwargs.get("frequency_penalty", 0),
+            "presence_penalty": kwargs.get("presence_penalty", 0),
+        }
 
     return {
         "name": name,
@@ -306,14 +369,12 @@ def _get_langfuse_data_from_sync_streaming_response(
     langfuse: Langfuse,
     is_nested_trace,
 ):
-    responses = []
+    accumulator = _StreamingResponseAccumulator(resource)
     for i in response:
-        responses.append(i)
+        accumulator.add(i)
         yield i
 
-    model, completion_start_time, completion = _extract_openai_response(
-        resource, responses
-    )
+    model, completion_start_time, completion = accumulator.get_result()
 
     # Avoiding the trace-update if trace-id is provided by user.
     if not is_nested_trace:
@@ -329,14 +390,12 @@ async def _get_langfuse_data_from_async_streaming_response(
     langfuse: Langfuse,
     is_nested_trace,
 ):
-    responses = []
+    accumulator = _StreamingResponseAccumulator(resource)
     async for i in response:
-        responses.append(i)
+        accumulator.add(i)
         yield i
 
-    model, completion_start_time, completion = _extract_openai_response(
-        resource, responses
-    )
+    model, completion_start_time, completion = accumulator.get_result()
 
     # Avoiding the trace-update if trace-id is provided by user.
     if not is_nested_trace:
@@ -359,118 +418,443 @@ def _create_langfuse_update(
     generation.update(**update)
 
 
-def _extract_openai_response(resource, responses):
-    completion = [] if resource.type == "chat" else ""
-    model = None
-    completion_start_time = None
-
-    for index, i in enumerate(responses):
-        if index == 0:
-            completion_start_time = _get_timestamp()
-
-        if _is_openai_v1():
-            i = i.__dict__
-
-        model = i.get("model", None) if model is None else model
-
-        choices = i.get("choices", [])
-
-        for choice in choices:
-            if _is_openai_v1():
-                choice = choice.__dict__
-            if resource.type == "chat":
-                delta = choice.get("delta", None)
-
-                if _is_openai_v1():
-                    delta = delta.__dict__
-
-                if delta.get("role", None) is not None:
-                    completion.append(
-                        {
-                            "role": delta.get("role", None),
-                            "function_call": None,
-                            "tool_calls": None,
-                            "content": None,
-                        }
-                    )
-
-                elif delta.get("content", None) is not None:
-                    completion[-1]["content"] = (
-                        delta.get("content", None)
-                        if completion[-1]["content"] is None
-                        else completion[-1]["content"] + delta.get("content", None)
-                    )
-
-                elif delta.get("function_call", None) is not None:
-                    completion[-1]["function_call"] = (
-                        delta.get("function_call", None)
-                        if completion[-1]["function_call"] is None
-                        else completion[-1]["function_call"]
-                        + delta.get("function_call", None)
-                    )
-                elif delta.get("tools_call", None) is not None:
-                    completion[-1]["tool_calls"] = (
-                        delta.get("tools_call", None)
-                        if completion[-1]["tool_calls"] is None
-                        else completion[-1]["tool_calls"]
-                        + delta.get("tools_call", None)
-                    )
-            if resource.type == "completion":
-                completion += choice.get("text", None)
-
-    def get_response_for_chat():
-        if len(completion) > 0:
-            if completion[-1].get("content", None) is not None:
-                return completion[-1]["content"]
-            elif completion[-1].get("function_call", None) is not None:
-                return completion[-1]["function_call"]
-            elif completion[-1].get("tool_calls", None) is not None:
-                return completion[-1]["tool_calls"]
+if _IS_OPENAI_V1:
+
+    def _get_field(obj, key: str):
+        """Reads a field of a response object, a pydantic model in openai>=1."""
+        return getattr(obj, key, None)
+
+else:
+
+    def _get_field(obj, key: str):
+        """Reads a field of a response object, a dict in openai<1."""
+        return obj.get(key, None)
+
+
+class _StreamedChoice:
+    """Running state of one choice of a streamed response, text is collected in parts and joined once at the end."""
+
+    __slots__ = ("text_parts", "function_name", "function_arguments", "tool_calls")
+
+    def __init__(self):
+        self.text_parts: List[str] = []
+        self.function_name: Optional[str] = None
+        self.function_arguments: Optional[List[str]] = None
+        self.tool_calls: Dict[int, dict] = {}
+
+    def add_function_call(self, function_call):
+        if self.function_arguments is None:
+            self.function_arguments = []
+
+        name = _get_field(function_call, "name")
+        if name is not None:
+            self.function_name = name
+
+        arguments = _get_field(function_call, "arguments")
+        if arguments:
+            self.function_arguments.append(arguments)
+
+    def add_tool_call(self, tool_call):
+        index = _get_field(tool_call, "index") or 0
+        state = self.tool_calls.get(index)
+        if state is None:
+            state = self.tool_calls[index] = {
+                "id": None,
+                "type": None,
+                "name": None,
+                "arguments": [],
+            }
+
+        for key in ("id", "type"):
+            value = _get_field(tool_call, key)
+            if value is not None:
+                state[key] = value
+
+        function = _get_field(tool_call, "function")
+        if function is not None:
+            name = _get_field(function, "name")
+            if name is not None:
+                state["name"] = name
+
+            arguments = _get_field(function, "arguments")
+            if arguments:
+                state["arguments"].append(arguments)
+
+    def get_chat_response(self):
+        content = "".join(self.text_parts)
+        if content:
+            return content
+
+        if self.function_arguments is not None:
+            return {
+                "name": self.function_name,
+                "arguments": "".join(self.function_arguments),
+            }
+
+        if self.tool_calls:
+            return [
+                {
+                    "id": state["id"],
+                    "type": state["type"],
+                    "function": {
+                        "name": state["name"],
+                        "arguments": "".join(state["arguments"]),
+                    },
+                }
+                for _, state in sorted(self.tool_calls.items())
+            ]
+
+        # an empty content delta still is a response
+        return content if self.text_parts else None
+
+
+class _StreamingResponseAccumulator:
+    """Folds the chunks of a streamed completion into the output as they arrive.
+
+    Only the running state of each choice is kept instead of the chunks, so accumulating a stream takes linear
+    time and memory in the length of the output. The time to first token is recorded on the first chunk.
+    """
+
+    def __init__(self, resource: OpenAiDefinition):
+        self._is_chat = resource.type == "chat"
+        self._add_choice = (
+            self._add_chat_choice if self._is_chat else self._add_completion_choice
+        )
+        self.model = None
+        self.completion_start_time = None
+        self._choices: Dict[int, _StreamedChoice] = {}
+
+    def add(self, chunk):
+        if self.completion_start_time is None:
+            self.completion_start_time = _get_timestamp()
+
+        try:
+            self._add(chunk)
+        except Exception as e:
+            # a chunk that cannot be read must not break the stream of the caller
+            log.exception(e)
+
+    def _add(self, chunk):
+        if self.model is None:
+            self.model = _get_field(chunk, "model")
+
+        for choice in _get_field(chunk, "choices") or []:
+            index = _get_field(choice, "index") or 0
+            state = self._choices.get(index)
+            if state is None:
+                state = self._choices[index] = _StreamedChoice()
+
+            self._add_choice(state, choice)
+
+    def _add_completion_choice(self, state: _StreamedChoice, choice):
+        text = _get_field(choice, "text")
+        if text is not None:
+            state.text_parts.append(text)
+
+    def _add_chat_choice(self, state: _StreamedChoice, choice):
+        delta = _get_field(choice, "delta")
+        if delta is None:
+            return
+
+        content = _get_field(delta, "content")
+        if content is not None:
+            state.text_parts.append(content)
+
+        function_call = _get_field(delta, "function_call")
+        if function_call is not None:
+            state.add_function_call(function_call)
+
+        for tool_call in _get_field(delta, "tool_calls") or []:
+            state.add_tool_call(tool_call)
+
+    def get_result(self):
+        """Returns the model, the time of the first chunk and the output of the last choice."""
+        if not self._choices:
+            return self.model, self.completion_start_time, None if self._is_chat else ""
+
+        choice = self._choices[max(self._choices)]
+        completion = (
+            choice.get_chat_response() if self._is_chat else "".join(choice.text_parts)
+        )
+
+        return self.model, self.completion_start_time, completion
+
+
+def _extract_completion_output(response):
+    choices = _get_field(response, "choices") or []
+
+    return _get_field(choices[-1], "text") if choices else None
+
+
+def _extract_chat_output(response):
+    choices = _get_field(response, "choices") or []
+    if not choices:
         return None
 
-    return (
-        model,
-        completion_start_time,
-        get_response_for_chat() if resource.type == "chat" else completion,
-    )
+    message = _get_field(choices[-1], "message")
 
+    return _extract_chat_response(message.__dict__) if _IS_OPENAI_V1 else message
 
-def _get_langfuse_data_from_default_response(resource: OpenAiDefinition, response):
-    model = response.get("model", None)
 
-    completion = None
-    if resource.type == "completion":
-        choices = response.get("choices", [])
-        if len(choices) > 0:
-            choice = choices[-1]
+def _extract_embedding_input(input):
+    # like the output, only the number of inputs is logged with a short preview of the first texts
+    if input is None:
+        return None
 
-            completion = choice.text if _is_openai_v1() else choice.get("text", None)
-    elif resource.type == "chat":
-        choices = response.get("choices", [])
-        if len(choices) > 0:
-            choice = choices[-1]
-            completion = (
-                _extract_chat_response(choice.message.__dict__)
-                if _is_openai_v1()
-                else choice.get("message", None)
-            )
+    # a single text or a single token array
+    if isinstance(input, str) or (
+        isinstance(input, list) and input and isinstance(input[0], int)
+    ):
+        input = [input]
+
+    preview = [
+        text[:EMBEDDING_INPUT_PREVIEW_LENGTH]
+        for text in input[:EMBEDDING_INPUT_PREVIEW_COUNT]
+        if isinstance(text, str)
+    ]
 
-    usage = response.get("usage", None)
+    return {"count": len(input), **({"preview": preview} if preview else {})}
 
-    return model, completion, usage.__dict__ if _is_openai_v1() else usage
+
+def _extract_embedding_output(response):
+    # the vectors are not logged, only their number and dimensions
+    data = _get_field(response, "data") or []
+    embedding = _get_field(data[0], "embedding") if data else None
+
+    return {
+        "count": len(data),
+        # base64 encoded vectors are strings, their length is not the dimension
+        "dimensions": len(embedding) if isinstance(embedding, list) else None,
+    }
+
+
+_DEFAULT_RESPONSE_EXTRACTORS = {
+    "chat": _extract_chat_output,
+    "completion": _extract_completion_output,
+    "embedding": _extract_embedding_output,
+}
+
+
+def _get_langfuse_data_from_default_response(resource: OpenAiDefinition, response):
+    extract_output = _DEFAULT_RESPONSE_EXTRACTORS.get(resource.type)
+    completion = extract_output(response) if extract_output is not None else None
+
+    usage = _get_field(response, "usage")
+    if _IS_OPENAI_V1 and usage is not None:
+        usage = usage.__dict__
+
+    return _get_field(response, "model"), completion, usage
 
 
 def _is_openai_v1():
-    return Version(openai.__version__) >= Version("1.0.0")
+    return _IS_OPENAI_V1
 
 
 def _is_streaming_response(response):
-    return (
-        isinstance(response, types.GeneratorType)
-        or isinstance(response, types.AsyncGeneratorType)
-        or (_is_openai_v1() and isinstance(response, openai.Stream))
-        or (_is_openai_v1() and isinstance(response, openai.AsyncStream))
-    )
+    return isinstance(response, _STREAM_TYPES)
+
+
+class _DeferredGeneration:
+    """Stands in for the generation of a call until the call completes, then creates it with a single event.
+
+    Used instead of a generation-create event when the call starts followed by a generation-update event when it
+    ends. With a `rollup`, successful calls are summed into the rolled up generation instead.
+    """
+
+    def __init__(
+        self,
+        langfuse: Langfuse,
+        params: dict,
+        rollup: Optional["_GenerationRollup"] = None,
+    ):
+        self._langfuse = langfuse
+        self._params = params
+        self._rollup = rollup
+        self._generation: Optional[StatefulGenerationClient] = None
+        self.trace_id = params["trace_id"]
+
+    def update(self, **kwargs):
+        if self._generation is not None:
+            return self._generation.update(**kwargs)
+
+        params = {
+            **self._params,
+            **{key: value for key, value in kwargs.items() if value is not None},
+        }
+
+        # errors are not rolled up, they are created on their own like without aggregation
+        if self._rollup is not None and params.get("level", None) != "ERROR":
+            self._rollup.add(self._langfuse, params)
+
+            return None
+
+        self._generation = self._langfuse.generation(**params)
+
+        return self._generation
+
+
+class _RollupSummary:
+    __slots__ = ("langfuse", "params", "created_at", "calls", "end_time", "usage")
+
+    def __init__(self, langfuse: Langfuse, params: dict, created_at: float):
+        self.langfuse = langfuse
+        self.params = params
+        self.created_at = created_at
+        self.calls = 0
+        self.end_time = None
+        self.usage: dict = {}
+
+
+class _GenerationRollup:
+    """Sums calls with the same name and model in the same trace and parent observation into one generation.
+
+    The summarized generation spans from the start of the first to the end of the last call and has the summed
+    usage and the number of calls in its metadata, inputs and outputs of the calls are not kept. It is created
+    `window` seconds after its first call by a background thread, when the integration or the Langfuse client is
+    flushed or shut down, before its trace is decided for tail sampling, or at exit.
+    """
+
+    def __init__(self, window: float = DEFAULT_ROLLUP_WINDOW):
+        self._window = window
+        self._lock = threading.Lock()
+        # ordered by creation, expired summaries are always at the front
+        self._summaries: "OrderedDict[tuple, _RollupSummary]" = OrderedDict()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        # the task managers that flush the rollup, each client registers it once
+        self._task_managers: "weakref.WeakSet" = weakref.WeakSet()
+
+    def add(self, langfuse: Langfuse, params: dict):
+        key = (
+            params.get("trace_id", None),
+            params.get("parent_observation_id", None),
+            params.get("name", None),
+            params.get("model", None),
+        )
+        now = time.monotonic()
+
+        with self._lock:
+            if self._thread is None:
+                # registered after the client, so it runs before the client is shut down
+                atexit.register(self.shutdown)
+                self._thread = threading.Thread(
+                    target=self._run, name="langfuse-openai-rollup", daemon=True
+                )
+                self._thread.start()
+
+            if langfuse.task_manager not in self._task_managers:
+                self._task_managers.add(langfuse.task_manager)
+                langfuse.task_manager.add_flush_callback(self.flush)
+
+            summary = self._summaries.get(key)
+            if summary is None:
+                summary = self._summaries[key] = _RollupSummary(
+                    langfuse,
+                    {
+                        name: params.get(name, None)
+                        for name in (
+                            "name",
+                            "trace_id",
+                            "parent_observation_id",
+                            "user_id",
+                            "start_time",
+                            "model",
+                            "model_parameters",
+                            "metadata",
+                        )
+                    },
+                    now,
+                )
+
+            summary.calls += 1
+            summary.end_time = params.get("end_time", None)
+            _add_usage(summary.usage, params.get("usage", None))
+
+    def create_expired(self):
+        """Create the generations of the summaries whose window has passed."""
+        now = time.monotonic()
+        ready = []
+
+        with self._lock:
+            while self._summaries:
+                summary = next(iter(self._summaries.values()))
+                if now - summary.created_at < self._window:
+                    break
+
+                ready.append(self._summaries.popitem(last=False)[1])
+
+        for summary in ready:
+            self._create(summary)
+
+    def flush(self, trace_id: Optional[str] = None):
+        """Create the generations of all summaries, or only of the summaries of a trace."""
+        with self._lock:
+            if trace_id is None:
+                ready = list(self._summaries.values())
+                self._summaries.clear()
+            else:
+                keys = [key for key in self._summaries if key[0] == trace_id]
+                ready = [self._summaries.pop(key) for key in keys]
+
+        for summary in ready:
+            self._create(summary)
+
+    def shutdown(self):
+        self._stopped.set()
+        self.flush()
+
+    def _run(self):
+        while not self._stopped.wait(min(ROLLUP_CHECK_INTERVAL, self._window)):
+            try:
+                self.create_expired()
+            except Exception as e:
+                log.exception(e)
+
+    def _create(self, summary: _RollupSummary):
+        summary.langfuse.generation(
+            **{
+                **summary.params,
+                "metadata": {
+                    **(summary.params["metadata"] or {}),
+                    "rollup_calls": summary.calls,
+                },
+            },
+            end_time=summary.end_time,
+            usage=summary.usage or None,
+        )
+
+
+def _add_usage(total: dict, usage):
+    if usage is None:
+        return
+
+    try:
+        usage = _convert_usage_input(usage)
+    except Exception as e:
+        log.exception(e)
+
+        return
+
+    for key in ("input", "output", "total"):
+        value = usage.get(key, None)
+        if isinstance(value, int):
+            total[key] = total.get(key, 0) + value
+
+    if usage.get("unit", None) is not None:
+        total.setdefault("unit", usage["unit"])
+
+
+_generation_rollup = _GenerationRollup()
+
+
+def _start_generation(langfuse: Langfuse, params: dict):
+    if openai.langfuse_rollup_generations:
+        return _DeferredGeneration(langfuse, params, _generation_rollup)
+
+    if openai.langfuse_aggregate_generations:
+        return _DeferredGeneration(langfuse, params)
+
+    return langfuse.generation(**params)
 
 
 @_langfuse_wrapper
@@ -483,7 +867,7 @@ def _wrap(open_ai_resource: OpenAiDefinition, initialize, wrapped, args, kwargs)
     generation, is_nested_trace = _get_langfuse_data_from_kwargs(
         open_ai_resource, new_langfuse, start_time, arg_extractor.get_langfuse_args()
     )
-    generation = new_langfuse.generation(**generation)
+    generation = _start_generation(new_langfuse, generation)
     try:
         openai_response = wrapped(**arg_extractor.get_openai_args())
 
@@ -498,8 +882,7 @@ def _wrap(open_ai_resource: OpenAiDefinition, initialize, wrapped, args, kwargs)
 
         else:
             model, completion, usage = _get_langfuse_data_from_default_response(
-                open_ai_resource,
-                openai_response.__dict__ if _is_openai_v1() else openai_response,
+                open_ai_resource, openai_response
             )
             generation.update(
                 model=model, output=completion, end_time=_get_timestamp(), usage=usage
@@ -533,7 +916,7 @@ async def _wrap_async(
     generation, is_nested_trace = _get_langfuse_data_from_kwargs(
         open_ai_resource, new_langfuse, start_time, arg_extractor.get_langfuse_args()
     )
-    generation = new_langfuse.generation(**generation)
+    generation = _start_generation(new_langfuse, generation)
     try:
         openai_response = await wrapped(**arg_extractor.get_openai_args())
 
@@ -548,8 +931,7 @@ async def _wrap_async(
 
         else:
             model, completion, usage = _get_langfuse_data_from_default_response(
-                open_ai_resource,
-                openai_response.__dict__ if _is_openai_v1() else openai_response,
+                open_ai_resource, openai_response
             )
             generation.update(
                 model=model,
@@ -588,10 +970,11 @@ class OpenAILangfuse:
         return self._langfuse
 
     def flush(cls):
+        _generation_rollup.flush()
         cls._langfuse.flush()
 
     def register_tracing(self):
-        resources = OPENAI_METHODS_V1 if _is_openai_v1() else OPENAI_METHODS_V0
+        resources = OPENAI_METHODS_V1 if _IS_OPENAI_V1 else OPENAI_METHODS_V0
 
         for resource in resources:
             wrap_function_wrapper(
@@ -606,6 +989,9 @@ class OpenAILangfuse:
         setattr(openai, "langfuse_secret_key", None)
         setattr(openai, "langfuse_host", None)
         setattr(openai, "langfuse_debug", None)
+        setattr(openai, "langfuse_image_placeholder", False)
+        setattr(openai, "langfuse_aggregate_generations", False)
+        setattr(openai, "langfuse_rollup_generations", False)
         setattr(openai, "flush_langfuse", self.flush)
 
 
@@ -620,22 +1006,67 @@ def auth_check():
     return modifier._langfuse.auth_check()
 
 
-def _filter_image_data(messages: List[dict]):
+def _filter_image_data(messages: List[dict], placeholder: bool = False):
     """https://platform.openai.com/docs/guides/vision?lang=python
 
     The messages array remains the same, but the 'image_url' is removed from the 'content' array.
     It should only be removed if the value starts with 'data:image/jpeg;base64,'
 
+    With `placeholder`, the 'image_url' is replaced by the mime type, size in bytes and sha256 of the image instead.
+    The input is not modified, only the messages and content parts that contain an image are copied, messages
+    without images are returned as they are.
     """
-    output_messages = copy.deepcopy(messages)
-
-    for message in output_messages:
-        if message.get("content", None) is not None:
-            content = message["content"]
-            for index, item in enumerate(content):
-                if isinstance(item, dict) and item.get("image_url", None) is not None:
-                    url = item["image_url"]["url"]
-                    if url.startswith("data:image/"):
-                        del content[index]["image_url"]
-
-    return output_messages
+    output_messages = None
+
+    for message_index, message in enumerate(messages):
+        content = message.get("content", None) if isinstance(message, dict) else None
+        if not isinstance(content, list):
+            continue
+
+        output_content = None
+        for index, item in enumerate(content):
+            if not isinstance(item, dict):
+                continue
+
+            image_url = item.get("image_url", None)
+            if not isinstance(image_url, dict):
+                continue
+
+            url = image_url.get("url", None)
+            if not isinstance(url, str) or not url.startswith("data:image/"):
+                continue
+
+            if output_content is None:
+                output_content = list(content)
+
+            redacted = {key: value for key, value in item.items() if key != "image_url"}
+            if placeholder:
+                redacted["image_url"] = _get_image_placeholder(image_url)
+
+            output_content[index] = redacted
+
+        if output_content is not None:
+            if output_messages is None:
+                output_messages = list(messages)
+
+            output_messages[message_index] = {**message, "content": output_content}
+
+    return messages if output_messages is None else output_messages
+
+
+def _get_image_placeholder(image_url: dict):
+    header, _, data = image_url["url"].partition(",")
+    placeholder = {"mime_type": header[len("data:") :].split(";")[0]}
+
+    try:
+        image = base64.b64decode(data)
+        placeholder.update(size=len(image), sha256=hashlib.sha256(image).hexdigest())
+    except (binascii.Error, ValueError):
+        # not valid base64, the size is estimated from the encoded length and there is no image to hash
+        padding = len(data) - len(data.rstrip("="))
+        placeholder["size"] = len(data) * 3 // 4 - padding
+
+    if image_url.get("detail", None) is not None:
+        placeholder["detail"] = image_url["detail"]
+
+    return placeholder
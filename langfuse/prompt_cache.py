@@ -1,43 +1,472 @@
 """@private
 """
 
-from datetime import datetime
-from typing import Optional, Dict
+import asyncio
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from queue import Queue
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple, TypeVar
 
-from langfuse.model import PromptClient
+from langfuse.api.resources.prompts import Prompt_Chat, Prompt_Text
+from langfuse.model import ChatPromptClient, PromptClient, TextPromptClient
+from langfuse.serializer import serialize
 
 
 DEFAULT_PROMPT_CACHE_TTL_SECONDS = 60
 
+DEFAULT_PROMPT_CACHE_MAX_ENTRIES = 1_000
+
+DEFAULT_PROMPT_CACHE_MAX_BYTES = 32_000_000
+
+DEFAULT_PROMPT_CACHE_REFRESH_WORKERS = 1
+
+DEFAULT_PROMPT_PREFETCH_WORKERS = 8
+
+# snapshots with a different format version are ignored
+PROMPT_CACHE_SNAPSHOT_VERSION = 1
+
+T = TypeVar("T")
+
 
 class PromptCacheItem:
     def __init__(self, prompt: PromptClient, ttl_seconds: int):
         self.value = prompt
-        self._expiry = ttl_seconds + self.get_epoch_seconds()
+        self._expiry = ttl_seconds + self.get_current_time()
+        self.size = self.estimate_size(prompt)
 
     def is_expired(self) -> bool:
-        return self.get_epoch_seconds() > self._expiry
+        return self.get_current_time() > self._expiry
+
+    def mark_expired(self):
+        self._expiry = float("-inf")
 
     @staticmethod
-    def get_epoch_seconds() -> int:
-        return int(datetime.now().timestamp())
+    def get_current_time() -> float:
+        # monotonic so that expiry is not affected by changes of the system clock
+        return time.monotonic()
 
+    @staticmethod
+    def estimate_size(prompt: PromptClient) -> int:
+        """Approximate memory size of a prompt in bytes, based on its encoded prompt and config."""
+        try:
+            return len(serialize([prompt.name, prompt.prompt, prompt.config]))
+        except Exception:
+            return len(str(prompt.prompt))
 
-class PromptCache:
-    _cache: Dict[str, PromptCacheItem]
+
+class PromptCacheRefreshConsumer(threading.Thread):
+    _log = logging.getLogger("langfuse")
+    _queue: Queue
+    _identifier: int
+
+    def __init__(self, queue: Queue, identifier: int):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._queue = queue
+        self._identifier = identifier
+
+    def run(self):
+        while True:
+            task = self._queue.get()
+
+            self._log.debug(
+                f"PromptCacheRefreshConsumer {self._identifier} processing task"
+            )
+            try:
+                task()
+            # the cached prompt is kept and served until a refresh succeeds
+            except Exception as e:
+                self._log.warning(
+                    f"PromptCacheRefreshConsumer {self._identifier} encountered an error, cache was not refreshed: {e}"
+                )
+            finally:
+                self._queue.task_done()
+
+
+class PromptCacheTaskManager:
+    """Runs prompt refreshes and snapshot writes on a small pool of daemon threads, one refresh per cache key at a time."""
+
+    _log = logging.getLogger("langfuse")
+    _consumers: List[PromptCacheRefreshConsumer]
+    _threads: int
+    _queue: Queue
+    _processing_keys: Set[str]
+
+    def __init__(self, threads: int = DEFAULT_PROMPT_CACHE_REFRESH_WORKERS):
+        self._threads = threads
+        self._queue = Queue()
+        self._consumers = []
+        self._processing_keys = set()
+        self._lock = threading.Lock()
+
+    def add_task(self, key: str, task: Callable[[], None]) -> bool:
+        """Schedule `task` unless a refresh of `key` is already scheduled, return whether it was scheduled."""
+        with self._lock:
+            if key in self._processing_keys:
+                return False
+
+            self._processing_keys.add(key)
+            self._start_consumers()
+
+        self._log.debug(f"Submitting refresh task for key: {key}")
+        self._queue.put(lambda: self._run_task(key, task))
+
+        return True
+
+    def add_background_task(self, task: Callable[[], None]):
+        """Schedule `task` without deduplication, for tasks that coalesce repeated calls themselves."""
+        with self._lock:
+            self._start_consumers()
+
+        self._queue.put(task)
+
+    def _start_consumers(self):
+        # threads are only started once the first task is scheduled
+        if not self._consumers:
+            for i in range(self._threads):
+                consumer = PromptCacheRefreshConsumer(self._queue, i)
+                consumer.start()
+                self._consumers.append(consumer)
+
+    def wait_for_completion(self):
+        """Block until all scheduled refreshes are done."""
+        self._queue.join()
+
+    def _run_task(self, key: str, task: Callable[[], None]):
+        try:
+            task()
+        finally:
+            with self._lock:
+                self._processing_keys.discard(key)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key across threads into a single call.
+
+    The first caller of a key runs the function, callers arriving while it runs wait for it and share its result
+    or exception.
+    """
+
+    _calls: Dict[str, _Call]
 
     def __init__(self):
-        self._cache = {}
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key: str, func: Callable[[], T]) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+
+            return call.result
+
+        try:
+            call.result = func()
+
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """Coalesces concurrent calls with the same key on one event loop into a single awaited call."""
+
+    _futures: Dict[str, asyncio.Future]
+
+    def __init__(self):
+        self._futures = {}
+
+    async def do(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        future = self._futures.get(key)
+        if future is not None:
+            # a waiter being cancelled must not cancel the shared call
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._futures[key] = future
+        try:
+            result = await func()
+            future.set_result(result)
+
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # marks the exception as retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._futures[key]
+
+
+class PromptCache:
+    """LRU cache of prompts, bounded by the number of entries and their approximate size in bytes.
+
+    All methods can be called concurrently from threads and event loops, the lock is only held for dict operations.
+    With a `snapshot_path`, the cache is written to that file after prompts are set so that the next process can
+    start from it with `load_snapshot`. The write runs on a refresh worker, prompts set while a write is pending
+    are included in it, and a pending write is done at exit.
+    """
+
+    _log = logging.getLogger("langfuse")
+    _cache: "OrderedDict[str, PromptCacheItem]"
+    _task_manager: PromptCacheTaskManager
+
+    def __init__(
+        self,
+        refresh_workers: int = DEFAULT_PROMPT_CACHE_REFRESH_WORKERS,
+        max_entries: int = DEFAULT_PROMPT_CACHE_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_PROMPT_CACHE_MAX_BYTES,
+        snapshot_path: Optional[str] = None,
+    ):
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._snapshot_path = snapshot_path
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_dirty = False
+        self._snapshot_scheduled = False
+        self._snapshot_registered = False
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._size = 0
+        self._hits = 0
+        self._stale_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._task_manager = PromptCacheTaskManager(threads=refresh_workers)
 
     def get(self, key: str) -> Optional[PromptCacheItem]:
-        return self._cache.get(key, None)
+        with self._lock:
+            item = self._cache.get(key, None)
+            if item is None:
+                self._misses += 1
+                return None
+
+            self._cache.move_to_end(key)
+            if item.is_expired():
+                self._stale_hits += 1
+            else:
+                self._hits += 1
+
+            return item
 
     def set(self, key: str, value: PromptClient, ttl_seconds: Optional[int]):
         if ttl_seconds is None:
             ttl_seconds = DEFAULT_PROMPT_CACHE_TTL_SECONDS
 
-        self._cache[key] = PromptCacheItem(value, ttl_seconds)
+        self._insert(key, PromptCacheItem(value, ttl_seconds))
+
+        if self._snapshot_path is not None:
+            self._schedule_snapshot()
+
+    def _insert(self, key: str, item: PromptCacheItem):
+        with self._lock:
+            previous = self._cache.pop(key, None)
+            if previous is not None:
+                self._size -= previous.size
+
+            self._cache[key] = item
+            self._size += item.size
+
+            # the new entry is kept even if it exceeds max_bytes on its own
+            while len(self._cache) > 1 and (
+                len(self._cache) > self._max_entries or self._size > self._max_bytes
+            ):
+                _, evicted = self._cache.popitem(last=False)
+                self._size -= evicted.size
+                self._evictions += 1
+
+    def _schedule_snapshot(self):
+        with self._lock:
+            self._snapshot_dirty = True
+            if self._snapshot_scheduled:
+                return
+
+            self._snapshot_scheduled = True
+            register = not self._snapshot_registered
+            self._snapshot_registered = True
+
+        if register:
+            atexit.register(self.flush_snapshot)
+
+        self._task_manager.add_background_task(self._write_scheduled_snapshot)
+
+    def _write_scheduled_snapshot(self):
+        # prompts set from now on schedule the next write
+        with self._lock:
+            self._snapshot_scheduled = False
+
+        self.flush_snapshot()
+
+    def flush_snapshot(self):
+        """Write the snapshot if prompts were set since it was last written."""
+        with self._snapshot_lock:
+            with self._lock:
+                if not self._snapshot_dirty:
+                    return
+
+                self._snapshot_dirty = False
+
+            self._write_snapshot()
+
+    def save_snapshot(self):
+        """Atomically write the cached prompts to `snapshot_path`, errors are logged."""
+        with self._snapshot_lock:
+            with self._lock:
+                self._snapshot_dirty = False
+
+            self._write_snapshot()
+
+    def _write_snapshot(self):
+        # the snapshot lock is held, so the latest snapshot is always the one that replaces the file last
+        with self._lock:
+            entries = [
+                {
+                    "key": key,
+                    "type": "chat"
+                    if isinstance(item.value, ChatPromptClient)
+                    else "text",
+                    "name": item.value.name,
+                    "version": item.value.version,
+                    "prompt": item.value.prompt,
+                    "config": item.value.config,
+                }
+                for key, item in self._cache.items()
+            ]
+
+        try:
+            data = serialize(
+                {"version": PROMPT_CACHE_SNAPSHOT_VERSION, "prompts": entries}
+            )
+            directory = os.path.dirname(os.path.abspath(self._snapshot_path))
+            # a complete snapshot replaces the previous one, readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                    f.flush()
+                    # the data is on disk before the rename, a crash cannot leave an empty snapshot behind
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self._snapshot_path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        except Exception as e:
+            self._log.warning(f"Failed to write prompt cache snapshot: {e}")
+
+    def load_snapshot(self) -> List[str]:
+        """Load the prompts of the snapshot at `snapshot_path` as expired entries, return their cache keys.
+
+        Prompts that are already cached are kept. A missing, corrupted or incompatible snapshot is ignored.
+        """
+        if self._snapshot_path is None or not os.path.exists(self._snapshot_path):
+            return []
+
+        try:
+            with open(self._snapshot_path, "rb") as f:
+                snapshot = json.loads(f.read())
+
+            if snapshot.get("version") != PROMPT_CACHE_SNAPSHOT_VERSION:
+                self._log.warning(
+                    f"Ignoring prompt cache snapshot with unsupported version {snapshot.get('version')}"
+                )
+                return []
+
+            loaded = []
+            for entry in snapshot["prompts"]:
+                key = entry["key"]
+                with self._lock:
+                    if key in self._cache:
+                        continue
+
+                if entry["type"] == "chat":
+                    prompt = ChatPromptClient(
+                        Prompt_Chat(
+                            name=entry["name"],
+                            version=entry["version"],
+                            prompt=entry["prompt"],
+                            config=entry["config"],
+                        )
+                    )
+                else:
+                    prompt = TextPromptClient(
+                        Prompt_Text(
+                            name=entry["name"],
+                            version=entry["version"],
+                            prompt=entry["prompt"],
+                            config=entry["config"],
+                        )
+                    )
+
+                item = PromptCacheItem(prompt, 0)
+                # served as a fallback until revalidated
+                item.mark_expired()
+                self._insert(key, item)
+                loaded.append(key)
+
+            self._log.debug(
+                f"Loaded {len(loaded)} prompts from the prompt cache snapshot"
+            )
+
+            return loaded
+        except Exception as e:
+            self._log.warning(f"Failed to load prompt cache snapshot: {e}")
+
+            return []
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._cache),
+                "bytes": self._size,
+                "hits": self._hits,
+                "stale_hits": self._stale_hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+            }
+
+    def add_refresh_prompt_task(self, key: str, fetch_func: Callable[[], None]):
+        """Refresh the prompt of `key` in the background, concurrent refreshes of the same key are skipped."""
+        self._task_manager.add_task(key, fetch_func)
+
+    def wait_for_refresh_completion(self):
+        self._task_manager.wait_for_completion()
 
     @staticmethod
     def generate_cache_key(name: str, version: Optional[int]) -> str:
         return f"{name}-{version or 'latest'}"
+
+    @staticmethod
+    def parse_cache_key(key: str) -> Tuple[str, Optional[int]]:
+        """Inverse of `generate_cache_key`."""
+        name, version = key.rsplit("-", 1)
+
+        return name, None if version == "latest" else int(version)
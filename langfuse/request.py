@@ -1,14 +1,33 @@
-"""@private
-"""
+"""@private"""
 
+import gzip
 import json
 import logging
 from base64 import b64encode
-from typing import Any, List, Union
+from typing import Any, List, Literal, NamedTuple, Optional, Tuple, Union
 
 import httpx
 
-from langfuse.serializer import EventSerializer
+from langfuse.serializer import serialize
+
+# zstandard is optional, without it zstd compression falls back to gzip
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# bodies smaller than this are sent uncompressed, compressing them costs more than it saves
+DEFAULT_COMPRESSION_MIN_SIZE = 1024
+
+CompressionType = Literal["gzip", "zstd"]
+
+
+class PreparedRequest(NamedTuple):
+    """Url, encoded and possibly compressed body and headers of an ingestion request, reused across retries"""
+
+    url: str
+    data: bytes
+    headers: dict
 
 
 class LangfuseClient:
@@ -18,6 +37,8 @@ class LangfuseClient:
     _version: str
     _timeout: int
     _session: httpx.Client
+    _compression: Optional[CompressionType]
+    _compression_min_size: int
 
     def __init__(
         self,
@@ -27,6 +48,8 @@ class LangfuseClient:
         version: str,
         timeout: int,
         session: httpx.Client,
+        compression: Optional[CompressionType] = None,
+        compression_min_size: int = DEFAULT_COMPRESSION_MIN_SIZE,
     ):
         self._public_key = public_key
         self._secret_key = secret_key
@@ -34,6 +57,19 @@ class LangfuseClient:
         self._version = version
         self._timeout = timeout
         self._session = session
+        self._compression = compression
+        self._compression_min_size = compression_min_size
+
+        if compression not in (None, "gzip", "zstd"):
+            raise ValueError(
+                f"Unsupported compression '{compression}', use 'gzip' or 'zstd'"
+            )
+
+        if compression == "zstd" and zstandard is None:
+            logging.getLogger("langfuse").warning(
+                "zstandard is not installed, falling back to gzip compression"
+            )
+            self._compression = "gzip"
 
     def generate_headers(self):
         return {
@@ -47,21 +83,26 @@ class LangfuseClient:
             "x_langfuse_public_key": self._public_key,
         }
 
-    def batch_post(self, **kwargs) -> httpx.Response:
-        """Post the `kwargs` to the batch API endpoint for events"""
-        logging.debug("uploading data: %s", kwargs)
-        res = self.post(**kwargs)
+    def prepare_batch(self, **kwargs) -> PreparedRequest:
+        """Encode and compress the `kwargs` once, so that retries of `batch_post` send the same bytes"""
+        return PreparedRequest(*self._prepare_request(kwargs))
+
+    def batch_post(
+        self, request: Optional[PreparedRequest] = None, **kwargs
+    ) -> httpx.Response:
+        """Post the `kwargs` or a prepared request to the batch API endpoint for events"""
+        logging.debug("uploading data: %s", request or kwargs)
+        res = self.post(request, **kwargs)
         return self._process_response(
             res, success_message="data uploaded successfully", return_json=False
         )
 
-    def post(self, **kwargs) -> httpx.Response:
-        """Post the `kwargs` to the API"""
+    def post(
+        self, request: Optional[PreparedRequest] = None, **kwargs
+    ) -> httpx.Response:
+        """Post the `kwargs` or a prepared request to the API"""
         log = logging.getLogger("langfuse")
-        url = self._remove_trailing_slash(self._base_url) + "/api/public/ingestion"
-        data = json.dumps(kwargs, cls=EventSerializer)
-        log.debug("making request: %s to %s", data, url)
-        headers = self.generate_headers()
+        url, data, headers = request or self._prepare_request(kwargs)
         res = self._session.post(
             url, content=data, headers=headers, timeout=self._timeout
         )
@@ -71,6 +112,46 @@ class LangfuseClient:
 
         return res
 
+    def _prepare_request(self, body: dict) -> Tuple[str, bytes, dict]:
+        """Returns the url, the encoded and possibly compressed body and the headers of an ingestion request"""
+        log = logging.getLogger("langfuse")
+        url = self._remove_trailing_slash(self._base_url) + "/api/public/ingestion"
+        data = self._encode_body(body)
+        log.debug("making request: %s to %s", data, url)
+        headers = self.generate_headers()
+
+        data, content_encoding = self._compress(data)
+        if content_encoding is not None:
+            headers["Content-Encoding"] = content_encoding
+
+        return url, data, headers
+
+    @staticmethod
+    def _encode_body(body: dict) -> bytes:
+        """Encodes the request body, splicing in lists of pre-encoded items without re-serializing them"""
+        fields = []
+        for key, value in body.items():
+            if isinstance(value, list) and all(
+                isinstance(item, bytes) for item in value
+            ):
+                encoded_value = b"[" + b", ".join(value) + b"]"
+            else:
+                encoded_value = serialize(value)
+
+            fields.append(json.dumps(key).encode("utf-8") + b": " + encoded_value)
+
+        return b"{" + b", ".join(fields) + b"}"
+
+    def _compress(self, data: bytes) -> Tuple[bytes, Optional[str]]:
+        """Compresses the body if compression is enabled and the body is large enough, returns the content encoding"""
+        if self._compression is None or len(data) < self._compression_min_size:
+            return data, None
+
+        if self._compression == "zstd":
+            return zstandard.ZstdCompressor().compress(data), "zstd"
+
+        return gzip.compress(data, compresslevel=6), "gzip"
+
     def _remove_trailing_slash(self, url: str) -> str:
         """Removes the trailing slash from a URL"""
         if url.endswith("/"):
@@ -91,7 +172,12 @@ class LangfuseClient:
             if len(errors) > 0:
                 raise APIErrors(
                     [
-                        APIError(error["status"], error["message"], error["error"])
+                        APIError(
+                            error["status"],
+                            error["message"],
+                            error["error"],
+                            event_id=error.get("id"),
+                        )
                         for error in errors
                     ]
                 )
@@ -105,11 +191,50 @@ class LangfuseClient:
             raise APIError(res.status_code, res.text)
 
 
+class AsyncLangfuseClient(LangfuseClient):
+    """LangfuseClient variant that uploads with an `httpx.AsyncClient`, used by the AsyncTaskManager"""
+
+    _session: httpx.AsyncClient
+
+    async def batch_post(
+        self, request: Optional[PreparedRequest] = None, **kwargs
+    ) -> httpx.Response:
+        """Post the `kwargs` or a prepared request to the batch API endpoint for events"""
+        logging.debug("uploading data: %s", request or kwargs)
+        res = await self.post(request, **kwargs)
+        return self._process_response(
+            res, success_message="data uploaded successfully", return_json=False
+        )
+
+    async def post(
+        self, request: Optional[PreparedRequest] = None, **kwargs
+    ) -> httpx.Response:
+        """Post the `kwargs` or a prepared request to the API"""
+        log = logging.getLogger("langfuse")
+        url, data, headers = request or self._prepare_request(kwargs)
+        res = await self._session.post(
+            url, content=data, headers=headers, timeout=self._timeout
+        )
+
+        if res.status_code == 200:
+            log.debug("data uploaded successfully")
+
+        return res
+
+
 class APIError(Exception):
-    def __init__(self, status: Union[int, str], message: str, details: Any = None):
+    def __init__(
+        self,
+        status: Union[int, str],
+        message: str,
+        details: Any = None,
+        event_id: Optional[str] = None,
+    ):
         self.message = message
         self.status = status
         self.details = details
+        # the id of the failed event in a partially successful (207) response
+        self.event_id = event_id
 
     def __str__(self):
         msg = "{0} ({1}): {2}"
@@ -0,0 +1,115 @@
+"""@private
+"""
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+DEFAULT_MAX_SAMPLING_DECISIONS = 10_000
+
+# safety net for traces that are never ended, a decision is only evicted from here past this many open traces
+DEFAULT_MAX_OPEN_TRACE_DECISIONS = 100_000
+
+
+class TraceSampler:
+    """Head-based sampling decision per trace id.
+
+    With a `sample_rate`, the decision is derived from a hash of the trace id, so every process and every client
+    with the same rate keeps or drops the same traces, which keeps distributed traces complete. A custom `sampler`
+    is called once per trace id. Its decision is kept until `end` is called for the trace, so observations added
+    to a long-running trace always get the same decision, and is then remembered for the `max_decisions` most
+    recently ended trace ids for events that arrive late.
+    """
+
+    _log = logging.getLogger("langfuse")
+
+    def __init__(
+        self,
+        sample_rate: Optional[float] = None,
+        sampler: Optional[Callable[[str], bool]] = None,
+        max_decisions: int = DEFAULT_MAX_SAMPLING_DECISIONS,
+        max_open_traces: int = DEFAULT_MAX_OPEN_TRACE_DECISIONS,
+    ):
+        if sample_rate is not None and not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("sample_rate must be between 0 and 1")
+
+        self._sample_rate = 1.0 if sample_rate is None else sample_rate
+        self._sampler = sampler
+        self._max_decisions = max_decisions
+        self._max_open_traces = max_open_traces
+        # decisions of traces that have not ended yet, they are not evicted by newer traces
+        self._open: "OrderedDict[str, bool]" = OrderedDict()
+        self._decisions: "OrderedDict[str, bool]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_sampled(self, trace_id: str) -> bool:
+        if self._sampler is None:
+            return self._is_sampled_by_rate(trace_id)
+
+        with self._lock:
+            decision = self._get_decision(trace_id)
+            if decision is not None:
+                return decision
+
+        try:
+            decision = bool(self._sampler(trace_id))
+        except Exception as e:
+            # keeping the trace is the safe default, the data is not lost
+            self._log.exception("error in sampler, keeping trace %s: %s", trace_id, e)
+            decision = True
+
+        with self._lock:
+            # a concurrent call for the same trace id may have decided first
+            existing = self._get_decision(trace_id)
+            if existing is not None:
+                return existing
+
+            self._open[trace_id] = decision
+            if len(self._open) > self._max_open_traces:
+                evicted, _ = self._open.popitem(last=False)
+                self._log.warning(
+                    "More than %d traces are open, forgetting the sampling decision of trace %s. "
+                    "Call end_trace for traces that are complete.",
+                    self._max_open_traces,
+                    evicted,
+                )
+
+        return decision
+
+    def end(self, trace_id: str):
+        """Release the decision of an ended trace, it is remembered for a while for events that arrive late."""
+        if self._sampler is None:
+            return
+
+        with self._lock:
+            decision = self._open.pop(trace_id, None)
+            if decision is None:
+                return
+
+            self._decisions[trace_id] = decision
+            self._decisions.move_to_end(trace_id)
+            while len(self._decisions) > self._max_decisions:
+                self._decisions.popitem(last=False)
+
+    def _get_decision(self, trace_id: str) -> Optional[bool]:
+        decision = self._open.get(trace_id)
+        if decision is not None:
+            return decision
+
+        decision = self._decisions.get(trace_id)
+        if decision is not None:
+            self._decisions.move_to_end(trace_id)
+
+        return decision
+
+    def _is_sampled_by_rate(self, trace_id: str) -> bool:
+        if self._sample_rate >= 1.0:
+            return True
+        if self._sample_rate <= 0.0:
+            return False
+
+        digest = hashlib.sha256(trace_id.encode("utf-8")).digest()
+
+        return int.from_bytes(digest[:8], "big") < self._sample_rate * 2**64
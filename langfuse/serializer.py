@@ -3,6 +3,7 @@
 
 from datetime import date, datetime
 from dataclasses import is_dataclass, asdict
+import json
 from json import JSONEncoder
 from typing import Any
 from uuid import UUID
@@ -18,6 +19,12 @@ except ImportError:
     # If Serializable is not available, set it to NoneType
     Serializable = type(None)
 
+# orjson is optional (`pip install langfuse[fast]`), if it is installed it is used as the fast path for encoding events
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 class EventSerializer(JSONEncoder):
     def __init__(self, *args, **kwargs):
@@ -79,3 +86,34 @@ class EventSerializer(JSONEncoder):
     def encode(self, obj: Any) -> str:
         self.seen.clear()  # Clear seen objects before each encode call
         return super().encode(obj)
+
+
+if orjson is not None:
+    # Datetimes and dataclasses are passed to EventSerializer.default to keep the output identical:
+    # naive datetimes are localized and LlamaIndex streaming dataclasses are stringified.
+    _ORJSON_OPTIONS = (
+        orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_DATACLASS
+        | orjson.OPT_NON_STR_KEYS
+    )
+
+
+def serialize(obj: Any) -> bytes:
+    """Serialize an object to UTF-8 encoded JSON bytes.
+
+    Uses orjson if it is installed. Everything orjson cannot encode natively (pydantic models, LangChain
+    `Serializable`, arbitrary objects) is converted by `EventSerializer.default`. If orjson fails altogether,
+    e.g. for integers exceeding 64 bit, the stdlib encoder with `EventSerializer` is used.
+
+    The output is semantically identical to `json.dumps(obj, cls=EventSerializer)` with two exceptions when orjson
+    is used: it is compact and not ASCII-escaped, and NaN/Infinity are encoded as valid JSON `null`.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(
+                obj, default=EventSerializer().default, option=_ORJSON_OPTIONS
+            )
+        except orjson.JSONEncodeError:
+            pass
+
+    return json.dumps(obj, cls=EventSerializer).encode("utf-8")
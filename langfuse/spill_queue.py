@@ -0,0 +1,388 @@
+"""@private
+"""
+
+import logging
+import os
+import struct
+import threading
+import time
+import typing
+import zlib
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+
+# every record is prefixed with the payload length and the CRC32 of the payload
+RECORD_HEADER = struct.Struct("<II")
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".log"
+
+DEFAULT_SEGMENT_MAX_BYTES = 4_000_000
+DEFAULT_SPILL_MAX_BYTES = 256_000_000
+# delay before spilled records are read again after a failed upload, doubled on every failure in a row
+SPILL_RETRY_DELAY = 1.0
+SPILL_MAX_RETRY_DELAY = 60.0
+# records that failed to upload this many times are dropped so that they do not block the queue forever
+DEFAULT_SPILL_MAX_ATTEMPTS = 10
+
+
+class _Segment:
+    """A segment file and the state of reading it."""
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self.records = 0
+        self.read_offset = 0
+        self.fully_read = False
+        self.pending_batches = 0
+        # offsets of records whose upload failed, with their number of failed attempts, in order of the offset
+        self.retry: "OrderedDict[int, int]" = OrderedDict()
+
+
+class SpillBatch:
+    """Records read from one segment, to be passed back to `ack` or `nack` once uploaded."""
+
+    def __init__(
+        self,
+        segment: _Segment,
+        items: List[bytes],
+        offsets: List[int],
+        attempts: List[int],
+    ):
+        self.segment = segment
+        self.items = items
+        # the position and the number of failed attempts of the record of each item
+        self.offsets = offsets
+        self.attempts = attempts
+
+
+class SpillQueue:
+    """Append-only on-disk queue of encoded events, split into segment files.
+
+    Records are stored as `<length><crc32><payload>` so that segments can be read sequentially or mmapped.
+    A segment is deleted once all of its records have been acknowledged, segments left in the directory by
+    a previous process are replayed first. Delivery is at-least-once: records of a segment that was only
+    partially acknowledged when the process died are read again on the next start. A directory must only
+    be used by one process at a time.
+
+    After a failed upload (`nack` or `defer`), no records are read until a retry delay has passed, which grows
+    exponentially while uploads keep failing and is reset by the next `ack`. Only the records that failed are
+    read again, records that failed `max_attempts` times are dropped. Segments are read in turns, so that the
+    records of a failing segment do not hold up the others.
+    """
+
+    _log = logging.getLogger("langfuse")
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = DEFAULT_SPILL_MAX_BYTES,
+        segment_max_bytes: int = DEFAULT_SEGMENT_MAX_BYTES,
+        max_attempts: int = DEFAULT_SPILL_MAX_ATTEMPTS,
+    ):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._segment_max_bytes = segment_max_bytes
+        self._max_attempts = max_attempts
+        self._condition = threading.Condition()
+        self._sealed: List[_Segment] = []
+        self._active: Optional[_Segment] = None
+        self._active_file: Optional[typing.BinaryIO] = None
+        self._size = 0
+        self._closed = False
+        self._retry_delay = 0.0
+        self._retry_at = 0.0
+        # where to continue reading failed records, and whether they are read next
+        self._next_segment = 0
+        self._retry_turn = False
+        self._dropped = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+        next_id = 0
+        for name in sorted(os.listdir(directory)):
+            if not (name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)):
+                continue
+
+            path = os.path.join(directory, name)
+            segment = _Segment(path, os.path.getsize(path))
+            self._sealed.append(segment)
+            self._size += segment.size
+            next_id = int(name[len(SEGMENT_PREFIX) : -len(SEGMENT_SUFFIX)]) + 1
+
+        if self._sealed:
+            self._log.info(
+                "replaying %d spilled segments (%d bytes) from %s",
+                len(self._sealed),
+                self._size,
+                directory,
+            )
+
+        self._next_id = next_id
+
+    def put(self, item: bytes) -> bool:
+        """Append an encoded event, return False if the queue is full or closed."""
+        record_size = RECORD_HEADER.size + len(item)
+        with self._condition:
+            if self._closed or self._size + record_size > self._max_bytes:
+                return False
+
+            if (
+                self._active is not None
+                and self._active.size + record_size > self._segment_max_bytes
+            ):
+                self._seal()
+
+            if self._active is None:
+                self._open_segment()
+
+            self._active_file.write(
+                RECORD_HEADER.pack(len(item), zlib.crc32(item)) + item
+            )
+            # hand the record to the OS so it survives the process, fsync is too costly per event
+            self._active_file.flush()
+            self._active.size += record_size
+            self._active.records += 1
+            self._size += record_size
+            self._condition.notify_all()
+
+            return True
+
+    def get_batch(self, max_items: int, max_bytes: int) -> Optional[SpillBatch]:
+        """Read the next records from a single segment, return None if nothing is left to read.
+
+        The failed records of a segment are read before its unread records, in the order they were written.
+        """
+        with self._condition:
+            if time.monotonic() < self._retry_at:
+                return None
+
+            segment = self._next_readable()
+            if segment is None:
+                return None
+
+            if segment.retry:
+                items, offsets, attempts = self._read_retries(
+                    segment, max_items, max_bytes
+                )
+            else:
+                items, offsets = self._read(segment, max_items, max_bytes)
+                attempts = [0] * len(items)
+
+            if not items:
+                self._release(segment)
+                return None
+
+            segment.pending_batches += 1
+
+            return SpillBatch(segment, items, offsets, attempts)
+
+    def ack(self, batch: SpillBatch):
+        """Mark the records of the batch as delivered."""
+        with self._condition:
+            self._retry_delay = 0.0
+            batch.segment.pending_batches -= 1
+            self._release(batch.segment)
+
+    def nack(self, batch: SpillBatch, failed: Optional[Sequence[int]] = None):
+        """Keep the records of the batch on disk, they are read again after the retry delay.
+
+        Args:
+            batch: The batch that failed to upload.
+            failed: Indexes of the items that failed, e.g. in a partially successful upload. The other items are
+                marked as delivered. Defaults to all items.
+        """
+        if failed is None:
+            failed = range(len(batch.items))
+
+        with self._condition:
+            segment = batch.segment
+            segment.pending_batches -= 1
+            for index in failed:
+                attempts = batch.attempts[index] + 1
+                if attempts >= self._max_attempts:
+                    self._dropped += 1
+                    self._log.warning(
+                        "dropping spilled record at offset %d of %s after %d failed uploads",
+                        batch.offsets[index],
+                        segment.path,
+                        attempts,
+                    )
+                    continue
+
+                segment.retry[batch.offsets[index]] = attempts
+
+            if segment.retry:
+                # keep the records in the order they were written
+                segment.retry = OrderedDict(sorted(segment.retry.items()))
+                self._defer()
+            self._release(segment)
+
+    def defer(self):
+        """Pause reading after an upload failed elsewhere, e.g. for records that were just spilled."""
+        with self._condition:
+            self._defer()
+
+    def get_stats(self) -> dict:
+        with self._condition:
+            segments = len(self._sealed) + (1 if self._active is not None else 0)
+
+            return {
+                "bytes": self._size,
+                "segments": segments,
+                "dropped_records": self._dropped,
+            }
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Block until all readable records have been acknowledged or failed, return False on timeout."""
+        with self._condition:
+            return self._condition.wait_for(self._is_drained, timeout=timeout)
+
+    def close(self):
+        """Close the active segment, records that were not acknowledged stay on disk."""
+        with self._condition:
+            self._closed = True
+            if self._active_file is not None:
+                self._active_file.close()
+                self._active_file = None
+                self._active = None
+            self._condition.notify_all()
+
+    def _defer(self):
+        self._retry_delay = min(
+            max(self._retry_delay * 2, SPILL_RETRY_DELAY), SPILL_MAX_RETRY_DELAY
+        )
+        self._retry_at = time.monotonic() + self._retry_delay
+
+    def _is_drained(self) -> bool:
+        # while uploads are failing the records stay on disk, flushing does not wait for the retry
+        if time.monotonic() < self._retry_at:
+            return True
+
+        if self._active is not None and self._active.records > 0:
+            return False
+
+        return all(
+            segment.retry or (segment.fully_read and segment.pending_batches == 0)
+            for segment in self._sealed
+        )
+
+    def _open_segment(self):
+        path = os.path.join(
+            self._directory, f"{SEGMENT_PREFIX}{self._next_id:020d}{SEGMENT_SUFFIX}"
+        )
+        self._next_id += 1
+        self._active = _Segment(path, 0)
+        self._active_file = open(path, "ab")
+
+    def _seal(self):
+        self._active_file.close()
+        self._sealed.append(self._active)
+        self._active = None
+        self._active_file = None
+
+    def _next_readable(self) -> Optional[_Segment]:
+        # failed and unread records are read in turns, so that failing records do not hold up the others
+        self._retry_turn = not self._retry_turn
+        if self._retry_turn:
+            segment = self._next_with_retries()
+            if segment is not None:
+                return segment
+
+        for segment in self._sealed:
+            if not segment.fully_read:
+                return segment
+
+        # seal the active segment early so that spilled records do not wait for it to fill up
+        if self._active is not None and self._active.records > 0:
+            self._seal()
+            return self._sealed[-1]
+
+        return self._next_with_retries()
+
+    def _next_with_retries(self) -> Optional[_Segment]:
+        # start after the segment whose failed records were read last, so that all failing segments get a turn
+        count = len(self._sealed)
+        for i in range(count):
+            index = (self._next_segment + i) % count
+            if self._sealed[index].retry:
+                self._next_segment = index + 1
+                return self._sealed[index]
+
+        return None
+
+    def _read(
+        self, segment: _Segment, max_items: int, max_bytes: int
+    ) -> typing.Tuple[List[bytes], List[int]]:
+        items = []
+        offsets = []
+        total_size = 0
+        with open(segment.path, "rb") as f:
+            f.seek(segment.read_offset)
+            while len(items) < max_items and total_size < max_bytes:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) == 0:
+                    segment.fully_read = True
+                    break
+
+                if len(header) == RECORD_HEADER.size:
+                    length, crc = RECORD_HEADER.unpack(header)
+                    item = f.read(length)
+                    if len(item) == length and zlib.crc32(item) == crc:
+                        items.append(item)
+                        offsets.append(segment.read_offset)
+                        total_size += length
+                        segment.read_offset = f.tell()
+                        continue
+
+                # a torn write at the end of the segment or corrupted data, the rest of the segment is skipped
+                self._log.warning(
+                    "skipping corrupted record at offset %d of %s",
+                    segment.read_offset,
+                    segment.path,
+                )
+                segment.fully_read = True
+                break
+
+            else:
+                segment.fully_read = f.read(1) == b""
+
+        return items, offsets
+
+    def _read_retries(
+        self, segment: _Segment, max_items: int, max_bytes: int
+    ) -> typing.Tuple[List[bytes], List[int], List[int]]:
+        """Read the failed records of a segment, they are removed from its retries until the batch is nacked."""
+        items = []
+        offsets = []
+        attempts = []
+        total_size = 0
+        with open(segment.path, "rb") as f:
+            while segment.retry and len(items) < max_items and total_size < max_bytes:
+                offset, record_attempts = segment.retry.popitem(last=False)
+                f.seek(offset)
+                length, _ = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                # the record was checked when it was first read
+                items.append(f.read(length))
+                offsets.append(offset)
+                attempts.append(record_attempts)
+                total_size += length
+
+        return items, offsets, attempts
+
+    def _release(self, segment: _Segment):
+        if segment.fully_read and segment.pending_batches == 0 and not segment.retry:
+            try:
+                os.remove(segment.path)
+            except OSError as e:
+                self._log.warning(
+                    "could not remove spill segment %s: %s", segment.path, e
+                )
+            index = self._sealed.index(segment)
+            del self._sealed[index]
+            if index < self._next_segment:
+                self._next_segment -= 1
+            self._size -= segment.size
+
+        self._condition.notify_all()
@@ -0,0 +1,134 @@
+"""@private
+"""
+
+import logging
+import threading
+import typing
+from bisect import bisect_left
+from typing import Callable, Dict, Optional, Sequence
+
+BATCH_SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# same as the default buckets of the Prometheus client
+UPLOAD_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+DEFAULT_STATS_INTERVAL = 10.0
+
+
+class Histogram:
+    """Fixed-bucket histogram, not thread-safe on its own."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self._buckets = tuple(buckets)
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value: float):
+        self._counts[bisect_left(self._buckets, value)] += 1
+        self._sum += value
+        self._count += 1
+
+    def as_dict(self) -> dict:
+        """Cumulative counts per upper bound like Prometheus histograms, the last bound is "+Inf"."""
+        buckets = {}
+        cumulative = 0
+        for bound, count in zip(self._buckets, self._counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        buckets["+Inf"] = cumulative + self._counts[-1]
+
+        return {"buckets": buckets, "sum": self._sum, "count": self._count}
+
+
+class IngestionStats:
+    """Counters and histograms of the ingestion pipeline.
+
+    Every update holds the lock for a few increments only, so the stats are always collected.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {
+            "enqueued": 0,
+            "uploaded_events": 0,
+            "uploaded_batches": 0,
+            "bytes_sent": 0,
+            "failed_batches": 0,
+            "failed_events": 0,
+            "retries": 0,
+            "partial_errors": 0,
+        }
+        self._batch_size = Histogram(BATCH_SIZE_BUCKETS)
+        self._upload_latency = Histogram(UPLOAD_LATENCY_BUCKETS)
+
+    def record_enqueued(self):
+        with self._lock:
+            self._counters["enqueued"] += 1
+
+    def record_upload(self, batch_size: int, size_bytes: int, latency: float):
+        with self._lock:
+            self._counters["uploaded_events"] += batch_size
+            self._counters["uploaded_batches"] += 1
+            self._counters["bytes_sent"] += size_bytes
+            self._batch_size.observe(batch_size)
+            self._upload_latency.observe(latency)
+
+    def record_failed_upload(self, batch_size: int):
+        with self._lock:
+            self._counters["failed_batches"] += 1
+            self._counters["failed_events"] += batch_size
+
+    def record_retry(self):
+        with self._lock:
+            self._counters["retries"] += 1
+
+    def record_partial_errors(self, count: int):
+        with self._lock:
+            self._counters["partial_errors"] += count
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["batch_size"] = self._batch_size.as_dict()
+            stats["upload_latency"] = self._upload_latency.as_dict()
+
+        return stats
+
+
+class StatsReporter(threading.Thread):
+    """Daemon thread passing the stats to an exporter callback every `interval` seconds."""
+
+    _log = logging.getLogger("langfuse")
+
+    def __init__(
+        self,
+        get_stats: Callable[[], dict],
+        callback: Callable[[dict], typing.Any],
+        interval: float = DEFAULT_STATS_INTERVAL,
+    ):
+        threading.Thread.__init__(self, daemon=True)
+        self._get_stats = get_stats
+        self._callback = callback
+        self._interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self._interval):
+            self.report()
+
+    def report(self):
+        try:
+            self._callback(self._get_stats())
+        except Exception as e:
+            self._log.exception("error in stats callback: %s", e)
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop the reporter after reporting the final stats."""
+        if self._stopped.is_set():
+            return
+
+        self._stopped.set()
+        if self.is_alive():
+            self.join(timeout)
+        self.report()
@@ -0,0 +1,298 @@
+"""@private
+"""
+
+import datetime as dt
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, List, Optional
+
+from langfuse.sampling import DEFAULT_MAX_SAMPLING_DECISIONS, TraceSampler
+
+DEFAULT_TAIL_SAMPLING_MAX_TRACE_BYTES = 1_000_000
+DEFAULT_TAIL_SAMPLING_MAX_BYTES = 64_000_000
+DEFAULT_TAIL_SAMPLING_DECISION_WAIT = 30.0
+DEFAULT_TAIL_SAMPLING_MAX_OBSERVATIONS = 100_000
+# upper bound of the delay between the decision wait of a trace passing and the trace being decided
+TAIL_SAMPLING_CHECK_INTERVAL = 1.0
+
+
+class _BufferedTrace:
+    """Events of an undecided trace and the signals the policy decides on."""
+
+    __slots__ = (
+        "items",
+        "size",
+        "created_at",
+        "last_seen",
+        "keep",
+        "start_time",
+        "end_time",
+    )
+
+    def __init__(self, created_at: float):
+        self.items: List[Any] = []
+        self.size = 0
+        self.created_at = created_at
+        self.last_seen = created_at
+        self.keep = False
+        self.start_time: Optional[dt.datetime] = None
+        self.end_time: Optional[dt.datetime] = None
+
+
+class TailSamplingBuffer:
+    """Buffers the events of each trace in memory until it is complete, then sends or discards all of them.
+
+    A trace is kept if any of its observations has level ERROR, if it took longer than `latency_threshold`
+    seconds, or if it has one of `tags`. The latency of a trace is the longer of the span from the first start
+    to the last end time of its events and the time from its first event until `complete` is called, or until its
+    last event if it is decided otherwise. Other traces are kept with probability `sample_rate`, decided from a
+    hash of the trace id like head sampling.
+
+    A trace is decided when `complete` is called for it, `decision_wait` seconds after its first event, or when it
+    is evicted to stay within `max_bytes`. Traces larger than `max_trace_bytes` are kept without waiting, a trace
+    that cannot be buffered is not dropped. Events that arrive after the decision follow it. Update events only
+    carry the observation id, its trace is looked up from the create event of the observation.
+    """
+
+    _log = logging.getLogger("langfuse")
+
+    def __init__(
+        self,
+        sample_rate: float = 0.0,
+        latency_threshold: Optional[float] = None,
+        tags: Optional[Iterable[str]] = None,
+        max_trace_bytes: int = DEFAULT_TAIL_SAMPLING_MAX_TRACE_BYTES,
+        max_bytes: int = DEFAULT_TAIL_SAMPLING_MAX_BYTES,
+        decision_wait: float = DEFAULT_TAIL_SAMPLING_DECISION_WAIT,
+    ):
+        self._healthy_sampler = TraceSampler(sample_rate=sample_rate)
+        self._latency_threshold = latency_threshold
+        self._tags = frozenset(tags or ())
+        self._max_trace_bytes = max_trace_bytes
+        self._max_bytes = max_bytes
+        self._decision_wait = decision_wait
+        self._lock = threading.Lock()
+        # in order of the first event, the oldest traces are decided first
+        self._pending: "OrderedDict[str, _BufferedTrace]" = OrderedDict()
+        self._decisions: "OrderedDict[str, bool]" = OrderedDict()
+        self._observation_traces: "OrderedDict[str, str]" = OrderedDict()
+        self._size = 0
+        self._kept_traces = 0
+        self._discarded_traces = 0
+        self._discarded_events = 0
+
+    def add(self, event: dict, item: Any, size: int) -> List[Any]:
+        """Buffer the queue item of an event, return the items that can be enqueued now."""
+        body = event.get("body")
+        if not isinstance(body, dict):
+            return [item]
+
+        now = time.monotonic()
+        with self._lock:
+            trace_id = self._get_trace_id(event.get("type"), body)
+            if trace_id is None:
+                return [item]
+
+            ready = self._decide_expired(now)
+
+            decision = self._decisions.get(trace_id)
+            if decision is not None:
+                if decision:
+                    ready.append(item)
+                else:
+                    self._discarded_events += 1
+
+                return ready
+
+            trace = self._pending.get(trace_id)
+            if trace is None:
+                trace = self._pending[trace_id] = _BufferedTrace(now)
+
+            trace.last_seen = now
+            self._observe(trace, body)
+            trace.items.append(item)
+            trace.size += size
+            self._size += size
+
+            if trace.size > self._max_trace_bytes:
+                self._log.debug(
+                    "trace %s exceeds the tail sampling budget, keeping it", trace_id
+                )
+                trace.keep = True
+                ready.extend(self._decide(trace_id))
+
+            while self._size > self._max_bytes and self._pending:
+                ready.extend(self._decide(next(iter(self._pending))))
+
+            return ready
+
+    def complete(self, trace_id: str) -> List[Any]:
+        """Decide a trace now, return its items if it is kept."""
+        with self._lock:
+            trace = self._pending.get(trace_id)
+            if trace is None:
+                return []
+
+            trace.last_seen = time.monotonic()
+
+            return self._decide(trace_id)
+
+    def decide_expired(self) -> List[Any]:
+        """Decide the traces buffered for longer than `decision_wait`, return the items of the kept ones."""
+        with self._lock:
+            return self._decide_expired(time.monotonic())
+
+    def expired_trace_ids(self) -> List[str]:
+        """The ids of the traces that the next `decide_expired` call decides, oldest first."""
+        now = time.monotonic()
+        with self._lock:
+            trace_ids = []
+            for trace_id, trace in self._pending.items():
+                if now - trace.created_at < self._decision_wait:
+                    break
+
+                trace_ids.append(trace_id)
+
+            return trace_ids
+
+    @property
+    def check_interval(self) -> float:
+        """How often `decide_expired` should be called so that traces are decided close to their decision wait."""
+        return min(TAIL_SAMPLING_CHECK_INTERVAL, self._decision_wait)
+
+    def decide_all(self) -> List[Any]:
+        """Decide all buffered traces, e.g. before flushing, return the items of the kept ones."""
+        with self._lock:
+            ready = []
+            while self._pending:
+                ready.extend(self._decide(next(iter(self._pending))))
+
+            return ready
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending_traces": len(self._pending),
+                "pending_bytes": self._size,
+                "kept_traces": self._kept_traces,
+                "discarded_traces": self._discarded_traces,
+                "discarded_events": self._discarded_events,
+            }
+
+    def _get_trace_id(self, event_type: Optional[str], body: dict) -> Optional[str]:
+        if event_type == "trace-create":
+            return body.get("id")
+
+        trace_id = body.get("traceId")
+        observation_id = body.get("id")
+        if observation_id is None:
+            return trace_id
+
+        if trace_id is None:
+            # unknown observations, e.g. evicted from the lookup, are not buffered
+            return self._observation_traces.get(observation_id)
+
+        self._observation_traces[observation_id] = trace_id
+        while len(self._observation_traces) > DEFAULT_TAIL_SAMPLING_MAX_OBSERVATIONS:
+            self._observation_traces.popitem(last=False)
+
+        return trace_id
+
+    def _observe(self, trace: _BufferedTrace, body: dict):
+        if body.get("level") == "ERROR":
+            trace.keep = True
+
+        if self._tags and self._tags.intersection(body.get("tags") or ()):
+            trace.keep = True
+
+        try:
+            # traces start at their timestamp, those created by `@observe` also carry the end time of the function
+            start_time = body.get("startTime") or body.get("timestamp")
+            if isinstance(start_time, dt.datetime) and (
+                trace.start_time is None or start_time < trace.start_time
+            ):
+                trace.start_time = start_time
+
+            end_time = body.get("endTime") or body.get("end_time")
+            if isinstance(end_time, dt.datetime) and (
+                trace.end_time is None or end_time > trace.end_time
+            ):
+                trace.end_time = end_time
+        except TypeError:
+            # naive and timezone-aware times of the same trace cannot be compared
+            pass
+
+    def _decide_expired(self, now: float) -> List[Any]:
+        ready = []
+        while self._pending:
+            trace_id, trace = next(iter(self._pending.items()))
+            if now - trace.created_at < self._decision_wait:
+                break
+
+            ready.extend(self._decide(trace_id))
+
+        return ready
+
+    def _decide(self, trace_id: str) -> List[Any]:
+        trace = self._pending.pop(trace_id)
+        self._size -= trace.size
+
+        keep = (
+            trace.keep
+            or self._is_slow(trace)
+            or self._healthy_sampler.is_sampled(trace_id)
+        )
+        self._decisions[trace_id] = keep
+        while len(self._decisions) > DEFAULT_MAX_SAMPLING_DECISIONS:
+            self._decisions.popitem(last=False)
+
+        if keep:
+            self._kept_traces += 1
+
+            return trace.items
+
+        self._discarded_traces += 1
+        self._discarded_events += len(trace.items)
+
+        return []
+
+    def _is_slow(self, trace: _BufferedTrace) -> bool:
+        if self._latency_threshold is None:
+            return False
+
+        latency = trace.last_seen - trace.created_at
+        if trace.start_time is not None and trace.end_time is not None:
+            try:
+                latency = max(
+                    latency, (trace.end_time - trace.start_time).total_seconds()
+                )
+            except TypeError:
+                pass
+
+        return latency > self._latency_threshold
+
+
+class TailSamplingTimer(threading.Thread):
+    """Daemon thread deciding expired traces every `interval` seconds, also when no new events arrive."""
+
+    _log = logging.getLogger("langfuse")
+
+    def __init__(self, release_expired: Callable[[], Any], interval: float):
+        threading.Thread.__init__(self, daemon=True)
+        self._release_expired = release_expired
+        self._interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                self._release_expired()
+            except Exception as e:
+                self._log.exception("error deciding expired traces: %s", e)
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stopped.set()
+        if self.is_alive():
+            self.join(timeout)
@@ -2,15 +2,19 @@
 """
 
 import atexit
+import datetime as dt
 import json
 import logging
 import queue
 import threading
 from queue import Empty, Queue
 import time
-from typing import List, Any
+from typing import Any, List
 from datetime import datetime, timezone
+from decimal import Decimal
+from enum import Enum
 import typing
+from uuid import UUID
 
 
 try:
@@ -21,8 +25,11 @@ except ImportError:
 
 import backoff
 
-from langfuse.request import LangfuseClient
-from langfuse.serializer import EventSerializer
+from langfuse.request import APIError, APIErrors, LangfuseClient, PreparedRequest
+from langfuse.serializer import serialize
+from langfuse.spill_queue import DEFAULT_SPILL_MAX_BYTES, SpillBatch, SpillQueue
+from langfuse.stats import DEFAULT_STATS_INTERVAL, IngestionStats, StatsReporter
+from langfuse.tail_sampling import TailSamplingBuffer, TailSamplingTimer
 
 # largest message size in db is 331_000 bytes right now
 MAX_MSG_SIZE = 1_000_000
@@ -34,6 +41,215 @@ MAX_MSG_SIZE = 1_000_000
 
 BATCH_SIZE_LIMIT = 2_500_000
 
+# upper bounds for adaptive batching, the byte limit BATCH_SIZE_LIMIT still applies to every batch
+ADAPTIVE_MAX_FLUSH_AT = 1_000
+ADAPTIVE_MAX_FLUSH_INTERVAL_FACTOR = 8
+
+
+def _encode_event(event: dict) -> bytes:
+    return serialize(event)
+
+
+# leaf values that cannot be mutated, they are shared between the caller and the queued event
+_IMMUTABLE_TYPES = (
+    str,
+    bytes,
+    int,
+    float,
+    type(None),
+    dt.date,
+    dt.time,
+    dt.timedelta,
+    Decimal,
+    Enum,
+    UUID,
+)
+
+
+def _snapshot(value: Any) -> Any:
+    """Copy an event so later mutations by the caller do not leak into the queued event.
+
+    Dicts, lists, tuples and sets are copied and immutable leaf values are shared. This is much cheaper than
+    encoding the event. Other leaf objects, e.g. pydantic models, dataclasses or custom classes, can be mutated
+    and are encoded right away into their JSON values.
+    """
+    if isinstance(value, dict):
+        return {k: _snapshot(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [_snapshot(v) for v in value]
+    if isinstance(value, _IMMUTABLE_TYPES):
+        return value
+
+    return json.loads(serialize(value))
+
+
+def _is_retryable_status(status: typing.Union[int, str]) -> bool:
+    try:
+        status = int(status)
+    except (TypeError, ValueError):
+        return True
+
+    return status == 429 or status >= 500
+
+
+def _get_retryable(batch: List[bytes], error: Exception) -> List[int]:
+    """Return the indexes of the items of a failed upload that can succeed when retried later.
+
+    These are all items after a network error or a 5xx or 429 response, none after another error response, and
+    the items of the failed events with such a status in a partially successful (207) response.
+    """
+    if isinstance(error, APIErrors):
+        failed_ids = {
+            api_error.event_id
+            for api_error in error.errors
+            if _is_retryable_status(api_error.status)
+        }
+        if not failed_ids:
+            return []
+
+        return [
+            index
+            for index, item in enumerate(batch)
+            if json.loads(item).get("id") in failed_ids
+        ]
+
+    if isinstance(error, APIError) and not _is_retryable_status(error.status):
+        return []
+
+    return list(range(len(batch)))
+
+
+def _prepare_item(item: Any, drop_counter: "DropCounter") -> typing.Optional[bytes]:
+    """Return the encoded queue item, or None if it has to be dropped."""
+    log = logging.getLogger("langfuse")
+
+    # events enqueued with defer_serialization are encoded here, off the caller's thread
+    if not isinstance(item, bytes):
+        try:
+            item = _encode_event(item)
+        except Exception as e:
+            log.exception(f"Exception in serializing task {e}")
+            drop_counter.increment(DropCounter.SERIALIZATION_ERROR)
+            return None
+
+    # items are encoded once, their size is the byte length
+    item_size = len(item)
+    log.debug(f"item size {item_size}")
+    if item_size > MAX_MSG_SIZE:
+        log.warning(
+            "Item exceeds size limit (size: %s), dropping item.",
+            item_size,
+        )
+        drop_counter.increment(DropCounter.OVERSIZE)
+        return None
+
+    return item
+
+
+class DropCounter:
+    """Thread-safe count of events that were dropped before being uploaded, by reason."""
+
+    QUEUE_FULL = "queue_full"
+    OVERSIZE = "oversize"
+    SERIALIZATION_ERROR = "serialization_error"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def increment(self, reason: str):
+        with self._lock:
+            self._counts[reason] = self._counts.get(reason, 0) + 1
+
+    def get(self, reason: typing.Optional[str] = None) -> int:
+        with self._lock:
+            if reason is None:
+                return sum(self._counts.values())
+            return self._counts.get(reason, 0)
+
+    def as_dict(self) -> typing.Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+class AdaptiveBatchPolicy:
+    """Adapts the batch size and flush interval of a consumer to the observed load.
+
+    The batch size doubles while the queue backlog grows or uploads take longer than the flush interval, in the
+    latter case the flush interval doubles as well. Both shrink back towards the configured values when batches
+    are flushed by the interval and the queue is empty, which keeps delivery latency low for light traffic.
+    """
+
+    _lock: threading.Lock
+    flush_at: int
+    flush_interval: float
+
+    def __init__(
+        self,
+        flush_at: int,
+        flush_interval: float,
+        max_flush_at: int = ADAPTIVE_MAX_FLUSH_AT,
+        max_flush_interval: typing.Optional[float] = None,
+    ):
+        self._lock = threading.Lock()
+        self._min_flush_at = flush_at
+        self._max_flush_at = max(max_flush_at, flush_at)
+        self._min_flush_interval = flush_interval
+        self._max_flush_interval = (
+            max_flush_interval or flush_interval * ADAPTIVE_MAX_FLUSH_INTERVAL_FACTOR
+        )
+        self.flush_at = flush_at
+        self.flush_interval = flush_interval
+        self._last_queue_depth = 0
+        self._upload_latency = None
+
+    def record_batch(self, batch_size: int, queue_depth: int):
+        """Adjust the settings after a batch of `batch_size` items was collected, `queue_depth` items are left."""
+        with self._lock:
+            slow_uploads = (
+                self._upload_latency is not None
+                and self._upload_latency > self.flush_interval
+            )
+            backlog_rising = queue_depth >= self.flush_at or (
+                queue_depth > self._last_queue_depth
+            )
+
+            if backlog_rising or slow_uploads:
+                self.flush_at = min(self.flush_at * 2, self._max_flush_at)
+                if slow_uploads:
+                    self.flush_interval = min(
+                        self.flush_interval * 2, self._max_flush_interval
+                    )
+            elif batch_size < self.flush_at and queue_depth == 0:
+                self.flush_at = max(self.flush_at // 2, self._min_flush_at)
+                self.flush_interval = max(
+                    self.flush_interval / 2, self._min_flush_interval
+                )
+
+            self._last_queue_depth = queue_depth
+
+    def record_upload(self, latency: float):
+        """Record the duration of a successful upload in seconds."""
+        with self._lock:
+            if self._upload_latency is None:
+                self._upload_latency = latency
+            else:
+                # exponentially weighted moving average
+                self._upload_latency = 0.7 * self._upload_latency + 0.3 * latency
+
+    def get_settings(self) -> typing.Tuple[int, float]:
+        with self._lock:
+            return self.flush_at, self.flush_interval
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "adaptive": True,
+                "flush_at": self.flush_at,
+                "flush_interval": self.flush_interval,
+                "upload_latency": self._upload_latency,
+            }
+
 
 class LangfuseMetadata(pydantic.BaseModel):
     batch_size: int
@@ -55,6 +271,9 @@ class Consumer(threading.Thread):
     _sdk_name: str
     _sdk_version: str
     _sdk_integration: str
+    _drop_counter: DropCounter
+    _stats: IngestionStats
+    _max_in_flight_batches: int
 
     def __init__(
         self,
@@ -68,6 +287,11 @@ class Consumer(threading.Thread):
         sdk_name: str,
         sdk_version: str,
         sdk_integration: str,
+        drop_counter: typing.Optional[DropCounter] = None,
+        max_in_flight_batches: int = 1,
+        batch_policy: typing.Optional[AdaptiveBatchPolicy] = None,
+        spill: typing.Optional[SpillQueue] = None,
+        stats: typing.Optional[IngestionStats] = None,
     ):
         """Create a consumer thread."""
         threading.Thread.__init__(self)
@@ -88,32 +312,55 @@ class Consumer(threading.Thread):
         self._sdk_name = sdk_name
         self._sdk_version = sdk_version
         self._sdk_integration = sdk_integration
+        self._drop_counter = drop_counter or DropCounter()
+        self._stats = stats or IngestionStats()
+        self._max_in_flight_batches = max_in_flight_batches
+        # with more than one batch in flight, uploads run on worker threads while this thread collects the next batch
+        self._in_flight = threading.BoundedSemaphore(max_in_flight_batches)
+        self._upload_queue = Queue()
+        self._upload_workers = []
+        self._batch_policy = batch_policy
+        self._spill = spill
+
+    def _get_batch_settings(self) -> typing.Tuple[int, float]:
+        if self._batch_policy is not None:
+            return self._batch_policy.get_settings()
+
+        return self._flush_at, self._flush_interval
+
+    def get_stats(self) -> dict:
+        """Return the effective batch settings of this consumer."""
+        if self._batch_policy is not None:
+            return self._batch_policy.get_stats()
+
+        return {
+            "adaptive": False,
+            "flush_at": self._flush_at,
+            "flush_interval": self._flush_interval,
+        }
 
     def _next(self):
         """Return the next batch of items to upload."""
         queue = self._queue
         items = []
+        flush_at, flush_interval = self._get_batch_settings()
 
         start_time = time.monotonic()
         total_size = 0
 
-        while len(items) < self._flush_at:
+        while len(items) < flush_at:
             elapsed = time.monotonic() - start_time
-            if elapsed >= self._flush_interval:
+            if elapsed >= flush_interval:
                 break
             try:
-                item = queue.get(block=True, timeout=self._flush_interval - elapsed)
-                item_size = len(json.dumps(item, cls=EventSerializer).encode())
-                self._log.debug(f"item size {item_size}")
-                if item_size > MAX_MSG_SIZE:
-                    self._log.warning(
-                        "Item exceeds size limit (size: %s), dropping item.",
-                        item_size,
-                    )
+                item = queue.get(block=True, timeout=flush_interval - elapsed)
+                item = _prepare_item(item, self._drop_counter)
+                if item is None:
                     self._queue.task_done()
                     continue
+
                 items.append(item)
-                total_size += item_size
+                total_size += len(item)
                 if total_size >= BATCH_SIZE_LIMIT:
                     self._log.debug("hit batch size limit (size: %d)", total_size)
                     break
@@ -121,34 +368,118 @@ class Consumer(threading.Thread):
             except Empty:
                 break
 
+        if self._batch_policy is not None and len(items) > 0:
+            self._batch_policy.record_batch(len(items), queue.qsize())
+
         return items
 
     def run(self):
         """Runs the consumer."""
         self._log.debug("consumer is running...")
+        if self._max_in_flight_batches > 1:
+            for _ in range(self._max_in_flight_batches):
+                worker = threading.Thread(target=self._run_upload_worker, daemon=True)
+                worker.start()
+                self._upload_workers.append(worker)
+
         while self.running:
             self.upload()
 
+        # let the workers finish the batches that are still in flight
+        for _ in self._upload_workers:
+            self._upload_queue.put(None)
+        for worker in self._upload_workers:
+            worker.join()
+
     def upload(self):
         """Upload the next batch of items, return whether successful."""
         batch = self._next()
+
+        if self._spill is not None:
+            self._upload_spilled()
+
         if len(batch) == 0:
             return
 
+        if not self._upload_workers:
+            self._upload_and_acknowledge(batch)
+            return
+
+        # blocks while max_in_flight_batches batches are being uploaded
+        self._in_flight.acquire()
+        self._upload_queue.put(batch)
+
+    def _run_upload_worker(self):
+        while True:
+            batch = self._upload_queue.get()
+            if batch is None:
+                return
+
+            try:
+                if isinstance(batch, SpillBatch):
+                    self._upload_spilled_batch(batch)
+                else:
+                    self._upload_and_acknowledge(batch)
+            finally:
+                self._in_flight.release()
+
+    def _upload_spilled(self):
+        """Upload the next batch of events that were spilled to disk."""
+        # with upload workers, spilled batches only take a free upload slot so they never hold up live batches
+        if self._upload_workers and not self._in_flight.acquire(blocking=False):
+            return
+
+        flush_at, _ = self._get_batch_settings()
+        spill_batch: typing.Optional[SpillBatch] = self._spill.get_batch(
+            flush_at, BATCH_SIZE_LIMIT
+        )
+
+        if not self._upload_workers:
+            if spill_batch is not None:
+                self._upload_spilled_batch(spill_batch)
+        elif spill_batch is not None:
+            self._upload_queue.put(spill_batch)
+        else:
+            self._in_flight.release()
+
+    def _upload_spilled_batch(self, spill_batch: SpillBatch):
+        try:
+            self._upload_batch(spill_batch.items)
+            self._spill.ack(spill_batch)
+        except Exception as e:
+            self._log.exception("error uploading spilled events: %s", e)
+            # the events that can succeed later stay on disk and are retried after a delay
+            self._spill.nack(spill_batch, _get_retryable(spill_batch.items, e))
+
+    def _upload_and_acknowledge(self, batch: List[bytes]):
         try:
             self._upload_batch(batch)
         except Exception as e:
             self._log.exception("error uploading: %s", e)
+            if self._spill is not None:
+                self._spill_failed(batch, e)
         finally:
             # mark items as acknowledged from queue
             for _ in batch:
                 self._queue.task_done()
 
+    def _spill_failed(self, batch: List[bytes], error: Exception):
+        """Write the events of a failed upload that can succeed later to the spill queue."""
+        retryable = _get_retryable(batch, error)
+        for index in retryable:
+            if not self._spill.put(batch[index]):
+                self._log.warning("spill queue is full")
+                break
+
+        if retryable:
+            # the batch was just retried with backoff, it is not read back right away
+            self._spill.defer()
+
     def pause(self):
         """Pause the consumer."""
         self.running = False
 
-    def _upload_batch(self, batch: List[Any]):
+    def _upload_batch(self, batch: List[bytes]):
         self._log.debug("uploading batch of %d items", len(batch))
 
         metadata = LangfuseMetadata(
@@ -159,11 +490,33 @@ class Consumer(threading.Thread):
             public_key=self._public_key,
         ).dict()
 
-        @backoff.on_exception(backoff.expo, Exception, max_tries=self._max_retries)
-        def execute_task_with_backoff(batch: List[Any]):
-            return self._client.batch_post(batch=batch, metadata=metadata)
+        @backoff.on_exception(
+            backoff.expo,
+            Exception,
+            max_tries=self._max_retries,
+            on_backoff=lambda _: self._stats.record_retry(),
+        )
+        def execute_task_with_backoff(request: PreparedRequest):
+            try:
+                return self._client.batch_post(request)
+            except APIErrors as e:
+                self._stats.record_partial_errors(len(e.errors))
+                raise
+
+        start_time = time.monotonic()
+        try:
+            # encoded and compressed once, retries send the same bytes
+            request = self._client.prepare_batch(batch=batch, metadata=metadata)
+            execute_task_with_backoff(request)
+        except Exception:
+            self._stats.record_failed_upload(len(batch))
+            raise
+
+        latency = time.monotonic() - start_time
+        self._stats.record_upload(len(batch), sum(map(len, batch)), latency)
+        if self._batch_policy is not None:
+            self._batch_policy.record_upload(latency)
 
-        execute_task_with_backoff(batch)
         self._log.debug("successfully uploaded batch of %d items", len(batch))
 
 
@@ -181,6 +534,16 @@ class TaskManager(object):
     _sdk_name: str
     _sdk_version: str
     _sdk_integration: str
+    _defer_serialization: bool
+    _drop_counter: DropCounter
+    _stats: IngestionStats
+    _stats_reporter: typing.Optional[StatsReporter]
+    _max_in_flight_batches: int
+    _adaptive_batching: bool
+    _spill: typing.Optional[SpillQueue]
+    _tail_sampling: typing.Optional[TailSamplingBuffer]
+    _tail_sampling_timer: typing.Optional[TailSamplingTimer]
+    _flush_callbacks: List[typing.Callable[[typing.Optional[str]], typing.Any]]
 
     def __init__(
         self,
@@ -194,6 +557,14 @@ class TaskManager(object):
         sdk_version: str,
         sdk_integration: str,
         max_task_queue_size: int = 100_000,
+        defer_serialization: bool = False,
+        max_in_flight_batches: int = 1,
+        adaptive_batching: bool = False,
+        spill_dir: typing.Optional[str] = None,
+        spill_max_bytes: int = DEFAULT_SPILL_MAX_BYTES,
+        stats_callback: typing.Optional[typing.Callable[[dict], typing.Any]] = None,
+        stats_interval: float = DEFAULT_STATS_INTERVAL,
+        tail_sampling: typing.Optional[TailSamplingBuffer] = None,
     ):
         self._max_task_queue_size = max_task_queue_size
         self._threads = threads
@@ -207,9 +578,34 @@ class TaskManager(object):
         self._sdk_name = sdk_name
         self._sdk_version = sdk_version
         self._sdk_integration = sdk_integration
+        self._defer_serialization = defer_serialization
+        self._drop_counter = DropCounter()
+        self._stats = IngestionStats()
+        self._max_in_flight_batches = max_in_flight_batches
+        self._adaptive_batching = adaptive_batching
+        self._spill = (
+            SpillQueue(spill_dir, max_bytes=spill_max_bytes)
+            if spill_dir is not None
+            else None
+        )
+        self._flush_callbacks = []
+        self._tail_sampling = tail_sampling
+        self._tail_sampling_timer = None
+        if tail_sampling is not None:
+            self._tail_sampling_timer = TailSamplingTimer(
+                self._release_expired, tail_sampling.check_interval
+            )
+            self._tail_sampling_timer.start()
 
         self.init_resources()
 
+        self._stats_reporter = None
+        if stats_callback is not None:
+            self._stats_reporter = StatsReporter(
+                self.get_stats, stats_callback, stats_interval
+            )
+            self._stats_reporter.start()
+
         # cleans up when the python interpreter closes
         atexit.register(self.join)
 
@@ -226,31 +622,142 @@ class TaskManager(object):
                 sdk_name=self._sdk_name,
                 sdk_version=self._sdk_version,
                 sdk_integration=self._sdk_integration,
+                drop_counter=self._drop_counter,
+                max_in_flight_batches=self._max_in_flight_batches,
+                batch_policy=AdaptiveBatchPolicy(self._flush_at, self._flush_interval)
+                if self._adaptive_batching
+                else None,
+                spill=self._spill,
+                stats=self._stats,
             )
             consumer.start()
             self._consumers.append(consumer)
 
-    def add_task(self, event: dict):
+    def add_task(self, event: dict) -> bool:
+        """Enqueue an event, return False if it or an event released by tail sampling with it was dropped."""
         try:
-            self._log.debug(f"adding task {event}")
-            json.dumps(event, cls=EventSerializer)
+            self._log.debug("adding task %s", event)
             event["timestamp"] = datetime.utcnow().replace(tzinfo=timezone.utc)
 
-            self._queue.put(event, block=False)
+            if self._tail_sampling is not None:
+                # buffered events are encoded right away, their size counts against the buffer budget
+                item = _encode_event(event)
+                ready = self._tail_sampling.add(event, item, len(item))
+
+                return all([self._put(item) for item in ready])
+            elif self._defer_serialization:
+                # the consumer encodes the snapshot, the caller only pays for copying containers
+                return self._put(_snapshot(event))
+            else:
+                # serialize exactly once, the consumer and the client only handle the bytes
+                return self._put(_encode_event(event))
+        except Exception as e:
+            self._log.exception(f"Exception in adding task {e}")
+            self._drop_counter.increment(DropCounter.SERIALIZATION_ERROR)
+
+            return False
+
+    def _put(self, item: Any) -> bool:
+        """Enqueue an item or spill it to disk if the queue is full, return whether it was kept."""
+        try:
+            self._queue.put(item, block=False)
+            self._stats.record_enqueued()
+
+            return True
         except queue.Full:
+            if self._spill is not None:
+                return self._spill_item(item)
+
             self._log.warning("analytics-python queue is full")
+            self._drop_counter.increment(DropCounter.QUEUE_FULL)
             return False
-        except Exception as e:
-            self._log.exception(f"Exception in adding task {e}")
 
+    def _spill_item(self, item: Any) -> bool:
+        """Write an event that does not fit into the queue to the spill queue on disk, return whether it was written."""
+        item = _prepare_item(item, self._drop_counter)
+        if item is None:
+            # too large or not serializable, already counted as dropped
             return False
 
+        if not self._spill.put(item):
+            self._log.warning("analytics-python queue is full")
+            self._drop_counter.increment(DropCounter.QUEUE_FULL)
+            return False
+
+        self._stats.record_enqueued()
+
+        return True
+
+    def add_flush_callback(
+        self, callback: typing.Callable[[typing.Optional[str]], typing.Any]
+    ):
+        """Register a callback that enqueues events held back outside of the task manager, e.g. by an integration.
+
+        It is called with the id of a trace before the trace is decided for tail sampling, and with None before
+        flushing or joining to enqueue the held back events of all traces.
+        """
+        self._flush_callbacks.append(callback)
+
+    def _run_flush_callbacks(self, trace_id: typing.Optional[str] = None):
+        for callback in list(self._flush_callbacks):
+            try:
+                callback(trace_id)
+            except Exception as e:
+                self._log.exception(e)
+
+    def end_trace(self, trace_id: str):
+        """Decide on a trace buffered for tail sampling and enqueue its events if it is kept."""
+        if self._tail_sampling is None:
+            return
+
+        self._run_flush_callbacks(trace_id)
+        for item in self._tail_sampling.complete(trace_id):
+            self._put(item)
+
+    def _release_expired(self):
+        for trace_id in self._tail_sampling.expired_trace_ids():
+            self._run_flush_callbacks(trace_id)
+
+        for item in self._tail_sampling.decide_expired():
+            self._put(item)
+
+    def _release_tail_sampled(self):
+        if self._tail_sampling is None:
+            return
+
+        for item in self._tail_sampling.decide_all():
+            self._put(item)
+
+    def get_dropped_count(self, reason: typing.Optional[str] = None) -> int:
+        """Number of events dropped so far, optionally only for the given `DropCounter` reason"""
+        return self._drop_counter.get(reason)
+
+    def get_stats(self) -> dict:
+        """Return the ingestion counters and histograms, the queue depth, the dropped events by reason, the
+        effective batch settings of each consumer, the spill queue size and the tail sampling buffer"""
+        stats = self._stats.as_dict()
+        stats["queue_depth"] = self._queue.qsize()
+        stats["dropped"] = self._drop_counter.as_dict()
+        stats["consumers"] = [consumer.get_stats() for consumer in self._consumers]
+        if self._spill is not None:
+            stats["spill"] = self._spill.get_stats()
+        if self._tail_sampling is not None:
+            stats["tail_sampling"] = self._tail_sampling.get_stats()
+
+        return stats
+
     def flush(self):
         """Forces a flush from the internal queue to the server"""
         self._log.debug("flushing queue")
+        self._run_flush_callbacks()
+        # traces buffered for tail sampling are decided with what is known so far
+        self._release_tail_sampled()
         queue = self._queue
         size = queue.qsize()
         queue.join()
+        if self._spill is not None:
+            # events that could not be uploaded stay on disk and are retried later
+            self._spill.join()
         # Note that this message may not be precise, because of threading.
         self._log.debug("successfully flushed about %s items.", size)
 
@@ -259,6 +766,10 @@ class TaskManager(object):
         Blocks execution until finished
         """
         self._log.debug(f"joining {len(self._consumers)} consumer threads")
+        if self._tail_sampling_timer is not None:
+            self._tail_sampling_timer.stop()
+        self._run_flush_callbacks()
+        self._release_tail_sampled()
         for consumer in self._consumers:
             consumer.pause()
             try:
@@ -269,6 +780,33 @@ class TaskManager(object):
 
             self._log.debug(f"consumer thread {consumer._identifier} joined")
 
+        if self._spill is not None:
+            self._spill_remaining()
+
+        if self._stats_reporter is not None:
+            self._stats_reporter.stop()
+
+    def _spill_remaining(self):
+        """Move the events left in the queue to disk so that the next process uploads them."""
+        spilled = 0
+        while True:
+            try:
+                item = self._queue.get(block=False)
+            except Empty:
+                break
+
+            item = _prepare_item(item, self._drop_counter)
+            if item is not None:
+                if self._spill.put(item):
+                    spilled += 1
+                else:
+                    self._drop_counter.increment(DropCounter.QUEUE_FULL)
+            self._queue.task_done()
+
+        if spilled > 0:
+            self._log.debug(f"spilled {spilled} queued events to disk")
+        self._spill.close()
+
     def shutdown(self):
         """Flush all messages and cleanly shutdown the client"""
         self._log.debug("shutdown initiated")
@@ -24,7 +24,13 @@ class LangfuseSingleton:
         host: Optional[str] = None,
         debug: bool = False,
         sdk_integration: Optional[str] = None,
+        **kwargs,
     ) -> Langfuse:
+        """Returns the shared client, creating it on first use.
+
+        Keyword arguments are passed to `Langfuse`, e.g. `sample_rate` or `tail_sampling`. They only apply when the
+        client is created, an existing client is returned unchanged.
+        """
         if self._langfuse:
             return self._langfuse
 
@@ -38,6 +44,7 @@ class LangfuseSingleton:
                 host=host,
                 debug=debug,
                 sdk_integration=sdk_integration,
+                **kwargs,
             )
 
             return self._langfuse
@@ -0,0 +1,380 @@
+import asyncio
+import threading
+import time
+from urllib.parse import urlparse, urlunparse
+
+import httpx
+import pytest
+from pytest_httpserver import HTTPServer
+from werkzeug.wrappers import Request, Response
+
+from langfuse import AsyncLangfuse
+from langfuse.async_task_manager import AsyncTaskManager
+from langfuse.request import AsyncLangfuseClient
+
+
+def get_host(url):
+    parsed_url = urlparse(url)
+    new_url = urlunparse((parsed_url.scheme, parsed_url.netloc, "", "", "", ""))
+    return new_url
+
+
+@pytest.fixture
+def threaded_httpserver():
+    server = HTTPServer(threaded=True)
+    server.start()
+    yield server
+    server.clear()
+    server.stop()
+
+
+def setup_async_langfuse_client(server: str):
+    return AsyncLangfuseClient(
+        "public_key", "secret_key", server, "1.0.0", 15, httpx.AsyncClient()
+    )
+
+
+def setup_server(httpserver: HTTPServer, batches: list, status: int = 200):
+    def handler(request: Request):
+        batches.append(request.json)
+        return Response(status=status)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+
+@pytest.mark.asyncio
+@pytest.mark.timeout(10)
+async def test_async_task_manager_flush(httpserver: HTTPServer):
+    batches = []
+    setup_server(httpserver, batches)
+
+    tm = AsyncTaskManager(
+        setup_async_langfuse_client(
+            get_host(httpserver.url_for("/api/public/ingestion"))
+        ),
+        10,
+        0.1,
+        3,
+        1,
+        "public_key",
+        "test-sdk",
+        "1.0.0",
+        "default",
+    )
+
+    for _ in range(25):
+        tm.add_task({"foo": "bar"})
+    await tm.flush()
+
+    uploaded = [item for batch in batches for item in batch["batch"]]
+    assert len(uploaded) == 25
+    assert all(len(batch["batch"]) <= 10 for batch in batches)
+
+    await tm.shutdown()
+    assert all(task.done() for task in tm._consumer_tasks)
+
+
+@pytest.mark.asyncio
+@pytest.mark.timeout(10)
+async def test_async_task_manager_add_task_from_other_thread_and_before_loop(
+    httpserver: HTTPServer,
+):
+    batches = []
+    setup_server(httpserver, batches)
+
+    tm = AsyncTaskManager(
+        setup_async_langfuse_client(
+            get_host(httpserver.url_for("/api/public/ingestion"))
+        ),
+        10,
+        0.1,
+        3,
+        1,
+        "public_key",
+        "test-sdk",
+        "1.0.0",
+        "default",
+    )
+
+    # no loop bound yet, the event is buffered until the manager is started
+    thread = threading.Thread(target=tm.add_task, args=({"foo": "before"},))
+    thread.start()
+    thread.join()
+
+    tm.add_task({"foo": "bar"})
+
+    # the loop is bound now, events from other threads are scheduled on it
+    await asyncio.get_running_loop().run_in_executor(
+        None, tm.add_task, {"foo": "thread"}
+    )
+    await tm.flush()
+    await tm.shutdown()
+
+    uploaded = sorted(item["foo"] for batch in batches for item in batch["batch"])
+    assert uploaded == ["bar", "before", "thread"]
+
+
+@pytest.mark.timeout(10)
+def test_async_task_manager_rebinds_to_new_loop(httpserver: HTTPServer):
+    batches = []
+    setup_server(httpserver, batches)
+
+    tm = AsyncTaskManager(
+        setup_async_langfuse_client(
+            get_host(httpserver.url_for("/api/public/ingestion"))
+        ),
+        10,
+        0.1,
+        3,
+        1,
+        "public_key",
+        "test-sdk",
+        "1.0.0",
+        "default",
+    )
+
+    async def job(name):
+        tm.add_task({"foo": name})
+        await tm.flush()
+
+    asyncio.run(job("first"))
+    # queued while no loop is running, uploaded by the next loop
+    tm.add_task({"foo": "between"})
+    asyncio.run(job("second"))
+
+    uploaded = sorted(item["foo"] for batch in batches for item in batch["batch"])
+    assert uploaded == ["between", "first", "second"]
+    assert tm.get_dropped_count() == 0
+
+
+def test_async_task_manager_bounds_events_before_loop():
+    tm = AsyncTaskManager(
+        setup_async_langfuse_client("http://localhost:1"),
+        10,
+        0.1,
+        3,
+        1,
+        "public_key",
+        "test-sdk",
+        "1.0.0",
+        "default",
+        max_task_queue_size=2,
+    )
+
+    for _ in range(3):
+        tm.add_task({"foo": "bar"})
+
+    assert tm.get_stats()["queue_depth"] == 2
+    assert tm.get_dropped_count("queue_full") == 1
+    assert tm.get_dropped_count("serialization_error") == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.timeout(10)
+async def test_async_task_manager_keeps_events_added_while_binding(
+    threaded_httpserver: HTTPServer,
+):
+    batches = []
+    setup_server(threaded_httpserver, batches)
+
+    tm = AsyncTaskManager(
+        setup_async_langfuse_client(
+            get_host(threaded_httpserver.url_for("/api/public/ingestion"))
+        ),
+        100,
+        0.1,
+        3,
+        1,
+        "public_key",
+        "test-sdk",
+        "1.0.0",
+        "default",
+    )
+
+    def add_tasks():
+        for _ in range(200):
+            tm.add_task({"foo": "thread"})
+
+    threads = [threading.Thread(target=add_tasks) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+
+    tm.add_task({"foo": "loop"})
+    await asyncio.get_running_loop().run_in_executor(
+        None, lambda: [thread.join() for thread in threads]
+    )
+    await tm.flush()
+    await tm.shutdown()
+
+    uploaded = [item for batch in batches for item in batch["batch"]]
+    assert len(uploaded) == 801
+
+
+@pytest.mark.asyncio
+@pytest.mark.timeout(10)
+async def test_async_task_manager_retries(httpserver: HTTPServer):
+    batches = []
+    setup_server(httpserver, batches, status=500)
+
+    tm = AsyncTaskManager(
+        setup_async_langfuse_client(
+            get_host(httpserver.url_for("/api/public/ingestion"))
+        ),
+        10,
+        0.1,
+        3,
+        1,
+        "public_key",
+        "test-sdk",
+        "1.0.0",
+        "default",
+    )
+
+    tm.add_task({"foo": "bar"})
+    await tm.flush()
+    await tm.shutdown()
+
+    assert len(batches) == 3
+
+
+@pytest.mark.asyncio
+@pytest.mark.timeout(10)
+async def test_async_langfuse(httpserver: HTTPServer):
+    batches = []
+    setup_server(httpserver, batches)
+
+    langfuse = AsyncLangfuse(
+        public_key="pk-lf-1234567890",
+        secret_key="sk-lf-1234567890",
+        host=get_host(httpserver.url_for("/api/public/ingestion")),
+    )
+
+    trace = langfuse.trace(name="async-trace")
+    span = trace.span(name="async-span")
+    span.generation(name="async-generation").end()
+    span.end()
+
+    # blocking the event loop is refused
+    langfuse.flush()
+    assert batches == []
+
+    await langfuse.aflush()
+    await langfuse.ashutdown()
+
+    events = [item for batch in batches for item in batch["batch"]]
+    assert [event["type"] for event in events] == [
+        "trace-create",
+        "span-create",
+        "generation-create",
+        "generation-update",
+        "span-update",
+    ]
+    assert all(event["body"]["traceId"] == trace.id for event in events[1:3])
+    assert langfuse.async_httpx_client.is_closed
+
+
+@pytest.mark.timeout(10)
+def test_async_langfuse_blocking_flush(httpserver: HTTPServer):
+    batches = []
+    setup_server(httpserver, batches)
+
+    langfuse = AsyncLangfuse(
+        public_key="pk-lf-1234567890",
+        secret_key="sk-lf-1234567890",
+        host=get_host(httpserver.url_for("/api/public/ingestion")),
+    )
+
+    langfuse.trace(name="sync-trace")
+    langfuse.flush()
+    assert [item["type"] for batch in batches for item in batch["batch"]] == [
+        "trace-create"
+    ]
+
+    langfuse.shutdown()
+    assert langfuse.async_httpx_client.is_closed
+
+
+def test_async_langfuse_rejects_defer_serialization():
+    with pytest.raises(ValueError):
+        AsyncLangfuse(defer_serialization=True)
+
+
+@pytest.mark.asyncio
+@pytest.mark.timeout(10)
+async def test_async_join_uploads_the_batch_being_collected(httpserver: HTTPServer):
+    batches = []
+    setup_server(httpserver, batches)
+
+    tm = AsyncTaskManager(
+        setup_async_langfuse_client(
+            get_host(httpserver.url_for("/api/public/ingestion"))
+        ),
+        10,
+        10,
+        3,
+        1,
+        "public_key",
+        "test-sdk",
+        "1.0.0",
+        "default",
+    )
+
+    for _ in range(3):
+        tm.add_task({"foo": "bar"})
+    # the consumer takes the events from the queue and waits for more
+    await asyncio.sleep(0.2)
+    await tm.join()
+
+    assert len(batches[0]["batch"]) == 3
+    await asyncio.wait_for(tm._queue.join(), timeout=1)
+
+
+@pytest.mark.asyncio
+@pytest.mark.timeout(20)
+async def test_async_in_flight_batches_are_bounded(
+    threaded_httpserver: HTTPServer,
+):
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+    uploaded = 0
+
+    def handler(request: Request):
+        nonlocal in_flight, max_in_flight, uploaded
+        with lock:
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+        time.sleep(0.2)
+        with lock:
+            in_flight -= 1
+            uploaded += len(request.json["batch"])
+        return Response(status=200)
+
+    threaded_httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    tm = AsyncTaskManager(
+        setup_async_langfuse_client(
+            get_host(threaded_httpserver.url_for("/api/public/ingestion"))
+        ),
+        1,
+        0.1,
+        3,
+        1,
+        "public_key",
+        "test-sdk",
+        "1.0.0",
+        "default",
+        max_in_flight_batches=3,
+    )
+
+    for _ in range(12):
+        tm.add_task({"foo": "bar"})
+    await tm.flush()
+    await tm.shutdown()
+
+    assert uploaded == 12
+    assert 1 < max_in_flight <= 3
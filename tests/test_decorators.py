@@ -8,8 +8,10 @@ from langchain_community.chat_models import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
 from langfuse.openai import AsyncOpenAI
 from langfuse.decorators import langfuse_context, observe
+from langfuse.decorators.langfuse_decorator import _observation_params_context
 from tests.utils import create_uuid, get_api, get_llama_index_index
 from typing import Optional
+from unittest.mock import patch
 
 mock_metadata = "mock_metadata"
 mock_deep_metadata = "mock_deep_metadata"
@@ -519,6 +521,109 @@ def test_get_current_ids():
     )
 
 
+def test_observation_stack_is_restored_after_calls():
+    mock_trace_id = create_uuid()
+    retrieved_ids = []
+
+    @observe()
+    def level_2_function():
+        langfuse_context.update_current_observation(metadata=mock_metadata)
+        retrieved_ids.append(
+            (
+                langfuse_context.get_current_trace_id(),
+                langfuse_context.get_current_observation_id(),
+            )
+        )
+
+    @observe()
+    def level_1_function():
+        level_2_function()
+        level_2_function()
+        retrieved_ids.append(
+            (
+                langfuse_context.get_current_trace_id(),
+                langfuse_context.get_current_observation_id(),
+            )
+        )
+
+    level_1_function(langfuse_observation_id=mock_trace_id)
+
+    first_span, second_span, trace = retrieved_ids
+    assert first_span[0] == second_span[0] == mock_trace_id
+    assert first_span[1] not in (mock_trace_id, second_span[1])
+    assert trace == (mock_trace_id, mock_trace_id)
+
+    # the stack is empty again and the params of the ended observations are released
+    assert langfuse_context.get_current_observation_id() is None
+    assert not _observation_params_context.get().keys() & {
+        first_span[1],
+        second_span[1],
+        mock_trace_id,
+    }
+
+
+def test_observations_are_created_when_they_start():
+    langfuse = langfuse_context._get_langfuse()
+
+    @observe()
+    def level_1_function(*args, **kwargs):
+        return "level_1"
+
+    with patch.object(langfuse.task_manager, "add_task") as add_task:
+        level_1_function(*mock_args, **mock_kwargs)
+
+    create, update = [call.args[0] for call in add_task.call_args_list]
+
+    assert create["type"] == "trace-create"
+    assert create["body"]["input"] == {"args": mock_args, "kwargs": mock_kwargs}
+    assert "output" not in create["body"]
+    assert update["type"] == "trace-create"
+    assert update["body"]["id"] == create["body"]["id"]
+    assert update["body"]["output"] == "level_1"
+
+
+def test_deferred_observations_are_sent_as_one_event_when_they_end():
+    mock_trace_id = create_uuid()
+    langfuse = langfuse_context._get_langfuse()
+
+    @observe(as_type="generation", deferred=True)
+    def level_2_function():
+        langfuse_context.update_current_observation(model="gpt-3.5-turbo")
+        return "level_2"
+
+    @observe(deferred=True)
+    def level_1_function(*args, **kwargs):
+        langfuse_context.update_current_trace(name="one-event")
+        # the input was captured when the call started
+        kwargs["messages"].append("mutated")
+        return level_2_function()
+
+    with patch.object(langfuse.task_manager, "add_task") as add_task:
+        level_1_function(
+            *mock_args,
+            **mock_kwargs,
+            messages=["original"],
+            langfuse_observation_id=mock_trace_id,
+        )
+
+    generation, trace = [call.args[0] for call in add_task.call_args_list]
+
+    assert generation["type"] == "generation-create"
+    assert generation["body"]["traceId"] == mock_trace_id
+    assert generation["body"]["model"] == "gpt-3.5-turbo"
+    assert generation["body"]["output"] == "level_2"
+    assert generation["body"]["endTime"] >= generation["body"]["startTime"]
+
+    assert trace["type"] == "trace-create"
+    assert trace["body"]["id"] == mock_trace_id
+    assert trace["body"]["name"] == "one-event"
+    assert trace["body"]["input"] == {
+        "args": list(mock_args),
+        "kwargs": {**mock_kwargs, "messages": ["original"]},
+    }
+    assert trace["body"]["output"] == "level_2"
+
+
 def test_scoring_observations():
     mock_name = "test_scoring_observations"
     mock_trace_id = create_uuid()
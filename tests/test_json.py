@@ -12,7 +12,7 @@ from langchain.schema.messages import HumanMessage
 from pydantic import BaseModel
 
 import langfuse
-from langfuse.serializer import EventSerializer
+from langfuse.serializer import EventSerializer, serialize
 
 
 class TestModel(BaseModel):
@@ -131,3 +131,43 @@ def test_mongo_cursor():
     result = json.dumps(test_id, cls=EventSerializer)
 
     assert result == '{"_": null, "i": null, "d": null}'
+
+
+@dataclass
+class StreamingResponse:
+    response_gen: object
+
+
+class CustomObject:
+    def __init__(self):
+        self.name = "custom"
+        self.created_at = datetime(2024, 1, 1, 12, 30, 0, 123456)
+        self.tags = {"a"}
+
+
+@pytest.mark.parametrize(
+    "obj",
+    [
+        {"foo": "bar", "nested": {"list": [1, 2.5, None, True], "tuple": (1, 2)}},
+        {"utc": datetime(2021, 1, 1, 0, 0, 0, tzinfo=timezone.utc)},
+        {"naive": datetime(2021, 1, 1, 10, 0, 0, 500)},
+        {"date": date(2024, 1, 1), "id": uuid.UUID("12345678123456781234567812345678")},
+        {"model": TestModel(foo="bar", bar=datetime(2021, 1, 1, tzinfo=timezone.utc))},
+        {"message": HumanMessage(content="I love programming!")},
+        {"bytes": b"bytes", "unicode": "äöü 😀"},
+        {1: "int key", None: "none key"},
+        {"big_int": 2**70},
+        {"streaming": StreamingResponse(response_gen=iter([]))},
+        {"object": CustomObject()},
+    ],
+)
+def test_serialize_parity_with_event_serializer(obj):
+    assert json.loads(serialize(obj)) == json.loads(
+        json.dumps(obj, cls=EventSerializer)
+    )
+
+
+def test_serialize_without_orjson(monkeypatch):
+    monkeypatch.setattr("langfuse.serializer.orjson", None)
+
+    assert serialize({"foo": "bar"}) == b'{"foo": "bar"}'
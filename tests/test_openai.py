@@ -1,18 +1,28 @@
+import hashlib
+import json
 import os
+import time
+from unittest.mock import MagicMock, patch
 
 import pytest
 from openai import APIConnectionError
 
 from langfuse.client import Langfuse
 from langfuse.openai import (
+    OPENAI_METHODS_V1,
     AsyncAzureOpenAI,
     AsyncOpenAI,
     AzureOpenAI,
+    OpenAI,
     _is_openai_v1,
     _is_streaming_response,
     _filter_image_data,
+    _get_langfuse_data_from_default_response,
+    _GenerationRollup,
+    _StreamingResponseAccumulator,
     openai,
 )
+from langfuse.utils.langfuse_singleton import LangfuseSingleton
 from tests.utils import create_uuid, get_api
 
 chat_func = (
@@ -946,6 +956,35 @@ def test_image_filter_url():
     ]
 
 
+def test_image_filter_copies_only_messages_with_images():
+    image_part = {
+        "type": "image_url",
+        "image_url": {"url": "data:image/png;base64,aGVsbG8=", "detail": "low"},
+    }
+    text_message = {"role": "system", "content": "You describe images."}
+    image_message = {"role": "user", "content": [{"type": "text"}, image_part]}
+    messages = [text_message, image_message]
+
+    result = _filter_image_data(messages, placeholder=True)
+
+    assert result[0] is text_message
+    assert result[1]["content"][0] is image_message["content"][0]
+    assert result[1]["content"][1] == {
+        "type": "image_url",
+        "image_url": {
+            "mime_type": "image/png",
+            "size": 5,
+            "sha256": hashlib.sha256(b"hello").hexdigest(),
+            "detail": "low",
+        },
+    }
+    # the input is sent to OpenAI and must not change
+    assert image_message["content"][1] is image_part
+    assert image_part["image_url"]["url"] == "data:image/png;base64,aGVsbG8="
+
+    assert _filter_image_data([text_message]) == [text_message]
+
+
 def test_openai_with_existing_trace_id():
     langfuse = Langfuse()
     trace = langfuse.trace(
@@ -1002,3 +1041,395 @@ def test_openai_with_existing_trace_id():
     trace = api.trace.get(generation.data[0].trace_id)
     assert trace.output == "This is a standard output"
     assert trace.input == "My custom input"
+
+
+def _chat_chunk(delta, index=0):
+    from openai.types.chat import ChatCompletionChunk
+
+    return ChatCompletionChunk(
+        id="chatcmpl",
+        object="chat.completion.chunk",
+        created=0,
+        model="gpt-3.5-turbo",
+        choices=[{"index": index, "delta": delta, "finish_reason": None}],
+    )
+
+
+def test_streaming_accumulator_chat_content():
+    accumulator = _StreamingResponseAccumulator(OPENAI_METHODS_V1[0])
+
+    accumulator.add(_chat_chunk({"role": "assistant", "content": ""}))
+    for _ in range(1_000):
+        accumulator.add(_chat_chunk({"content": "token "}))
+
+    model, completion_start_time, completion = accumulator.get_result()
+
+    assert model == "gpt-3.5-turbo"
+    assert completion_start_time is not None
+    assert completion == "token " * 1_000
+
+
+def test_streaming_accumulator_chat_tool_calls():
+    accumulator = _StreamingResponseAccumulator(OPENAI_METHODS_V1[0])
+
+    accumulator.add(_chat_chunk({"role": "assistant", "content": None}))
+    for index, name in enumerate(["get_weather", "get_time"]):
+        accumulator.add(
+            _chat_chunk(
+                {
+                    "tool_calls": [
+                        {
+                            "index": index,
+                            "id": f"call_{index}",
+                            "type": "function",
+                            "function": {"name": name, "arguments": ""},
+                        }
+                    ]
+                }
+            )
+        )
+    for part in ['{"location"', ': "Boston"}']:
+        for index in range(2):
+            accumulator.add(
+                _chat_chunk(
+                    {"tool_calls": [{"index": index, "function": {"arguments": part}}]}
+                )
+            )
+
+    assert accumulator.get_result()[2] == [
+        {
+            "id": f"call_{index}",
+            "type": "function",
+            "function": {"name": name, "arguments": '{"location": "Boston"}'},
+        }
+        for index, name in enumerate(["get_weather", "get_time"])
+    ]
+
+
+def test_streaming_accumulator_chat_function_call():
+    accumulator = _StreamingResponseAccumulator(OPENAI_METHODS_V1[0])
+
+    accumulator.add(
+        _chat_chunk(
+            {"role": "assistant", "function_call": {"name": "answer", "arguments": ""}}
+        )
+    )
+    accumulator.add(_chat_chunk({"function_call": {"arguments": '{"a": '}}))
+    accumulator.add(_chat_chunk({"function_call": {"arguments": "1}"}}))
+
+    assert accumulator.get_result()[2] == {"name": "answer", "arguments": '{"a": 1}'}
+
+
+def test_streaming_accumulator_completion():
+    from openai.types import Completion
+
+    accumulator = _StreamingResponseAccumulator(OPENAI_METHODS_V1[1])
+
+    for text in ["1, ", "2, ", "3"]:
+        accumulator.add(
+            Completion(
+                id="cmpl",
+                object="text_completion",
+                created=0,
+                model="gpt-3.5-turbo-instruct",
+                choices=[{"index": 0, "text": text, "finish_reason": "length"}],
+            )
+        )
+
+    assert accumulator.get_result()[::2] == ("gpt-3.5-turbo-instruct", "1, 2, 3")
+    assert _StreamingResponseAccumulator(OPENAI_METHODS_V1[1]).get_result()[2] == ""
+
+
+def test_default_response_extraction():
+    from openai.types.chat import ChatCompletion
+
+    response = ChatCompletion(
+        id="chatcmpl",
+        object="chat.completion",
+        created=0,
+        model="gpt-3.5-turbo",
+        choices=[
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": "2"},
+                "finish_reason": "stop",
+            }
+        ],
+        usage={"prompt_tokens": 5, "completion_tokens": 1, "total_tokens": 6},
+    )
+
+    model, completion, usage = _get_langfuse_data_from_default_response(
+        OPENAI_METHODS_V1[0], response
+    )
+
+    assert model == "gpt-3.5-turbo"
+    assert completion["content"] == "2"
+    assert usage["total_tokens"] == 6
+
+
+def _embedding_transport():
+    import httpx
+
+    def handler(request):
+        inputs = json.loads(request.content)["input"]
+
+        return httpx.Response(
+            200,
+            json={
+                "object": "list",
+                "model": "text-embedding-3-small",
+                "data": [
+                    {"object": "embedding", "index": index, "embedding": [0.1] * 1536}
+                    for index in range(len(inputs))
+                ],
+                "usage": {"prompt_tokens": 8, "total_tokens": 8},
+            },
+        )
+
+    return httpx.MockTransport(handler)
+
+
+def _get_generation_events(add_task):
+    return [
+        call.args[0]["body"]
+        for call in add_task.call_args_list
+        if call.args[0]["type"].startswith("generation-")
+    ]
+
+
+def test_openai_embeddings_log_usage_without_vectors():
+    import httpx
+
+    langfuse = Langfuse()
+    LangfuseSingleton()._langfuse = langfuse
+    client = OpenAI(
+        api_key="sk-test",
+        http_client=httpx.Client(transport=_embedding_transport()),
+    )
+
+    try:
+        with patch.object(
+            langfuse.task_manager, "add_task", wraps=langfuse.task_manager.add_task
+        ) as add_task:
+            response = client.embeddings.create(
+                model="text-embedding-3-small",
+                input=["hello", "world" * 100, "foo", "bar"],
+            )
+
+        create, update = _get_generation_events(add_task)
+    finally:
+        LangfuseSingleton().reset()
+
+    assert len(response.data) == 4
+    assert create["name"] == "OpenAI-embedding"
+    assert create["input"] == {
+        "count": 4,
+        "preview": ["hello", ("world" * 100)[:100], "foo"],
+    }
+    assert update["model"] == "text-embedding-3-small"
+    assert update["output"] == {"count": 4, "dimensions": 1536}
+    assert update["usage"]["input"] == 8
+    assert update["usage"]["total"] == 8
+
+
+@pytest.mark.asyncio
+async def test_openai_async_embeddings():
+    import httpx
+
+    langfuse = Langfuse()
+    LangfuseSingleton()._langfuse = langfuse
+    client = AsyncOpenAI(
+        api_key="sk-test",
+        http_client=httpx.AsyncClient(transport=_embedding_transport()),
+    )
+
+    try:
+        with patch.object(
+            langfuse.task_manager, "add_task", wraps=langfuse.task_manager.add_task
+        ) as add_task:
+            await client.embeddings.create(
+                model="text-embedding-3-small", input=[[1, 2, 3]]
+            )
+
+        create, update = _get_generation_events(add_task)
+    finally:
+        LangfuseSingleton().reset()
+
+    # token arrays are only counted
+    assert create["input"] == {"count": 1}
+    assert update["output"] == {"count": 1, "dimensions": 1536}
+
+
+def _chat_transport(status_code=200):
+    import httpx
+
+    def handler(request):
+        return httpx.Response(
+            status_code,
+            json={
+                "id": "chatcmpl",
+                "object": "chat.completion",
+                "created": 0,
+                "model": "gpt-3.5-turbo",
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "2"},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 5,
+                    "completion_tokens": 1,
+                    "total_tokens": 6,
+                },
+            },
+        )
+
+    return httpx.MockTransport(handler)
+
+
+def test_openai_aggregated_generations():
+    import httpx
+
+    langfuse = Langfuse()
+    LangfuseSingleton()._langfuse = langfuse
+    client = OpenAI(
+        api_key="sk-test",
+        http_client=httpx.Client(transport=_chat_transport()),
+        max_retries=0,
+    )
+    trace_id = create_uuid()
+    messages = [{"role": "user", "content": "1 + 1 = "}]
+
+    try:
+        openai.langfuse_aggregate_generations = True
+        with patch.object(
+            langfuse.task_manager, "add_task", wraps=langfuse.task_manager.add_task
+        ) as add_task:
+            client.chat.completions.create(
+                model="gpt-3.5-turbo", messages=messages, trace_id=trace_id
+            )
+
+        types = [call.args[0]["type"] for call in add_task.call_args_list]
+        (generation,) = _get_generation_events(add_task)
+    finally:
+        openai.langfuse_aggregate_generations = False
+        LangfuseSingleton().reset()
+
+    assert types == ["trace-create", "generation-create"]
+    assert generation["traceId"] == trace_id
+    assert generation["input"] == messages
+    assert generation["output"]["content"] == "2"
+    assert generation["usage"]["total"] == 6
+    assert generation["startTime"] < generation["endTime"]
+
+
+def test_openai_rolled_up_generations():
+    import httpx
+
+    langfuse = Langfuse()
+    LangfuseSingleton()._langfuse = langfuse
+    client = OpenAI(
+        api_key="sk-test",
+        http_client=httpx.Client(transport=_chat_transport()),
+        max_retries=0,
+    )
+    failing_client = OpenAI(
+        api_key="sk-test",
+        http_client=httpx.Client(transport=_chat_transport(500)),
+        max_retries=0,
+    )
+    trace_id = create_uuid()
+    messages = [{"role": "user", "content": "1 + 1 = "}]
+
+    try:
+        openai.langfuse_rollup_generations = True
+        with patch.object(
+            langfuse.task_manager, "add_task", wraps=langfuse.task_manager.add_task
+        ) as add_task:
+            for _ in range(3):
+                client.chat.completions.create(
+                    model="gpt-3.5-turbo", messages=messages, trace_id=trace_id
+                )
+
+            with pytest.raises(openai.InternalServerError):
+                failing_client.chat.completions.create(
+                    model="gpt-3.5-turbo", messages=messages, trace_id=trace_id
+                )
+
+            (error,) = _get_generation_events(add_task)
+
+            openai.flush_langfuse()
+            _, rollup = _get_generation_events(add_task)
+    finally:
+        openai.langfuse_rollup_generations = False
+        LangfuseSingleton().reset()
+
+    assert error["level"] == "ERROR"
+    assert rollup["traceId"] == trace_id
+    assert rollup["model"] == "gpt-3.5-turbo"
+    assert rollup["metadata"] == {"rollup_calls": 3}
+    assert rollup["usage"]["input"] == 15
+    assert rollup["usage"]["output"] == 3
+    assert rollup["usage"]["total"] == 18
+    assert "input" not in rollup
+
+
+def test_only_expired_rolled_up_generations_are_created():
+    langfuse = MagicMock()
+    rollup = _GenerationRollup(window=10)
+
+    try:
+        with patch("langfuse.openai.time.monotonic", return_value=0):
+            rollup.add(langfuse, {"trace_id": "first", "model": "gpt-3.5-turbo"})
+
+        with patch("langfuse.openai.time.monotonic", return_value=5):
+            rollup.add(langfuse, {"trace_id": "second", "model": "gpt-3.5-turbo"})
+
+        with patch("langfuse.openai.time.monotonic", return_value=12):
+            rollup.create_expired()
+
+        (call,) = langfuse.generation.mock_calls
+        assert call.kwargs["trace_id"] == "first"
+    finally:
+        rollup.shutdown()
+
+
+def test_rolled_up_generations_are_created_without_further_calls():
+    langfuse = MagicMock()
+    rollup = _GenerationRollup(window=0.1)
+
+    try:
+        rollup.add(langfuse, {"trace_id": "first", "model": "gpt-3.5-turbo"})
+        time.sleep(0.5)
+
+        (call,) = langfuse.generation.mock_calls
+        assert call.kwargs["metadata"] == {"rollup_calls": 1}
+    finally:
+        rollup.shutdown()
+
+
+def test_client_flushes_rolled_up_generations():
+    # healthy traces are discarded by tail sampling, so nothing is uploaded
+    langfuse = Langfuse(tail_sampling=True)
+    rollup = _GenerationRollup(window=10)
+    trace_id = create_uuid()
+
+    try:
+        with patch.object(
+            langfuse.task_manager, "add_task", wraps=langfuse.task_manager.add_task
+        ) as add_task:
+            rollup.add(langfuse, {"trace_id": trace_id, "model": "gpt-3.5-turbo"})
+            rollup.add(langfuse, {"trace_id": "other", "model": "gpt-3.5-turbo"})
+
+            # the summary of the trace is created before the trace is decided
+            langfuse.end_trace(trace_id)
+            (generation,) = _get_generation_events(add_task)
+            assert generation["traceId"] == trace_id
+
+            langfuse.flush()
+            _, generation = _get_generation_events(add_task)
+            assert generation["traceId"] == "other"
+    finally:
+        rollup.shutdown()
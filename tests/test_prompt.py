@@ -1,9 +1,20 @@
+import asyncio
+import os
+import threading
+import time
+
+import chevron
 import pytest
-from unittest.mock import Mock, patch
+from unittest.mock import AsyncMock, Mock, patch
 
 import openai
-from langfuse.client import Langfuse
-from langfuse.prompt_cache import PromptCacheItem, DEFAULT_PROMPT_CACHE_TTL_SECONDS
+from langfuse.client import AsyncLangfuse, Langfuse
+from langfuse.prompt_cache import (
+    AsyncSingleFlight,
+    PromptCache,
+    PromptCacheItem,
+    DEFAULT_PROMPT_CACHE_TTL_SECONDS,
+)
 from tests.utils import create_uuid, get_api
 from langfuse.api.resources.prompts import Prompt_Text, Prompt_Chat
 from langfuse.model import TextPromptClient, ChatPromptClient
@@ -108,6 +119,122 @@ def test_compiling_prompt():
     )
 
 
+@pytest.mark.parametrize(
+    "template",
+    [
+        "Hello, {{target}}!",
+        "Escaped {{html}} and raw {{{html}}} and {{& html}}",
+        "{{missing}} {{zero}} {{false}} {{none}} {{number}}",
+        "Dotted {{user.name}} and {{user.missing}}",
+        "{{#items}}- {{.}}\n{{/items}}{{^empty}}no items{{/empty}}",
+        "{{! a comment }}{{=<% %>=}}<% target %>",
+        "  {{#user}}\n  {{name}}\n  {{/user}}\n",
+    ],
+)
+def test_compiled_prompt_matches_chevron(template):
+    data = {
+        "target": "world",
+        "html": '<b> & "quotes"',
+        "zero": 0,
+        "false": False,
+        "none": None,
+        "number": 1.5,
+        "user": {"name": "Ada"},
+        "items": ["a", "b"],
+        "empty": [],
+    }
+
+    text_prompt = TextPromptClient(
+        Prompt_Text(name="test", version=1, prompt=template, config={})
+    )
+    chat_prompt = ChatPromptClient(
+        Prompt_Chat(
+            name="test",
+            version=1,
+            prompt=[{"role": "system", "content": template}],
+            config={},
+        )
+    )
+
+    assert text_prompt.compile(**data) == chevron.render(template, data)
+    assert chat_prompt.compile(**data)[0]["content"] == chevron.render(template, data)
+
+
+def test_compiled_prompt_raises_like_chevron():
+    prompt = TextPromptClient(
+        Prompt_Text(name="test", version=1, prompt="{{#open}}", config={})
+    )
+
+    with pytest.raises(chevron.ChevronError):
+        prompt.compile(open=True)
+
+
+def test_compiled_prompt_follows_reassigned_prompt():
+    prompt = TextPromptClient(
+        Prompt_Text(name="test", version=1, prompt="Hi {{a}}", config={})
+    )
+    assert prompt.get_langchain_prompt() == "Hi {a}"
+
+    prompt.prompt = "Bye {{a}}"
+
+    assert prompt.compile(a="there") == "Bye there"
+    assert prompt.get_langchain_prompt() == "Bye {a}"
+
+
+def test_cached_langchain_chat_prompt_is_a_copy():
+    prompt = ChatPromptClient(
+        Prompt_Chat(
+            name="test",
+            version=1,
+            prompt=[{"role": "user", "content": "Hi {{a}}"}],
+            config={},
+        )
+    )
+
+    messages = prompt.get_langchain_prompt()
+    messages.append(("user", "changed"))
+
+    assert prompt.get_langchain_prompt() == [("user", "Hi {a}")]
+
+
+def test_compile_many_streams_results():
+    prompt = TextPromptClient(
+        Prompt_Text(name="test", version=1, prompt="Hi {{name}}", config={})
+    )
+    consumed = []
+
+    def variables():
+        for i in range(1_000_000):
+            consumed.append(i)
+            yield {"name": i}
+
+    results = prompt.compile_many(variables())
+
+    assert next(results) == "Hi 0"
+    assert next(results) == "Hi 1"
+    assert consumed == [0, 1]
+
+
+@pytest.mark.parametrize("processes", [None, 2])
+def test_compile_many_chat_prompt(processes):
+    prompt = ChatPromptClient(
+        Prompt_Chat(
+            name="test",
+            version=1,
+            prompt=[
+                {"role": "system", "content": "You are {{role}}."},
+                {"role": "user", "content": "{{#items}}{{.}} {{/items}}"},
+            ],
+            config={},
+        )
+    )
+    variables = [{"role": f"bot {i}", "items": [i, i + 1]} for i in range(50)]
+
+    results = list(prompt.compile_many(variables, processes=processes, chunksize=7))
+
+    assert results == [prompt.compile(**kwargs) for kwargs in variables]
+
+
 def test_create_prompt_with_null_config():
     langfuse = Langfuse(debug=False)
 
@@ -277,7 +404,7 @@ def test_get_valid_cached_chat_prompt(langfuse):
 
 
 # Should refetch and return new prompt if cached one is expired according to custom TTL
-@patch.object(PromptCacheItem, "get_epoch_seconds")
+@patch.object(PromptCacheItem, "get_current_time")
 def test_get_fresh_prompt_when_expired_cache_custom_ttl(mock_time, langfuse):
     mock_time.return_value = 0
     ttl_seconds = 20
@@ -315,7 +442,7 @@ def test_get_fresh_prompt_when_expired_cache_custom_ttl(mock_time, langfuse):
 
 
 # Should refetch and return new prompt if cached one is expired according to default TTL
-@patch.object(PromptCacheItem, "get_epoch_seconds")
+@patch.object(PromptCacheItem, "get_current_time")
 def test_get_fresh_prompt_when_expired_cache_default_ttl(mock_time, langfuse):
     mock_time.return_value = 0
 
@@ -352,7 +479,7 @@ def test_get_fresh_prompt_when_expired_cache_default_ttl(mock_time, langfuse):
 
 
 # Should return expired prompt if refetch fails
-@patch.object(PromptCacheItem, "get_epoch_seconds")
+@patch.object(PromptCacheItem, "get_current_time")
 def test_get_expired_prompt_when_failing_fetch(mock_time, langfuse):
     mock_time.return_value = 0
 
@@ -415,3 +542,457 @@ def test_get_fresh_prompt_when_version_changes(langfuse):
     result_call_2 = langfuse.get_prompt(prompt_name, version=2)
     assert mock_server_call.call_count == 2
     assert result_call_2 == version_changed_prompt_client
+
+
+# Should return the expired prompt immediately and refresh it in the background
+@patch.object(PromptCacheItem, "get_current_time")
+def test_get_stale_prompt_while_revalidating(mock_time, langfuse):
+    langfuse.prompt_cache_stale_while_revalidate = True
+    mock_time.return_value = 0
+
+    prompt_name = "test"
+    prompt = Prompt_Text(
+        name=prompt_name,
+        version=1,
+        prompt="Make me laugh",
+        type="text",
+        config={},
+    )
+    prompt_client = TextPromptClient(prompt)
+
+    mock_server_call = langfuse.client.prompts.get
+    mock_server_call.return_value = prompt
+
+    result_call_1 = langfuse.get_prompt(prompt_name)
+    assert mock_server_call.call_count == 1
+    assert result_call_1 == prompt_client
+
+    # Set time to just AFTER cache expiry
+    mock_time.return_value = DEFAULT_PROMPT_CACHE_TTL_SECONDS + 1
+
+    updated_prompt = Prompt_Text(
+        name=prompt_name,
+        version=2,
+        prompt="Make me laugh more",
+        type="text",
+        config={},
+    )
+    refresh_started = threading.Event()
+    release_refresh = threading.Event()
+
+    def slow_fetch(**kwargs):
+        refresh_started.set()
+        release_refresh.wait(5)
+        return updated_prompt
+
+    mock_server_call.side_effect = slow_fetch
+
+    # the stale prompt is served while a single refresh is running
+    result_call_2 = langfuse.get_prompt(prompt_name)
+    assert refresh_started.wait(5)
+    result_call_3 = langfuse.get_prompt(prompt_name)
+    assert result_call_2 == prompt_client
+    assert result_call_3 == prompt_client
+
+    release_refresh.set()
+    langfuse.prompt_cache.wait_for_refresh_completion()
+    assert mock_server_call.call_count == 2
+
+    result_call_4 = langfuse.get_prompt(prompt_name)
+    assert result_call_4 == TextPromptClient(updated_prompt)
+    assert mock_server_call.call_count == 2
+
+
+# Should keep serving the expired prompt if the background refresh fails
+@patch.object(PromptCacheItem, "get_current_time")
+def test_get_stale_prompt_when_background_refresh_fails(mock_time, langfuse):
+    langfuse.prompt_cache_stale_while_revalidate = True
+    mock_time.return_value = 0
+
+    prompt_name = "test"
+    prompt = Prompt_Text(
+        name=prompt_name,
+        version=1,
+        prompt="Make me laugh",
+        type="text",
+        config={},
+    )
+    prompt_client = TextPromptClient(prompt)
+
+    mock_server_call = langfuse.client.prompts.get
+    mock_server_call.return_value = prompt
+    langfuse.get_prompt(prompt_name)
+
+    mock_time.return_value = DEFAULT_PROMPT_CACHE_TTL_SECONDS + 1
+    mock_server_call.side_effect = Exception("Server error")
+
+    assert langfuse.get_prompt(prompt_name) == prompt_client
+    langfuse.prompt_cache.wait_for_refresh_completion()
+
+    # the failed refresh is retried on the next call
+    assert langfuse.get_prompt(prompt_name) == prompt_client
+    langfuse.prompt_cache.wait_for_refresh_completion()
+    assert mock_server_call.call_count == 3
+
+
+# Concurrent cache misses for the same prompt should result in a single fetch
+@pytest.mark.timeout(10)
+def test_concurrent_cache_misses_share_one_fetch(langfuse):
+    prompt_name = "test"
+    prompt = Prompt_Text(
+        name=prompt_name,
+        version=1,
+        prompt="Make me laugh",
+        type="text",
+        config={},
+    )
+    threads = 50
+    barrier = threading.Barrier(threads)
+
+    def slow_fetch(**kwargs):
+        time.sleep(0.2)
+        return prompt
+
+    mock_server_call = langfuse.client.prompts.get
+    mock_server_call.side_effect = slow_fetch
+
+    results = []
+
+    def get_prompt():
+        barrier.wait()
+        results.append(langfuse.get_prompt(prompt_name))
+
+    workers = [threading.Thread(target=get_prompt) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert mock_server_call.call_count == 1
+    assert results == [TextPromptClient(prompt)] * threads
+
+
+# All callers waiting on a failing fetch should receive its error
+@pytest.mark.timeout(10)
+def test_concurrent_cache_misses_share_fetch_error(langfuse):
+    threads = 20
+    barrier = threading.Barrier(threads)
+
+    def failing_fetch(**kwargs):
+        time.sleep(0.2)
+        raise Exception("Prompt not found")
+
+    mock_server_call = langfuse.client.prompts.get
+    mock_server_call.side_effect = failing_fetch
+
+    errors = []
+
+    def get_prompt():
+        barrier.wait()
+        try:
+            langfuse.get_prompt("test")
+        except Exception as e:
+            errors.append(str(e))
+
+    workers = [threading.Thread(target=get_prompt) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert mock_server_call.call_count == 1
+    assert errors == ["Prompt not found"] * threads
+    langfuse.log.exception.assert_called_once()
+
+
+@pytest.mark.asyncio
+@pytest.mark.timeout(10)
+async def test_async_concurrent_cache_misses_share_one_fetch():
+    langfuse = AsyncLangfuse()
+    langfuse.async_client = Mock()
+
+    prompt = Prompt_Chat(
+        name="test",
+        version=1,
+        prompt=[{"role": "system", "content": "Make me laugh"}],
+        type="chat",
+        config={},
+    )
+
+    async def slow_fetch(**kwargs):
+        await asyncio.sleep(0.1)
+        return prompt
+
+    langfuse.async_client.prompts.get = AsyncMock(side_effect=slow_fetch)
+
+    results = await asyncio.gather(*[langfuse.aget_prompt("test") for _ in range(100)])
+
+    assert langfuse.async_client.prompts.get.await_count == 1
+    assert results == [ChatPromptClient(prompt)] * 100
+
+    # served from the cache
+    assert await langfuse.aget_prompt("test") == ChatPromptClient(prompt)
+    assert langfuse.async_client.prompts.get.await_count == 1
+
+    await langfuse.ashutdown()
+
+
+@pytest.mark.asyncio
+@pytest.mark.timeout(10)
+async def test_async_single_flight_shares_errors():
+    single_flight = AsyncSingleFlight()
+    calls = 0
+
+    async def failing_fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.1)
+        raise ValueError("Prompt not found")
+
+    results = await asyncio.gather(
+        *[single_flight.do("test-latest", failing_fetch) for _ in range(20)],
+        return_exceptions=True,
+    )
+
+    assert calls == 1
+    assert all(isinstance(result, ValueError) for result in results)
+
+    # the next call after the failure starts a new fetch
+    with pytest.raises(ValueError):
+        await single_flight.do("test-latest", failing_fetch)
+    assert calls == 2
+
+
+def create_text_prompt_client(name: str, prompt: str = "Make me laugh"):
+    return TextPromptClient(
+        Prompt_Text(name=name, version=1, prompt=prompt, type="text", config={})
+    )
+
+
+def test_prompt_cache_evicts_least_recently_used():
+    cache = PromptCache(max_entries=2)
+
+    cache.set("a-latest", create_text_prompt_client("a"), None)
+    cache.set("b-latest", create_text_prompt_client("b"), None)
+    assert cache.get("a-latest") is not None
+
+    cache.set("c-latest", create_text_prompt_client("c"), None)
+
+    assert cache.get("b-latest") is None
+    assert cache.get("a-latest") is not None
+    assert cache.get("c-latest") is not None
+
+    stats = cache.get_stats()
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 3
+    assert stats["misses"] == 1
+
+
+def test_prompt_cache_evicts_by_size():
+    prompt = create_text_prompt_client("a", "x" * 1_000)
+    cache = PromptCache(max_bytes=int(PromptCacheItem.estimate_size(prompt) * 2.5))
+
+    for name in ["a", "b", "c"]:
+        cache.set(f"{name}-latest", create_text_prompt_client(name, "x" * 1_000), None)
+
+    assert cache.get("a-latest") is None
+    assert cache.get_stats()["entries"] == 2
+
+    # an entry larger than the limit replaces all others but is still cached
+    cache.set("d-latest", create_text_prompt_client("d", "x" * 10_000), None)
+    assert cache.get("d-latest") is not None
+    assert cache.get_stats()["entries"] == 1
+
+    # replacing an entry does not count its old size
+    cache.set("d-latest", create_text_prompt_client("d"), None)
+    assert cache.get_stats()["bytes"] == PromptCacheItem.estimate_size(
+        create_text_prompt_client("d")
+    )
+
+
+@patch.object(PromptCacheItem, "get_current_time")
+def test_prompt_cache_counts_stale_hits(mock_time):
+    mock_time.return_value = 1000.0
+    cache = PromptCache()
+    cache.set("a-latest", create_text_prompt_client("a"), 10)
+
+    mock_time.return_value = 1011.0
+    assert cache.get("a-latest").is_expired()
+    assert cache.get_stats()["stale_hits"] == 1
+
+
+@pytest.mark.timeout(20)
+def test_prompt_cache_concurrent_access():
+    cache = PromptCache(max_entries=50)
+    prompts = [create_text_prompt_client(f"prompt-{i}") for i in range(200)]
+
+    def worker(offset: int):
+        for i in range(2_000):
+            key = f"prompt-{(i + offset) % 200}-latest"
+            if cache.get(key) is None:
+                cache.set(key, prompts[(i + offset) % 200], None)
+
+    workers = [threading.Thread(target=worker, args=(i * 7,)) for i in range(8)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    stats = cache.get_stats()
+    assert stats["entries"] == 50
+    assert stats["hits"] + stats["misses"] == 16_000
+    assert stats["bytes"] == sum(
+        PromptCacheItem.estimate_size(item.value) for item in cache._cache.values()
+    )
+
+
+@pytest.mark.timeout(10)
+def test_prefetch_prompts(langfuse):
+    def slow_fetch(name, version):
+        time.sleep(0.2)
+        if name == "missing":
+            raise Exception("Prompt not found")
+
+        return Prompt_Text(
+            name=name, version=version or 1, prompt=name, type="text", config={}
+        )
+
+    mock_server_call = langfuse.client.prompts.get
+    mock_server_call.side_effect = slow_fetch
+
+    start = time.monotonic()
+    failed = langfuse.prefetch_prompts(
+        ["a", "b", ("c", 2), "missing", "a"], max_workers=8
+    )
+
+    # fetched concurrently
+    assert time.monotonic() - start < 0.6
+    assert list(failed) == ["missing-latest"]
+    assert str(failed["missing-latest"]) == "Prompt not found"
+    assert mock_server_call.call_count == 4
+
+    assert langfuse.get_prompt("a").prompt == "a"
+    assert langfuse.get_prompt("c", 2).version == 2
+    assert mock_server_call.call_count == 4
+
+
+@pytest.mark.asyncio
+@pytest.mark.timeout(10)
+async def test_async_prefetch_prompts():
+    langfuse = AsyncLangfuse()
+    langfuse.async_client = Mock()
+
+    async def slow_fetch(name, version):
+        await asyncio.sleep(0.2)
+        if name == "missing":
+            raise Exception("Prompt not found")
+
+        return Prompt_Text(
+            name=name, version=version or 1, prompt=name, type="text", config={}
+        )
+
+    langfuse.async_client.prompts.get = AsyncMock(side_effect=slow_fetch)
+
+    failed = await langfuse.aprefetch_prompts(["a", ("b", 3), "missing"])
+
+    assert list(failed) == ["missing-latest"]
+    assert (await langfuse.aget_prompt("b", 3)).version == 3
+    assert langfuse.async_client.prompts.get.await_count == 3
+
+    await langfuse.ashutdown()
+
+
+def test_prompt_cache_snapshot(tmp_path):
+    path = str(tmp_path / "prompts.json")
+    cache = PromptCache(snapshot_path=path)
+    text_prompt = create_text_prompt_client("my-prompt", "Hello {{name}}")
+    chat_prompt = ChatPromptClient(
+        Prompt_Chat(
+            name="chat-prompt",
+            version=3,
+            prompt=[{"role": "system", "content": "Hello {{name}}"}],
+            type="chat",
+            config={"temperature": 0.5},
+        )
+    )
+    cache.set("my-prompt-latest", text_prompt, None)
+    cache.set("chat-prompt-3", chat_prompt, None)
+    cache.wait_for_refresh_completion()
+
+    restored = PromptCache(snapshot_path=path)
+    assert restored.load_snapshot() == ["my-prompt-latest", "chat-prompt-3"]
+
+    assert restored.get("my-prompt-latest").value == text_prompt
+    assert restored.get("chat-prompt-3").value == chat_prompt
+    # snapshot entries are served as stale until revalidated
+    assert restored.get("my-prompt-latest").is_expired()
+
+    assert PromptCache.parse_cache_key("my-prompt-latest") == ("my-prompt", None)
+    assert PromptCache.parse_cache_key("chat-prompt-3") == ("chat-prompt", 3)
+
+
+def test_prompt_cache_snapshot_writes_are_coalesced_in_the_background(tmp_path):
+    path = str(tmp_path / "prompts.json")
+    cache = PromptCache(snapshot_path=path)
+    release = threading.Event()
+
+    # occupies the refresh worker, the prompts below are set while the write is pending
+    cache.add_refresh_prompt_task("blocker", release.wait)
+
+    with patch("langfuse.prompt_cache.os.fsync", wraps=os.fsync) as fsync:
+        for i in range(20):
+            cache.set(f"prompt-{i}-latest", create_text_prompt_client("p", "x"), None)
+
+        assert not os.path.exists(path)
+
+        release.set()
+        cache.wait_for_refresh_completion()
+
+    fsync.assert_called_once()
+    assert len(PromptCache(snapshot_path=path).load_snapshot()) == 20
+
+
+def test_prompt_cache_snapshot_ignores_invalid_files(tmp_path):
+    path = tmp_path / "prompts.json"
+
+    assert PromptCache(snapshot_path=str(path)).load_snapshot() == []
+
+    path.write_text("{not json")
+    assert PromptCache(snapshot_path=str(path)).load_snapshot() == []
+
+    path.write_text('{"version": 999, "prompts": []}')
+    assert PromptCache(snapshot_path=str(path)).load_snapshot() == []
+
+
+def test_prompt_cache_snapshot_is_revalidated_on_startup(tmp_path):
+    path = str(tmp_path / "prompts.json")
+    cache = PromptCache(snapshot_path=path)
+    cache.set("test-latest", create_text_prompt_client("test", "old"), None)
+    cache.wait_for_refresh_completion()
+
+    with patch("langfuse.client.FernLangfuse") as fern_langfuse:
+        fern_langfuse.return_value.prompts.get.return_value = Prompt_Text(
+            name="test", version=2, prompt="new", type="text", config={}
+        )
+        langfuse = Langfuse(prompt_cache_path=path)
+        langfuse.prompt_cache.wait_for_refresh_completion()
+
+    fern_langfuse.return_value.prompts.get.assert_called_once_with(
+        name="test", version=None
+    )
+    assert langfuse.get_prompt("test").prompt == "new"
+
+
+def test_prompt_cache_snapshot_serves_stale_prompt_when_api_is_down(tmp_path):
+    path = str(tmp_path / "prompts.json")
+    cache = PromptCache(snapshot_path=path)
+    cache.set("test-latest", create_text_prompt_client("test", "old"), None)
+    cache.wait_for_refresh_completion()
+
+    with patch("langfuse.client.FernLangfuse") as fern_langfuse:
+        fern_langfuse.return_value.prompts.get.side_effect = Exception("API down")
+        langfuse = Langfuse(prompt_cache_path=path)
+        langfuse.prompt_cache.wait_for_refresh_completion()
+
+        assert langfuse.get_prompt("test").prompt == "old"
@@ -0,0 +1,191 @@
+import pytest
+
+from langfuse.client import Langfuse
+from langfuse.decorators import langfuse_context, observe
+from langfuse.sampling import TraceSampler
+from langfuse.utils.langfuse_singleton import LangfuseSingleton
+from tests.utils import create_uuid
+
+
+def test_sample_rate_is_deterministic_per_trace_id():
+    trace_ids = [create_uuid() for _ in range(2_000)]
+
+    first = TraceSampler(sample_rate=0.25)
+    second = TraceSampler(sample_rate=0.25)
+
+    decisions = [first.is_sampled(trace_id) for trace_id in trace_ids]
+    assert decisions == [second.is_sampled(trace_id) for trace_id in trace_ids]
+    assert 0.2 < sum(decisions) / len(decisions) < 0.3
+
+
+def test_sample_rate_bounds():
+    assert TraceSampler(sample_rate=1.0).is_sampled(create_uuid())
+    assert not TraceSampler(sample_rate=0.0).is_sampled(create_uuid())
+
+    with pytest.raises(ValueError):
+        TraceSampler(sample_rate=1.5)
+
+
+def test_custom_sampler_is_called_once_per_trace_id():
+    calls = []
+
+    def sampler(trace_id):
+        calls.append(trace_id)
+
+        return len(calls) % 2 == 1
+
+    trace_sampler = TraceSampler(sampler=sampler, max_decisions=2)
+
+    assert trace_sampler.is_sampled("a")
+    assert not trace_sampler.is_sampled("b")
+    assert trace_sampler.is_sampled("a")
+    assert not trace_sampler.is_sampled("b")
+    assert calls == ["a", "b"]
+
+    # decisions of open traces are kept beyond max_decisions
+    trace_sampler.is_sampled("c")
+    trace_sampler.is_sampled("a")
+    assert calls == ["a", "b", "c"]
+
+    # ended traces are remembered, the oldest ended decision is evicted
+    for trace_id in ["a", "b", "c"]:
+        trace_sampler.end(trace_id)
+
+    assert not trace_sampler.is_sampled("b")
+    trace_sampler.is_sampled("a")
+    assert calls == ["a", "b", "c", "a"]
+
+
+def test_open_trace_decisions_are_bounded():
+    calls = []
+
+    def sampler(trace_id):
+        calls.append(trace_id)
+
+        return True
+
+    trace_sampler = TraceSampler(sampler=sampler, max_decisions=1, max_open_traces=2)
+
+    for trace_id in ["a", "b", "c", "a"]:
+        trace_sampler.is_sampled(trace_id)
+
+    assert calls == ["a", "b", "c", "a"]
+
+
+def test_end_trace_releases_the_sampling_decision():
+    calls = []
+
+    def sampler(trace_id):
+        calls.append(trace_id)
+
+        return True
+
+    langfuse = Langfuse(sampler=sampler)
+
+    trace = langfuse.trace()
+    trace.span()
+    assert calls == [trace.id]
+
+    langfuse.end_trace(trace.id)
+    assert trace.id not in langfuse._sampler._open
+    assert langfuse._sampler.is_sampled(trace.id)
+    assert calls == [trace.id]
+
+
+def test_failing_sampler_keeps_traces():
+    def sampler(trace_id):
+        raise ValueError("boom")
+
+    assert TraceSampler(sampler=sampler).is_sampled(create_uuid())
+
+
+def test_unsampled_trace_sends_no_events():
+    langfuse = Langfuse(sample_rate=0.0)
+
+    trace = langfuse.trace(name="trace", input={"query": "hi"})
+    span = trace.span(name="span")
+    generation = span.generation(name="generation", model="gpt-3.5-turbo")
+    generation.end(output="hello")
+    span.event(name="event")
+    span.score(name="score", value=1)
+    span.end()
+    trace.update(output="done")
+    langfuse.score(trace_id=trace.id, name="score", value=1)
+    langfuse.generation(trace_id=trace.id, name="generation")
+
+    assert not trace.sampled
+    assert not generation.sampled
+    assert generation.trace_id == trace.id
+    assert langfuse.task_manager.get_stats()["enqueued"] == 0
+
+
+def test_observations_follow_the_decision_of_their_trace():
+    kept_trace_id = create_uuid()
+    langfuse = Langfuse(sampler=lambda trace_id: trace_id == kept_trace_id)
+
+    dropped = langfuse.trace(id=create_uuid())
+    kept = langfuse.trace(id=kept_trace_id)
+
+    # observations added to the kept trace by id, e.g. from another service
+    span = langfuse.span(trace_id=kept_trace_id, name="remote-span")
+    nested = span.generation(name="nested")
+
+    assert not dropped.sampled
+    assert kept.sampled
+    assert span.sampled
+    assert nested.sampled
+    assert not langfuse.span(trace_id=dropped.id).sampled
+    assert langfuse.task_manager.get_stats()["enqueued"] == 3
+
+
+def test_unsampled_decorated_functions_send_no_events():
+    langfuse = Langfuse(sample_rate=0.0)
+    LangfuseSingleton()._langfuse = langfuse
+
+    @observe(as_type="generation")
+    def generate():
+        langfuse_context.update_current_observation(model="gpt-3.5-turbo")
+
+        return "generated"
+
+    @observe()
+    def main():
+        return generate()
+
+    try:
+        assert main() == "generated"
+        assert generate() == "generated"
+        assert langfuse_context.get_current_observation_id() is None
+        assert langfuse.task_manager.get_stats()["enqueued"] == 0
+    finally:
+        LangfuseSingleton().reset()
+
+
+def test_configure_sampling_for_decorated_functions():
+    kept_trace_ids = []
+
+    def sampler(trace_id):
+        kept = not kept_trace_ids
+        if kept:
+            kept_trace_ids.append(trace_id)
+
+        return kept
+
+    @observe()
+    def main():
+        return langfuse_context.get_current_trace_id()
+
+    try:
+        langfuse = langfuse_context.configure(sampler=sampler)
+
+        assert main() == kept_trace_ids[0]
+        main()
+        assert langfuse.task_manager.get_stats()["enqueued"] == 2
+
+        langfuse = langfuse_context.configure(sample_rate=0.0)
+
+        main()
+        assert LangfuseSingleton().get() is langfuse
+        assert langfuse.task_manager.get_stats()["enqueued"] == 0
+    finally:
+        LangfuseSingleton().reset()
@@ -0,0 +1,155 @@
+import os
+from unittest.mock import patch
+
+from langfuse.spill_queue import SpillQueue
+
+
+def test_spill_queue_in_order(tmp_path):
+    spill = SpillQueue(str(tmp_path), segment_max_bytes=100)
+
+    for i in range(20):
+        assert spill.put(b'{"id": %d}' % i)
+
+    items = []
+    while True:
+        batch = spill.get_batch(3, 1_000_000)
+        if batch is None:
+            break
+        items.extend(batch.items)
+        spill.ack(batch)
+
+    assert items == [b'{"id": %d}' % i for i in range(20)]
+    assert spill.get_stats() == {"bytes": 0, "segments": 0, "dropped_records": 0}
+    assert os.listdir(tmp_path) == []
+
+
+def test_spill_queue_replays_unacknowledged_segments(tmp_path):
+    spill = SpillQueue(str(tmp_path))
+    spill.put(b'{"id": 1}')
+    spill.put(b'{"id": 2}')
+
+    batch = spill.get_batch(1, 1_000_000)
+    spill.ack(batch)
+    spill.close()
+
+    # the segment was only partially acknowledged, all of it is replayed
+    replayed = SpillQueue(str(tmp_path))
+    batch = replayed.get_batch(10, 1_000_000)
+    assert batch.items == [b'{"id": 1}', b'{"id": 2}']
+    replayed.ack(batch)
+
+    assert replayed.get_batch(10, 1_000_000) is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_spill_queue_nack_keeps_segment(tmp_path):
+    spill = SpillQueue(str(tmp_path))
+    spill.put(b'{"id": 1}')
+
+    spill.nack(spill.get_batch(10, 1_000_000))
+
+    assert spill.get_batch(10, 1_000_000) is None
+    assert spill.join(timeout=1)
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_spill_queue_retries_nacked_records_after_delay(tmp_path):
+    spill = SpillQueue(str(tmp_path))
+    spill.put(b'{"id": 1}')
+
+    with patch("langfuse.spill_queue.time.monotonic", return_value=0):
+        spill.nack(spill.get_batch(1, 1_000_000))
+        assert spill.get_batch(10, 1_000_000) is None
+
+    with patch("langfuse.spill_queue.time.monotonic", return_value=1.5):
+        batch = spill.get_batch(10, 1_000_000)
+        assert batch.items == [b'{"id": 1}']
+        spill.nack(batch)
+
+    # the delay doubles while uploads keep failing
+    with patch("langfuse.spill_queue.time.monotonic", return_value=3):
+        assert spill.get_batch(10, 1_000_000) is None
+
+    with patch("langfuse.spill_queue.time.monotonic", return_value=4):
+        spill.ack(spill.get_batch(10, 1_000_000))
+
+    assert spill.get_stats() == {"bytes": 0, "segments": 0, "dropped_records": 0}
+    assert os.listdir(tmp_path) == []
+
+
+def test_spill_queue_only_reads_failed_records_again(tmp_path):
+    spill = SpillQueue(str(tmp_path))
+    for i in range(3):
+        spill.put(b'{"id": %d}' % i)
+
+    with patch("langfuse.spill_queue.time.monotonic", return_value=0):
+        # e.g. a partially successful upload
+        spill.nack(spill.get_batch(10, 1_000_000), [1])
+
+    with patch("langfuse.spill_queue.time.monotonic", return_value=2):
+        batch = spill.get_batch(10, 1_000_000)
+        assert batch.items == [b'{"id": 1}']
+        spill.ack(batch)
+        assert spill.get_batch(10, 1_000_000) is None
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_spill_queue_drops_records_after_max_attempts(tmp_path):
+    spill = SpillQueue(str(tmp_path), max_attempts=3)
+    spill.put(b'{"id": 1}')
+
+    for attempt in range(3):
+        with patch("langfuse.spill_queue.time.monotonic", return_value=attempt * 10):
+            spill.nack(spill.get_batch(10, 1_000_000))
+
+    with patch("langfuse.spill_queue.time.monotonic", return_value=100):
+        assert spill.get_batch(10, 1_000_000) is None
+
+    assert spill.get_stats() == {"bytes": 0, "segments": 0, "dropped_records": 1}
+    assert os.listdir(tmp_path) == []
+
+
+def test_spill_queue_reads_failed_and_unread_records_in_turns(tmp_path):
+    spill = SpillQueue(str(tmp_path), segment_max_bytes=20)
+    for i in range(4):
+        spill.put(b'{"id": %d}' % i)
+
+    # the records of the first two segments keep failing
+    failing = [b'{"id": 0}', b'{"id": 1}']
+    items = []
+    for i in range(6):
+        with patch("langfuse.spill_queue.time.monotonic", return_value=i * 100):
+            batch = spill.get_batch(10, 1_000_000)
+            items.extend(batch.items)
+            if batch.items[0] in failing:
+                spill.nack(batch)
+            else:
+                spill.ack(batch)
+
+    # they do not hold up the other records, and take turns
+    assert items[2:] == [b'{"id": 0}', b'{"id": 2}', b'{"id": 1}', b'{"id": 3}']
+
+
+def test_spill_queue_skips_corrupted_tail(tmp_path):
+    spill = SpillQueue(str(tmp_path))
+    spill.put(b'{"id": 1}')
+    spill.put(b'{"id": 2}')
+    spill.close()
+
+    # simulate a torn write
+    [name] = os.listdir(tmp_path)
+    path = os.path.join(tmp_path, name)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 2)
+
+    replayed = SpillQueue(str(tmp_path))
+    batch = replayed.get_batch(10, 1_000_000)
+    assert batch.items == [b'{"id": 1}']
+
+
+def test_spill_queue_max_bytes(tmp_path):
+    spill = SpillQueue(str(tmp_path), max_bytes=50)
+
+    assert spill.put(b"x" * 30)
+    assert not spill.put(b"x" * 30)
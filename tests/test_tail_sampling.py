@@ -0,0 +1,243 @@
+import datetime as dt
+import time
+from unittest.mock import patch
+
+import pytest
+
+from langfuse.client import Langfuse
+from langfuse.decorators import langfuse_context, observe
+from langfuse.tail_sampling import TailSamplingBuffer
+from langfuse.utils.langfuse_singleton import LangfuseSingleton
+from tests.utils import create_uuid
+
+START = dt.datetime(2024, 1, 1, tzinfo=dt.timezone.utc)
+
+
+def span_event(trace_id, seconds=1.0, level=None):
+    return {
+        "type": "span-create",
+        "body": {
+            "traceId": trace_id,
+            "startTime": START,
+            "endTime": START + dt.timedelta(seconds=seconds),
+            "level": level,
+        },
+    }
+
+
+def trace_event(trace_id, tags=None):
+    return {"type": "trace-create", "body": {"id": trace_id, "tags": tags}}
+
+
+def test_healthy_traces_are_discarded():
+    buffer = TailSamplingBuffer(latency_threshold=5)
+
+    assert buffer.add(trace_event("a"), b"trace", 5) == []
+    assert buffer.add(span_event("a"), b"span", 4) == []
+    assert buffer.complete("a") == []
+
+    # events after the decision follow it
+    assert buffer.add(span_event("a"), b"late", 4) == []
+    assert buffer.get_stats() == {
+        "pending_traces": 0,
+        "pending_bytes": 0,
+        "kept_traces": 0,
+        "discarded_traces": 1,
+        "discarded_events": 3,
+    }
+
+
+def test_errored_slow_and_tagged_traces_are_kept():
+    buffer = TailSamplingBuffer(latency_threshold=5, tags=["debug"])
+
+    buffer.add(span_event("error", level="ERROR"), b"error", 5)
+    buffer.add(span_event("slow", seconds=10), b"slow", 4)
+    buffer.add(trace_event("tagged", tags=["debug"]), b"tagged", 6)
+
+    assert buffer.complete("error") == [b"error"]
+    assert buffer.complete("slow") == [b"slow"]
+    assert buffer.complete("tagged") == [b"tagged"]
+    assert buffer.add(span_event("error"), b"late", 4) == [b"late"]
+
+
+def test_updates_are_buffered_with_the_trace_of_their_observation():
+    buffer = TailSamplingBuffer()
+
+    create = span_event("a")
+    create["body"]["id"] = "span"
+    update = {"type": "span-update", "body": {"id": "span", "level": "ERROR"}}
+
+    assert buffer.add(create, b"create", 6) == []
+    assert buffer.add(update, b"update", 6) == []
+    assert buffer.complete("a") == [b"create", b"update"]
+
+
+def test_healthy_traces_are_kept_at_the_sample_rate():
+    buffer = TailSamplingBuffer(sample_rate=0.5)
+
+    kept = 0
+    for _ in range(1_000):
+        trace_id = create_uuid()
+        buffer.add(trace_event(trace_id), b"trace", 5)
+        kept += len(buffer.complete(trace_id))
+
+    assert 400 < kept < 600
+
+
+def test_events_without_trace_pass_through():
+    buffer = TailSamplingBuffer()
+
+    assert buffer.add({"type": "sdk-log", "body": {"log": "x"}}, b"log", 3) == [b"log"]
+
+
+def test_budgets_decide_traces_early():
+    buffer = TailSamplingBuffer(max_trace_bytes=10, max_bytes=15)
+
+    # a single trace over its budget is kept
+    assert buffer.add(span_event("large"), b"x" * 11, 11) == [b"x" * 11]
+
+    # the oldest trace is decided to stay within the global budget
+    buffer.add(span_event("first", level="ERROR"), b"first", 8)
+    assert buffer.add(span_event("second"), b"second", 8) == [b"first"]
+    assert buffer.get_stats()["pending_traces"] == 1
+
+
+def test_traces_are_decided_after_the_decision_wait():
+    buffer = TailSamplingBuffer(decision_wait=30)
+
+    with patch("langfuse.tail_sampling.time.monotonic", return_value=0):
+        buffer.add(span_event("first", level="ERROR"), b"first", 5)
+
+    with patch("langfuse.tail_sampling.time.monotonic", return_value=31):
+        assert buffer.add(span_event("second"), b"second", 6) == [b"first"]
+
+
+def test_latency_includes_the_time_until_the_trace_is_complete():
+    buffer = TailSamplingBuffer(latency_threshold=5)
+
+    with patch("langfuse.tail_sampling.time.monotonic", return_value=0):
+        buffer.add(trace_event("slow"), b"slow", 4)
+        buffer.add(trace_event("fast"), b"fast", 4)
+
+    with patch("langfuse.tail_sampling.time.monotonic", return_value=1):
+        assert buffer.complete("fast") == []
+
+    with patch("langfuse.tail_sampling.time.monotonic", return_value=6):
+        assert buffer.complete("slow") == [b"slow"]
+
+
+@pytest.mark.parametrize("deferred", [False, True])
+def test_slow_decorated_root_is_kept(deferred):
+    langfuse = langfuse_context.configure(
+        tail_sampling=True, tail_sampling_latency_threshold=0.1
+    )
+
+    @observe(deferred=deferred)
+    def main(seconds: float):
+        time.sleep(seconds)
+
+    try:
+        main(0)
+        main(0.3)
+        stats = langfuse.get_stats()["tail_sampling"]
+        assert stats["kept_traces"] == 1
+        assert stats["discarded_traces"] == 1
+    finally:
+        LangfuseSingleton().reset()
+
+
+def test_client_sends_only_kept_traces():
+    langfuse = Langfuse(tail_sampling=True)
+
+    healthy = langfuse.trace(name="healthy")
+    healthy.span(name="span").end()
+    langfuse.end_trace(healthy.id)
+
+    failed = langfuse.trace(name="failed")
+    failed.span(name="span").end(level="ERROR")
+    langfuse.end_trace(failed.id)
+
+    stats = langfuse.get_stats()
+    assert stats["enqueued"] == 3
+    assert stats["tail_sampling"]["discarded_events"] == 3
+
+
+def test_expired_traces_are_decided_without_new_events():
+    langfuse = Langfuse(
+        tail_sampling=True,
+        tail_sampling_tags=["keep"],
+        tail_sampling_decision_wait=0.1,
+    )
+
+    langfuse.trace(name="tagged", tags=["keep"])
+    assert langfuse.get_stats()["enqueued"] == 0
+
+    time.sleep(0.5)
+    assert langfuse.get_stats()["enqueued"] == 1
+
+
+def test_flush_callbacks_run_before_traces_are_decided():
+    langfuse = Langfuse(tail_sampling=True, tail_sampling_decision_wait=0.1)
+    flushed = []
+    langfuse.task_manager.add_flush_callback(flushed.append)
+
+    trace = langfuse.trace(name="expiring")
+    langfuse.end_trace("unknown")
+    assert flushed == ["unknown"]
+
+    time.sleep(0.5)
+    assert flushed == ["unknown", trace.id]
+
+    langfuse.flush()
+    assert flushed == ["unknown", trace.id, None]
+
+
+def test_flush_decides_buffered_traces():
+    langfuse = Langfuse(tail_sampling=True, tail_sampling_tags=["keep"])
+
+    langfuse.trace(name="tagged", tags=["keep"])
+    assert langfuse.get_stats()["enqueued"] == 0
+
+    langfuse.task_manager._release_tail_sampled()
+    assert langfuse.get_stats()["enqueued"] == 1
+
+
+def test_decorated_traces_are_decided_when_the_outermost_function_returns():
+    langfuse = langfuse_context.configure(tail_sampling=True)
+
+    @observe()
+    def step(fail: bool):
+        if fail:
+            langfuse_context.update_current_observation(level="ERROR")
+
+    @observe()
+    def main(fail: bool):
+        step(fail)
+
+    try:
+        main(False)
+        assert langfuse.get_stats()["enqueued"] == 0
+
+        main(True)
+        stats = langfuse.get_stats()
+        assert stats["enqueued"] == 4
+        assert stats["tail_sampling"]["pending_traces"] == 0
+    finally:
+        LangfuseSingleton().reset()
+
+
+def test_tail_sampling_from_environment(monkeypatch):
+    monkeypatch.setenv("LANGFUSE_TAIL_SAMPLING", "True")
+    monkeypatch.setenv("LANGFUSE_TAIL_SAMPLING_RATE", "1")
+    LangfuseSingleton().reset()
+
+    @observe()
+    def main():
+        pass
+
+    try:
+        main()
+        stats = LangfuseSingleton().get().get_stats()["tail_sampling"]
+        assert stats["kept_traces"] == 1
+    finally:
+        LangfuseSingleton().reset()
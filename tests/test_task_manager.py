@@ -1,6 +1,10 @@
+import gzip
+import json
 import logging
 import subprocess
 import threading
+import time
+from unittest.mock import patch
 from urllib.parse import urlparse, urlunparse
 import httpx
 
@@ -9,7 +13,15 @@ from pytest_httpserver import HTTPServer
 from werkzeug.wrappers import Request, Response
 
 from langfuse.request import LangfuseClient
-from langfuse.task_manager import TaskManager
+from langfuse.serializer import EventSerializer
+from langfuse.spill_queue import SpillQueue
+from langfuse.task_manager import (
+    BATCH_SIZE_LIMIT,
+    AdaptiveBatchPolicy,
+    Consumer,
+    DropCounter,
+    TaskManager,
+)
 
 logging.basicConfig()
 log = logging.getLogger("langfuse")
@@ -34,6 +46,15 @@ def get_host(url):
     return new_url
 
 
+@pytest.fixture
+def threaded_httpserver():
+    server = HTTPServer(threaded=True)
+    server.start()
+    yield server
+    server.clear()
+    server.stop()
+
+
 @pytest.mark.timeout(10)
 def test_multiple_tasks_without_predecessor(httpserver: HTTPServer):
     failed = False
@@ -335,3 +356,677 @@ def test_large_events(httpserver: HTTPServer):
     # Make sure that the client queue is empty after flushing
     assert tm._queue.empty()
     assert not failed
+
+
+@pytest.mark.timeout(10)
+def test_events_are_encoded_once(httpserver: HTTPServer, monkeypatch):
+    encoded_events = []
+    original_encode = EventSerializer.encode
+
+    def counting_encode(self, obj):
+        if isinstance(obj, dict) and obj.get("foo") == "bar":
+            encoded_events.append(obj)
+        return original_encode(self, obj)
+
+    monkeypatch.setattr(EventSerializer, "encode", counting_encode)
+    # count encodings on the stdlib path
+    monkeypatch.setattr("langfuse.serializer.orjson", None)
+
+    batches = []
+
+    def handler(request: Request):
+        batches.append(request.json)
+        return Response(status=200)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    langfuse_client = setup_langfuse_client(
+        get_host(httpserver.url_for("/api/public/ingestion"))
+    )
+
+    tm = TaskManager(
+        langfuse_client, 10, 0.1, 3, 1, 10_000, "test-sdk", "1.0.0", "default"
+    )
+
+    tm.add_task({"foo": "bar"})
+    tm.add_task({"foo": "bar"})
+    tm.add_task({"foo": "bar"})
+    tm.flush()
+
+    assert len(encoded_events) == 3
+    uploaded = [item for batch in batches for item in batch["batch"]]
+    assert len(uploaded) == 3
+    assert all(item["foo"] == "bar" and "timestamp" in item for item in uploaded)
+    assert all(
+        batch["metadata"]["batch_size"] == len(batch["batch"]) for batch in batches
+    )
+
+
+def test_encode_body_splices_pre_encoded_batch():
+    body = LangfuseClient._encode_body(
+        {"batch": [b'{"foo": "bar"}', b'{"foo": "baz"}'], "metadata": {"batch_size": 2}}
+    )
+
+    assert json.loads(body) == {
+        "batch": [{"foo": "bar"}, {"foo": "baz"}],
+        "metadata": {"batch_size": 2},
+    }
+
+
+@pytest.mark.timeout(10)
+def test_deferred_serialization(httpserver: HTTPServer):
+    batches = []
+
+    def handler(request: Request):
+        batches.append(request.json)
+        return Response(status=200)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    langfuse_client = setup_langfuse_client(
+        get_host(httpserver.url_for("/api/public/ingestion"))
+    )
+
+    tm = TaskManager(
+        langfuse_client,
+        10,
+        0.1,
+        3,
+        1,
+        10_000,
+        "test-sdk",
+        "1.0.0",
+        "default",
+        defer_serialization=True,
+    )
+
+    class Message:
+        def __init__(self, content):
+            self.content = content
+
+    message = Message("first")
+    body = {"input": ["first"], "message": message}
+    assert tm.add_task({"foo": "bar", "body": body}) is True
+    # mutations after add_task must not leak into the queued event, also not of objects in it
+    body["input"].append("second")
+    message.content = "second"
+
+    class Unserializable:
+        def __getattribute__(self, name):
+            raise RuntimeError("cannot serialize")
+
+    assert tm.add_task({"foo": Unserializable()}) is False
+    tm.flush()
+
+    uploaded = [item for batch in batches for item in batch["batch"]]
+    assert len(uploaded) == 1
+    assert uploaded[0]["body"] == {"input": ["first"], "message": {"content": "first"}}
+    assert tm.get_dropped_count(DropCounter.SERIALIZATION_ERROR) == 1
+    assert tm.get_dropped_count() == 1
+
+
+@pytest.mark.timeout(10)
+@pytest.mark.parametrize(
+    "compression, min_size, expected_encoding",
+    [("gzip", 0, "gzip"), ("gzip", 1_000_000, None), (None, 0, None)],
+)
+def test_compressed_batches(
+    httpserver: HTTPServer, compression, min_size, expected_encoding
+):
+    batches = []
+    encodings = []
+
+    def handler(request: Request):
+        encoding = request.headers.get("Content-Encoding")
+        encodings.append(encoding)
+        data = request.get_data()
+        if encoding == "gzip":
+            data = gzip.decompress(data)
+        batches.append(json.loads(data))
+        return Response(status=200)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    langfuse_client = LangfuseClient(
+        "public_key",
+        "secret_key",
+        get_host(httpserver.url_for("/api/public/ingestion")),
+        "1.0.0",
+        15,
+        httpx.Client(),
+        compression=compression,
+        compression_min_size=min_size,
+    )
+
+    tm = TaskManager(
+        langfuse_client, 10, 0.1, 3, 1, 10_000, "test-sdk", "1.0.0", "default"
+    )
+
+    for _ in range(3):
+        tm.add_task({"foo": "bar" * 1000})
+    tm.flush()
+
+    uploaded = [item for batch in batches for item in batch["batch"]]
+    assert len(uploaded) == 3
+    assert all(item["foo"] == "bar" * 1000 for item in uploaded)
+    assert all(encoding == expected_encoding for encoding in encodings)
+
+
+@pytest.mark.timeout(10)
+def test_retries_reuse_the_compressed_body(httpserver: HTTPServer):
+    bodies = []
+
+    def handler(request: Request):
+        bodies.append(request.get_data())
+        return Response(status=500)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    langfuse_client = LangfuseClient(
+        "public_key",
+        "secret_key",
+        get_host(httpserver.url_for("/api/public/ingestion")),
+        "1.0.0",
+        15,
+        httpx.Client(),
+        compression="gzip",
+        compression_min_size=0,
+    )
+
+    tm = TaskManager(
+        langfuse_client, 10, 0.1, 3, 1, 10_000, "test-sdk", "1.0.0", "default"
+    )
+
+    with patch.object(
+        langfuse_client, "_compress", wraps=langfuse_client._compress
+    ) as compress:
+        tm.add_task({"foo": "bar"})
+        tm.flush()
+
+    assert compress.call_count == 1
+    assert len(bodies) == 3
+    assert bodies[0] == bodies[1] == bodies[2]
+
+
+def test_zstd_compression():
+    zstandard = pytest.importorskip("zstandard")
+
+    langfuse_client = LangfuseClient(
+        "public_key",
+        "secret_key",
+        "http://localhost:3000",
+        "1.0.0",
+        15,
+        httpx.Client(),
+        compression="zstd",
+        compression_min_size=0,
+    )
+
+    data, encoding = langfuse_client._compress(b'{"batch": []}')
+
+    assert encoding == "zstd"
+    assert zstandard.ZstdDecompressor().decompress(data) == b'{"batch": []}'
+
+
+def test_zstd_compression_falls_back_to_gzip(monkeypatch):
+    monkeypatch.setattr("langfuse.request.zstandard", None)
+
+    langfuse_client = LangfuseClient(
+        "public_key",
+        "secret_key",
+        "http://localhost:3000",
+        "1.0.0",
+        15,
+        httpx.Client(),
+        compression="zstd",
+        compression_min_size=0,
+    )
+
+    data, encoding = langfuse_client._compress(b'{"batch": []}')
+
+    assert encoding == "gzip"
+    assert gzip.decompress(data) == b'{"batch": []}'
+
+
+@pytest.mark.timeout(20)
+def test_in_flight_batches_are_bounded(threaded_httpserver: HTTPServer):
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+    uploaded = 0
+
+    def handler(request: Request):
+        nonlocal in_flight, max_in_flight, uploaded
+        with lock:
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+        time.sleep(0.2)
+        with lock:
+            in_flight -= 1
+            uploaded += len(request.json["batch"])
+        return Response(status=200)
+
+    threaded_httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    langfuse_client = setup_langfuse_client(
+        get_host(threaded_httpserver.url_for("/api/public/ingestion"))
+    )
+
+    tm = TaskManager(
+        langfuse_client,
+        1,
+        0.1,
+        3,
+        1,
+        10_000,
+        "test-sdk",
+        "1.0.0",
+        "default",
+        max_in_flight_batches=3,
+    )
+
+    for _ in range(12):
+        tm.add_task({"foo": "bar"})
+    tm.flush()
+
+    assert uploaded == 12
+    assert 1 < max_in_flight <= 3
+
+    tm.shutdown()
+    assert not any(c.is_alive() for c in tm._consumers)
+
+
+def test_adaptive_batch_policy_grows_under_backlog():
+    policy = AdaptiveBatchPolicy(10, 0.5, max_flush_at=40)
+
+    policy.record_batch(10, 100)
+    assert policy.get_settings() == (20, 0.5)
+
+    policy.record_batch(20, 200)
+    policy.record_batch(40, 300)
+    assert policy.get_settings() == (40, 0.5)
+
+
+def test_adaptive_batch_policy_grows_interval_for_slow_uploads():
+    policy = AdaptiveBatchPolicy(10, 0.5)
+
+    policy.record_upload(10.0)
+    policy.record_batch(10, 0)
+    assert policy.get_settings() == (20, 1.0)
+
+    policy.record_batch(20, 0)
+    policy.record_batch(20, 0)
+    assert policy.get_settings() == (80, 4.0)
+
+    # capped at 8 times the configured interval
+    policy.record_batch(80, 0)
+    assert policy.get_settings()[1] == 4.0
+
+
+def test_adaptive_batch_policy_shrinks_under_light_load():
+    policy = AdaptiveBatchPolicy(10, 0.5)
+    policy.record_upload(2.0)
+    policy.record_batch(10, 0)
+    policy.record_batch(20, 0)
+    assert policy.get_settings() == (40, 2.0)
+
+    for _ in range(10):
+        policy.record_upload(0.01)
+    policy.record_batch(3, 0)
+    assert policy.get_settings() == (20, 1.0)
+
+    for _ in range(5):
+        policy.record_batch(1, 0)
+    assert policy.get_settings() == (10, 0.5)
+
+
+@pytest.mark.timeout(20)
+def test_adaptive_batching(httpserver: HTTPServer):
+    batches = []
+
+    def handler(request: Request):
+        batches.append(request.json["batch"])
+        return Response(status=200)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    langfuse_client = setup_langfuse_client(
+        get_host(httpserver.url_for("/api/public/ingestion"))
+    )
+
+    tm = TaskManager(
+        langfuse_client,
+        10,
+        0.1,
+        3,
+        1,
+        10_000,
+        "test-sdk",
+        "1.0.0",
+        "default",
+        adaptive_batching=True,
+    )
+
+    for _ in range(500):
+        tm.add_task({"foo": "bar"})
+    tm.flush()
+
+    assert sum(len(batch) for batch in batches) == 500
+    assert max(len(batch) for batch in batches) > 10
+
+    stats = tm.get_stats()
+    assert stats["consumers"][0]["adaptive"] is True
+    assert stats["dropped"] == {}
+
+    tm.shutdown()
+
+
+@pytest.mark.timeout(20)
+def test_spill_to_disk_and_replay(httpserver: HTTPServer, tmp_path):
+    status = 500
+    uploaded = []
+
+    def handler(request: Request):
+        if status == 200:
+            uploaded.extend(request.json["batch"])
+        return Response(status=status)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    def create_task_manager():
+        return TaskManager(
+            setup_langfuse_client(
+                get_host(httpserver.url_for("/api/public/ingestion"))
+            ),
+            10,
+            0.1,
+            1,
+            1,
+            10_000,
+            "test-sdk",
+            "1.0.0",
+            "default",
+            max_task_queue_size=5,
+            spill_dir=str(tmp_path),
+        )
+
+    tm = create_task_manager()
+    # more events than the queue holds, nothing is dropped
+    for i in range(20):
+        tm.add_task({"id": i})
+    tm.flush()
+    tm.shutdown()
+
+    assert tm.get_dropped_count() == 0
+    assert tm.get_stats()["spill"]["bytes"] > 0
+
+    # the next process uploads the events once the API is available again
+    status = 200
+    tm = create_task_manager()
+    tm.flush()
+    tm.shutdown()
+
+    assert sorted(event["id"] for event in uploaded) == list(range(20))
+    assert tm.get_stats()["spill"] == {"bytes": 0, "segments": 0, "dropped_records": 0}
+
+
+def test_spill_does_not_count_dropped_events_as_enqueued(tmp_path):
+    # no consumer threads, the queue stays full
+    tm = TaskManager(
+        setup_langfuse_client("http://localhost:1"),
+        10,
+        0.1,
+        1,
+        0,
+        "public_key",
+        "test-sdk",
+        "1.0.0",
+        "default",
+        max_task_queue_size=1,
+        spill_dir=str(tmp_path),
+    )
+
+    assert tm.add_task({"id": "queued"}) is True
+    assert tm.add_task({"id": "spilled"}) is True
+    assert tm.add_task({"id": "oversize", "body": "x" * 1_000_000}) is False
+
+    assert tm.get_stats()["enqueued"] == 2
+    assert tm.get_dropped_count("oversize") == 1
+    assert tm.get_dropped_count("queue_full") == 0
+
+
+@pytest.mark.timeout(30)
+def test_spilled_events_are_retried_without_restart(httpserver: HTTPServer, tmp_path):
+    status = 500
+    uploaded = []
+
+    def handler(request: Request):
+        if status == 200:
+            uploaded.extend(request.json["batch"])
+        return Response(status=status)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    tm = TaskManager(
+        setup_langfuse_client(get_host(httpserver.url_for("/api/public/ingestion"))),
+        10,
+        0.1,
+        1,
+        1,
+        10_000,
+        "test-sdk",
+        "1.0.0",
+        "default",
+        max_task_queue_size=5,
+        spill_dir=str(tmp_path),
+    )
+
+    for i in range(20):
+        tm.add_task({"id": i})
+    tm.flush()
+    assert tm.get_stats()["spill"]["bytes"] > 0
+
+    # the API recovers, the spilled events are uploaded by the running process
+    status = 200
+    while tm.get_stats()["spill"]["bytes"] > 0:
+        time.sleep(0.1)
+    tm.shutdown()
+
+    assert sorted(set(event["id"] for event in uploaded)) == list(range(20))
+
+
+@pytest.mark.timeout(20)
+def test_only_retryable_failures_are_spilled(httpserver: HTTPServer, tmp_path):
+    status = 207
+
+    def handler(request: Request):
+        if status != 207:
+            return Response(status=status)
+
+        # event 1 fails temporarily, event 2 is invalid and the others are accepted
+        errors = [
+            {"id": event["id"], "status": 500, "message": "error", "error": "error"}
+            if event["id"] == "1"
+            else {"id": event["id"], "status": 400, "message": "invalid", "error": ""}
+            for event in request.json["batch"]
+            if event["id"] in ("1", "2")
+        ]
+        return Response(json.dumps({"successes": [], "errors": errors}), status=207)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    def spill_events(events):
+        tm = TaskManager(
+            setup_langfuse_client(
+                get_host(httpserver.url_for("/api/public/ingestion"))
+            ),
+            10,
+            0.1,
+            1,
+            1,
+            10_000,
+            "test-sdk",
+            "1.0.0",
+            "default",
+            spill_dir=str(tmp_path),
+        )
+        for event in events:
+            tm.add_task(event)
+        tm.flush()
+        tm.shutdown()
+
+        spill = SpillQueue(str(tmp_path))
+        batch = spill.get_batch(10, BATCH_SIZE_LIMIT)
+        if batch is None:
+            return []
+
+        spill.ack(batch)
+        return [json.loads(item)["id"] for item in batch.items]
+
+    assert spill_events([{"id": str(i)} for i in range(4)]) == ["1"]
+
+    status = 400
+    assert spill_events([{"id": str(i)} for i in range(4)]) == []
+
+    status = 429
+    assert spill_events([{"id": str(i)} for i in range(4)]) == ["0", "1", "2", "3"]
+
+
+@pytest.mark.timeout(30)
+def test_spilled_batches_are_uploaded_by_the_upload_workers(
+    threaded_httpserver: HTTPServer, tmp_path, monkeypatch
+):
+    uploaded = []
+    threaded_httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(
+        lambda request: uploaded.extend(request.json["batch"]) or Response(status=200)
+    )
+
+    spill = SpillQueue(str(tmp_path))
+    for i in range(20):
+        spill.put(json.dumps({"id": i}).encode())
+    spill.close()
+
+    upload_threads = []
+    upload_spilled_batch = Consumer._upload_spilled_batch
+
+    def record_thread(self, spill_batch):
+        upload_threads.append(threading.current_thread())
+        upload_spilled_batch(self, spill_batch)
+
+    monkeypatch.setattr(Consumer, "_upload_spilled_batch", record_thread)
+
+    tm = TaskManager(
+        setup_langfuse_client(
+            get_host(threaded_httpserver.url_for("/api/public/ingestion"))
+        ),
+        5,
+        0.1,
+        1,
+        1,
+        10_000,
+        "test-sdk",
+        "1.0.0",
+        "default",
+        max_in_flight_batches=2,
+        spill_dir=str(tmp_path),
+    )
+
+    while tm.get_stats()["spill"]["bytes"] > 0:
+        time.sleep(0.1)
+    tm.shutdown()
+
+    assert sorted(event["id"] for event in uploaded) == list(range(20))
+    # the consumer thread only collects batches
+    assert upload_threads
+    assert not any(isinstance(thread, Consumer) for thread in upload_threads)
+
+
+@pytest.mark.timeout(20)
+def test_ingestion_stats(httpserver: HTTPServer):
+    attempts = 0
+
+    def handler(request: Request):
+        nonlocal attempts
+        attempts += 1
+        if attempts == 1:
+            return Response(status=500)
+        if attempts == 2:
+            return Response(
+                json.dumps(
+                    {
+                        "successes": [],
+                        "errors": [
+                            {
+                                "id": "1",
+                                "status": 400,
+                                "message": "invalid",
+                                "error": "invalid body",
+                            }
+                        ],
+                    }
+                ),
+                status=207,
+            )
+        return Response(status=200)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    reports = []
+    tm = TaskManager(
+        setup_langfuse_client(get_host(httpserver.url_for("/api/public/ingestion"))),
+        10,
+        0.1,
+        3,
+        1,
+        10_000,
+        "test-sdk",
+        "1.0.0",
+        "default",
+        stats_callback=reports.append,
+        stats_interval=60,
+    )
+
+    for _ in range(3):
+        tm.add_task({"foo": "bar"})
+    tm.flush()
+
+    stats = tm.get_stats()
+    assert stats["enqueued"] == 3
+    assert stats["uploaded_events"] == 3
+    assert stats["uploaded_batches"] == 1
+    assert stats["bytes_sent"] > 0
+    assert stats["retries"] == 2
+    assert stats["partial_errors"] == 1
+    assert stats["failed_batches"] == 0
+    assert stats["queue_depth"] == 0
+    assert stats["batch_size"]["count"] == 1
+    assert stats["batch_size"]["buckets"]["1"] == 0
+    assert stats["batch_size"]["buckets"]["5"] == 1
+    assert stats["batch_size"]["buckets"]["+Inf"] == 1
+    assert stats["upload_latency"]["count"] == 1
+
+    # the final stats are reported on shutdown
+    tm.shutdown()
+    assert reports[-1]["uploaded_events"] == 3